@@ -0,0 +1,102 @@
+"""Startup and first requests served from the directory against its bundle.
+
+Generates a tree of --files small files in nested directories, packs it
+with `main.py pack` and starts the server on each. Prints how long the
+server took to listen, how long one keep-alive connection took to fetch
+--requests distinct files that no worker cache has seen yet, and the
+server's memory use afterwards.
+
+    python bench/bundle.py [--files 20000] [--requests 2000]
+"""
+import os
+import sys
+import gzip
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import http.client
+from pathlib import Path
+
+import yaml
+
+import run
+
+
+def build_tree(static: Path, files: int) -> list[str]:
+    # a hundred files per directory, every tenth with a gzip sidecar
+    paths = []
+    for index in range(files):
+        directory = static / f"d{index // 10000}" / f"d{index // 100 % 100}"
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"f{index}.html"
+        content = f"<!doctype html><p>file {index}</p>\n" * (1 + index % 40)
+        (directory / name).write_text(content)
+        if index % 10 == 0:
+            (directory / (name + ".gz")).write_bytes(gzip.compress(content.encode(), mtime=0))
+        paths.append("/" + str((directory / name).relative_to(static)))
+    return paths
+
+
+def measure(config: Path, port: int, paths: list[str]) -> dict:
+    started = time.monotonic()
+    server = run.start_server(config, port)
+    try:
+        listening = time.monotonic() - started
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        errors = 0
+        started = time.monotonic()
+        for path in paths:
+            connection.request("GET", path, headers={"Accept-Encoding": "gzip"})
+            response = connection.getresponse()
+            response.read()
+            errors += response.status != 200
+        fetched = time.monotonic() - started
+        connection.close()
+        rss = run.rss_bytes(run.process_tree(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+    return {"listening": listening, "fetched": fetched, "errors": errors, "rss": rss}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="severt-bundle-") as directory:
+        directory = Path(directory)
+        paths = build_tree(directory / "static", args.files)
+        port = run.free_port()
+        config = run.write_config(directory, port, 1, "selectors")
+        settings = yaml.safe_load(config.read_text())
+        settings["location"]["bundle"] = str(directory / "static.bundle")
+        bundled = directory / "bundle.yml"
+        bundled.write_text(yaml.safe_dump(settings))
+        started = time.monotonic()
+        subprocess.run(
+            [sys.executable, "main.py", "pack"],
+            cwd=run.ROOT / "src",
+            env={**os.environ, "SEVERT_CONFIG": str(bundled)},
+            check=True,
+        )
+        print(f"--- packed in {time.monotonic() - started:.2f}s, "
+              f"{os.path.getsize(directory / 'static.bundle') / 1e6:.1f} MB", flush=True)
+        sample = random.Random(0).sample(paths, min(args.requests, len(paths)))
+        for name, path in (("directory", config), ("bundle", bundled)):
+            rows.append({"serving": name, **measure(path, port, sample)})
+
+    print(f"\n{'serving':<10} {'listening s':>11} {'fetch s':>8} {'req/s':>8} {'RSS MB':>7} {'errors':>6}")
+    for row in rows:
+        print(
+            f"{row['serving']:<10} {row['listening']:>11.2f} {row['fetched']:>8.2f} "
+            f"{len(sample) / row['fetched']:>8.0f} {row['rss'] / 1e6:>7.1f} {row['errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
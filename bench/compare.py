@@ -0,0 +1,69 @@
+"""Compares two bench/run.py result files level by level.
+
+Throughput that drops, or p99 latency that grows, by more than the
+threshold is a regression and makes the exit code 1.
+
+    python bench/compare.py BASELINE CURRENT [--threshold 0.10]
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+
+
+def error_rate_failures(results: dict, max_error_rate: float) -> list[str]:
+    return [
+        f"c={run['concurrency']} error rate {run['error_rate']:.2%} is above {max_error_rate:.2%}"
+        for run in results["runs"]
+        if run["error_rate"] > max_error_rate
+    ]
+
+
+def changes(baseline: dict, current: dict) -> list[tuple[int, str, float, float]]:
+    # only levels present in both runs can be compared
+    before = {run["concurrency"]: run for run in baseline["runs"]}
+    rows = []
+    for run in current["runs"]:
+        if (old := before.get(run["concurrency"])) is None:
+            continue
+        rows.append((run["concurrency"], "rps", old["rps"], run["rps"]))
+        rows.append((run["concurrency"], "p99_ms", old["latency_ms"]["p99"], run["latency_ms"]["p99"]))
+    return rows
+
+
+def regressions(baseline: dict, current: dict, threshold: float) -> list[str]:
+    failures = []
+    for concurrency, metric, old, new in changes(baseline, current):
+        if not old:
+            continue
+        change = (new - old) / old
+        # less throughput or more latency is worse
+        worse = -change if metric == "rps" else change
+        if worse > threshold:
+            failures.append(
+                f"c={concurrency} {metric} {old:g} -> {new:g} ({change:+.1%}, threshold {threshold:.0%})"
+            )
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+    baseline = json.loads(args.baseline.read_text())
+    current = json.loads(args.current.read_text())
+    label = lambda results: f"{results['commit']} ({results['settings'].get('engine', 'selectors')})"
+    print(f"{label(baseline)} -> {label(current)}")
+    for concurrency, metric, old, new in changes(baseline, current):
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        print(f"c={concurrency:<5} {metric:<7} {old:>10g} {new:>10g}  {change}")
+    failures = regressions(baseline, current, args.threshold)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
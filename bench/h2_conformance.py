@@ -0,0 +1,443 @@
+"""HTTP/2 conformance checks in the style of h2spec.
+
+Starts the server with HTTP/2 enabled, then runs h2spec against it when
+it is on the PATH, and otherwise the checks below, which send raw frames
+and look at what comes back. Each check names the section of RFC 9113
+(or RFC 7541 for HPACK) it covers.
+
+    python bench/h2_conformance.py [--h2spec PATH]
+"""
+import sys
+import time
+import shutil
+import socket
+import struct
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import hpack
+
+import run
+
+PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+
+# frame types, flags, error codes and settings, RFC 9113 sections 6, 7 and 6.5.2
+DATA, HEADERS, RST_STREAM, SETTINGS, PING, GOAWAY, WINDOW_UPDATE = 0x0, 0x1, 0x3, 0x4, 0x6, 0x7, 0x8
+END_STREAM = ACK = 0x1
+END_HEADERS = 0x4
+
+NO_ERROR, PROTOCOL_ERROR, FLOW_CONTROL_ERROR = 0x0, 0x1, 0x3
+FRAME_SIZE_ERROR, COMPRESSION_ERROR = 0x6, 0x9
+
+INITIAL_WINDOW_SIZE, MAX_FRAME_SIZE = 0x4, 0x5
+BIG_SIZE = 1024 * 1024
+
+
+class Failed(Exception):
+    pass
+
+
+def frame(kind: int, flags: int, stream_id: int, payload: bytes = b"") -> bytes:
+    return len(payload).to_bytes(3, "big") + bytes((kind, flags)) + struct.pack(">I", stream_id) + payload
+
+
+def settings(**values) -> bytes:
+    codes = {"initial_window_size": INITIAL_WINDOW_SIZE, "max_frame_size": MAX_FRAME_SIZE}
+    payload = b"".join(struct.pack(">HI", codes[name], value) for name, value in values.items())
+    return frame(SETTINGS, 0, 0, payload)
+
+
+class Client:
+    """One connection that sends frames as given and reads what comes back."""
+
+    def __init__(
+        self, port: int = 0, preface: bytes = PREFACE, sock: socket.socket | None = None, **values
+    ) -> None:
+        # an upgraded connection passes its socket
+        self.sock = sock or socket.create_connection(("127.0.0.1", port), timeout=2)
+        self.encoder = hpack.Encoder()
+        self.decoder = hpack.Decoder()
+        self._buffer = b""
+        # header fields and body bytes of every response read so far, by stream
+        self.headers: dict[int, dict] = {}
+        self.sizes: dict[int, int] = {}
+        self.ended: set[int] = set()
+        # read DATA is given back to the windows right away
+        self.acknowledge = True
+        self.send(preface + settings(**values))
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.sock.close()
+
+    def send(self, data: bytes) -> None:
+        self.sock.sendall(data)
+
+    def request(self, stream_id: int, path: str = "/index.html", method: str = "GET", extra=()) -> None:
+        fields = [
+            (":method", method), (":scheme", "http"), (":path", path), (":authority", "localhost"), *extra
+        ]
+        self.send(frame(HEADERS, END_HEADERS | END_STREAM, stream_id, self.encoder.encode(fields)))
+
+    def window_update(self, stream_id: int, size: int) -> None:
+        # gives back what was read on the stream and the connection
+        increment = struct.pack(">I", size)
+        self.send(frame(WINDOW_UPDATE, 0, 0, increment) + frame(WINDOW_UPDATE, 0, stream_id, increment))
+
+    def read(self) -> tuple[int, int, int, bytes] | None:
+        # the next frame, None once the server closed the connection
+        while len(self._buffer) < 9 or len(self._buffer) < 9 + int.from_bytes(self._buffer[:3], "big"):
+            try:
+                data = self.sock.recv(65536)
+            except ConnectionResetError:
+                data = b""
+            if not data:
+                return None
+            self._buffer += data
+        length = int.from_bytes(self._buffer[:3], "big")
+        kind, flags = self._buffer[3], self._buffer[4]
+        stream_id = struct.unpack(">I", self._buffer[5:9])[0] & 0x7FFFFFFF
+        payload = self._buffer[9:9 + length]
+        self._buffer = self._buffer[9 + length:]
+        # every header block goes through the decoder, skipping one would break
+        # the dynamic table for the ones after it
+        if kind == HEADERS:
+            fields = self.decoder.decode(payload, raw=True)
+            self.headers[stream_id] = {name.decode(): value.decode() for name, value in fields}
+        elif kind == DATA and payload:
+            self.sizes[stream_id] = self.sizes.get(stream_id, 0) + len(payload)
+            if self.acknowledge:
+                self.window_update(stream_id, len(payload))
+        if kind in (HEADERS, DATA) and flags & END_STREAM:
+            self.ended.add(stream_id)
+        return kind, flags, stream_id, payload
+
+    def expect(self, match, what: str):
+        # reads until a frame satisfies match, DATA is acknowledged along the way
+        while True:
+            try:
+                received = self.read()
+            except socket.timeout:
+                raise Failed(f"timed out waiting for {what}")
+            if received is None:
+                raise Failed(f"connection closed before {what}")
+            if match(*received):
+                return received
+
+    def expect_error(self, codes: tuple[int, ...], stream_id: int | None = None) -> None:
+        # a GOAWAY with one of the codes, or an RST_STREAM on the stream when that's allowed,
+        # a closed connection after a GOAWAY counts as well
+        while True:
+            try:
+                received = self.read()
+            except socket.timeout:
+                raise Failed(f"timed out waiting for error {codes}")
+            if received is None:
+                raise Failed(f"connection closed without GOAWAY {codes}")
+            kind, flags, sid, payload = received
+            if kind == GOAWAY:
+                code = struct.unpack(">I", payload[4:8])[0]
+                if code not in codes:
+                    raise Failed(f"GOAWAY with error {code:#x}, expected {codes}")
+                return
+            if kind == RST_STREAM and stream_id is not None and sid == stream_id:
+                code = struct.unpack(">I", payload)[0]
+                if code not in codes:
+                    raise Failed(f"RST_STREAM with error {code:#x}, expected {codes}")
+                return
+
+    def response(self, stream_id: int) -> tuple[dict, int]:
+        # the header fields and body size of the response on stream_id
+        while stream_id not in self.ended:
+            kind, _, _, _ = self.expect(
+                lambda k, f, s, p: s == stream_id and k in (HEADERS, DATA, RST_STREAM),
+                f"stream {stream_id}",
+            )
+            if kind == RST_STREAM:
+                raise Failed(f"stream {stream_id} was reset")
+        return self.headers[stream_id], self.sizes.get(stream_id, 0)
+
+
+CHECKS = []
+
+
+def check(section: str):
+    def register(function):
+        CHECKS.append((section, function.__doc__, function))
+        return function
+    return register
+
+
+@check("3.4")
+def server_preface(port: int) -> None:
+    """Sends a SETTINGS frame as its connection preface"""
+    with Client(port) as client:
+        kind, flags, stream_id, _ = client.read()
+        if kind != SETTINGS or flags & ACK or stream_id:
+            raise Failed(f"first frame was type {kind}")
+
+
+@check("3.4")
+def invalid_preface(port: int) -> None:
+    """Answers a broken connection preface with a PROTOCOL_ERROR"""
+    with Client(port, preface=b"PRI * HTTP/2.0\r\n\r\nXX\r\n\r\n") as client:
+        client.expect_error((PROTOCOL_ERROR,))
+
+
+@check("4.2")
+def frame_too_large(port: int) -> None:
+    """Answers a frame over SETTINGS_MAX_FRAME_SIZE with a FRAME_SIZE_ERROR"""
+    with Client(port) as client:
+        client.send(frame(DATA, 0, 1, b"\0" * 16385))
+        client.expect_error((FRAME_SIZE_ERROR,))
+
+
+@check("4.3")
+def broken_header_block(port: int) -> None:
+    """Answers a header block HPACK can't decode with a COMPRESSION_ERROR"""
+    with Client(port) as client:
+        # an indexed field with an index past the end of both tables
+        client.send(frame(HEADERS, END_HEADERS | END_STREAM, 1, b"\xff\x7f\xff\xff"))
+        client.expect_error((COMPRESSION_ERROR,))
+
+
+@check("5.1.1")
+def even_stream_id(port: int) -> None:
+    """Answers a request on a server-initiated (even) stream with a PROTOCOL_ERROR"""
+    with Client(port) as client:
+        client.request(2)
+        client.expect_error((PROTOCOL_ERROR,))
+
+
+@check("5.1")
+def multiplexing(port: int) -> None:
+    """Answers many requests sent at once on one connection"""
+    with Client(port) as client:
+        streams = range(1, 41, 2)
+        for stream_id in streams:
+            client.request(stream_id, "/big.bin" if stream_id % 4 == 1 else "/index.html")
+        for stream_id in streams:
+            headers, size = client.response(stream_id)
+            if headers.get(":status") != "200" or size != int(headers["content-length"]):
+                raise Failed(f"stream {stream_id}: {headers.get(':status')} with {size} bytes")
+
+
+@check("5.1")
+def interleaving(port: int) -> None:
+    """Interleaves the DATA frames of two large responses"""
+    with Client(port) as client:
+        client.request(1, "/big.bin")
+        client.request(3, "/big.bin")
+        order = []
+        while len(order) < 8:
+            _, _, stream_id, payload = client.expect(lambda k, f, s, p: k == DATA, "DATA")
+            order.append(stream_id)
+        if set(order) != {1, 3}:
+            raise Failed(f"DATA frames only on {set(order)}")
+
+
+@check("5.5")
+def unknown_frame(port: int) -> None:
+    """Ignores frames of an unknown type"""
+    with Client(port) as client:
+        client.send(frame(0x20, 0, 0, b"severt"))
+        client.request(1)
+        if client.response(1)[0].get(":status") != "200":
+            raise Failed("no response after the unknown frame")
+
+
+@check("6.4")
+def reset_stream(port: int) -> None:
+    """Stops a stream on RST_STREAM and keeps serving the connection"""
+    with Client(port) as client:
+        client.request(1, "/big.bin")
+        client.expect(lambda k, f, s, p: s == 1 and k == HEADERS, "headers of stream 1")
+        client.send(frame(RST_STREAM, 0, 1, struct.pack(">I", 0x8)))
+        client.request(3)
+        if client.response(3)[0].get(":status") != "200":
+            raise Failed("no response after RST_STREAM")
+
+
+@check("6.5")
+def settings_ack(port: int) -> None:
+    """Acknowledges the client's SETTINGS"""
+    with Client(port) as client:
+        client.expect(lambda k, f, s, p: k == SETTINGS and f & ACK, "SETTINGS with ACK")
+
+
+@check("6.5.2")
+def bad_window_setting(port: int) -> None:
+    """Answers SETTINGS_INITIAL_WINDOW_SIZE over 2^31-1 with a FLOW_CONTROL_ERROR"""
+    with Client(port) as client:
+        client.send(settings(initial_window_size=2**31))
+        client.expect_error((FLOW_CONTROL_ERROR,))
+
+
+@check("6.7")
+def ping(port: int) -> None:
+    """Answers PING with a PING ACK carrying the same payload"""
+    with Client(port) as client:
+        client.send(frame(PING, 0, 0, b"severt!!"))
+        _, _, _, payload = client.expect(lambda k, f, s, p: k == PING and f & ACK, "PING ACK")
+        if payload != b"severt!!":
+            raise Failed(f"PING ACK carried {payload!r}")
+
+
+@check("6.8")
+def goaway(port: int) -> None:
+    """Closes the connection after the client's GOAWAY"""
+    with Client(port) as client:
+        client.send(frame(GOAWAY, 0, 0, struct.pack(">II", 0, NO_ERROR)))
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            if client.read() is None:
+                return
+        raise Failed("connection still open")
+
+
+@check("6.9")
+def stream_window(port: int) -> None:
+    """Sends no more DATA than the stream's window until WINDOW_UPDATE"""
+    with Client(port, initial_window_size=1000) as client:
+        client.acknowledge = False
+        client.request(1, "/big.bin")
+        received = 0
+        while received < 1000:
+            _, _, _, payload = client.expect(lambda k, f, s, p: s == 1 and k == DATA, "DATA")
+            received += len(payload)
+        client.send(frame(PING, 0, 0, b"\0" * 8))
+        # anything the server had to send on stream 1 came before the PING ACK
+        while True:
+            kind, flags, stream_id, payload = client.expect(lambda k, f, s, p: True, "PING ACK")
+            if kind == PING and flags & ACK:
+                break
+            if kind == DATA and stream_id == 1:
+                received += len(payload)
+        if received != 1000:
+            raise Failed(f"{received} bytes sent on a 1000 byte window")
+        client.send(frame(WINDOW_UPDATE, 0, 1, struct.pack(">I", 500)))
+        _, _, _, payload = client.expect(lambda k, f, s, p: s == 1 and k == DATA, "DATA after WINDOW_UPDATE")
+        if len(payload) > 500:
+            raise Failed(f"{len(payload)} bytes sent after a 500 byte WINDOW_UPDATE")
+
+
+@check("6.9")
+def zero_window_update(port: int) -> None:
+    """Answers a WINDOW_UPDATE of 0 with a PROTOCOL_ERROR"""
+    with Client(port) as client:
+        client.send(frame(WINDOW_UPDATE, 0, 0, struct.pack(">I", 0)))
+        client.expect_error((PROTOCOL_ERROR,))
+
+
+@check("6.9.1")
+def window_overflow(port: int) -> None:
+    """Answers a connection window over 2^31-1 with a FLOW_CONTROL_ERROR"""
+    with Client(port) as client:
+        client.send(frame(WINDOW_UPDATE, 0, 0, struct.pack(">I", 2**31 - 1)))
+        client.expect_error((FLOW_CONTROL_ERROR,))
+
+
+@check("8.1.1")
+def uppercase_field(port: int) -> None:
+    """Treats a request with an uppercase field name as malformed"""
+    with Client(port) as client:
+        client.request(1, extra=[("X-Severt", "1")])
+        client.expect_error((PROTOCOL_ERROR,), stream_id=1)
+
+
+@check("8.3.1")
+def missing_path(port: int) -> None:
+    """Treats a request without :path as malformed"""
+    with Client(port) as client:
+        fields = client.encoder.encode([(":method", "GET"), (":scheme", "http"), (":authority", "localhost")])
+        client.send(frame(HEADERS, END_HEADERS | END_STREAM, 1, fields))
+        client.expect_error((PROTOCOL_ERROR,), stream_id=1)
+
+
+@check("8.1")
+def head_request(port: int) -> None:
+    """Ends a HEAD response with its HEADERS frame"""
+    with Client(port) as client:
+        client.request(1, method="HEAD")
+        _, flags, _, _ = client.expect(lambda k, f, s, p: s == 1 and k == HEADERS, "HEADERS")
+        if not flags & END_STREAM:
+            raise Failed("HEADERS without END_STREAM")
+
+
+@check("RFC 7541 2.3")
+def dynamic_table(port: int) -> None:
+    """Decodes header fields indexed from the dynamic table"""
+    with Client(port) as client:
+        extra = [("accept-language", "en")]
+        for stream_id in (1, 3, 5):
+            client.request(stream_id, extra=extra)
+            if client.response(stream_id)[0].get(":status") != "200":
+                raise Failed(f"stream {stream_id} failed")
+
+
+@check("RFC 7540 3.2")
+def h2c_upgrade(port: int) -> None:
+    """Switches to HTTP/2 on Upgrade: h2c and answers the request on stream 1"""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=2)
+    with sock:
+        sock.sendall(
+            b"GET /index.html HTTP/1.1\r\nHost: localhost\r\nConnection: Upgrade, HTTP2-Settings\r\n"
+            b"Upgrade: h2c\r\nHTTP2-Settings: AAMAAABkAAQAAP__\r\n\r\n"
+        )
+        head = b""
+        while b"\r\n\r\n" not in head:
+            head += sock.recv(1)
+        if not head.startswith(b"HTTP/1.1 101"):
+            raise Failed(f"answered {head.splitlines()[0]!r}")
+        client = Client(sock=sock)
+        headers, size = client.response(1)
+        if headers.get(":status") != "200" or size != int(headers["content-length"]):
+            raise Failed(f"stream 1: {headers.get(':status')} with {size} bytes")
+
+
+def run_checks(port: int) -> int:
+    failures = 0
+    for section, description, function in CHECKS:
+        try:
+            function(port)
+        except (Failed, OSError) as error:
+            failures += 1
+            print(f"  x {section:<14} {description}\n      {error}")
+        else:
+            print(f"  ok {section:<13} {description}")
+    print(f"\n{len(CHECKS)} checks, {len(CHECKS) - failures} passed, {failures} failed")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--h2spec", default=shutil.which("h2spec"), help="h2spec binary, found on the PATH by default"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="severt-h2-") as directory:
+        directory = Path(directory)
+        run.build_tree(directory / "static")
+        (directory / "static" / "big.bin").write_bytes(b"\0" * BIG_SIZE)
+        port = run.free_port()
+        server = run.start_server(run.write_config(directory, port, 1, "selectors"), port)
+        try:
+            if args.h2spec:
+                command = [args.h2spec, "-h", "127.0.0.1", "-p", str(port), "--path", "/index.html"]
+                failed = subprocess.run(command).returncode
+            else:
+                print("h2spec not found, running the built-in checks")
+                failed = run_checks(port)
+        finally:
+            server.terminate()
+            server.wait()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Per-request cost of building a cache-hit response header and validating
+the request headers, before and after the precompiled header templates.
+
+    python bench/headers_bench.py [--number N]
+"""
+import re
+import sys
+import timeit
+import argparse
+import importlib.util
+from pathlib import Path
+from datetime import datetime, timezone
+from http.client import HTTPMessage
+
+# util/headers.py only depends on the standard library, loading it by path
+# keeps the util package (and with it severt.yml) out of the benchmark
+spec = importlib.util.spec_from_file_location(
+    "headers", Path(__file__).resolve().parent.parent / "src" / "util" / "headers.py"
+)
+headers = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(headers)
+
+
+class Representation:
+    content_type = "text/css"
+    encoding = "gzip"
+    etag = '"12c0-18df72d6b69bb4b9"'
+    last_modified = "Sat, 17 Oct 2026 22:50:43 GMT"
+    content_headers = headers.content_headers(content_type, encoding)
+    cache_headers = headers.cache_headers(etag, last_modified, True)
+
+
+def request() -> HTTPMessage:
+    header = HTTPMessage()
+    for name, value in (
+        ("Host", "localhost:8000"),
+        ("User-Agent", "Mozilla/5.0 (X11; Linux x86_64; rv:131.0) Gecko/20100101 Firefox/131.0"),
+        ("Accept", "text/css,*/*;q=0.1"),
+        ("Accept-Language", "en-US,en;q=0.5"),
+        ("Accept-Encoding", "gzip, deflate, br, zstd"),
+        ("Connection", "keep-alive"),
+        ("Referer", "http://localhost:8000/"),
+        ("Sec-Fetch-Dest", "style"),
+        ("Sec-Fetch-Mode", "no-cors"),
+        ("Sec-Fetch-Site", "same-origin"),
+        ("Method", "GET"),
+        ("Location", "/style.css"),
+    ):
+        header[name] = value
+    return header
+
+
+def header_before(representation, content_length: int) -> bytes:
+    # WriteMessage._get_request before the templates
+    gmt_string = datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+    base_header = f"HTTP/1.1 200 OK\r\ncontent-type:{representation.content_type}\r\ncontent-encoding:{representation.encoding}\r\ndate:{gmt_string}\r\nCache-Control: public, max-age=3600, must-revalidate\r\n"
+    base_header += "Vary: Accept-Encoding\r\n"
+    base_header += f"ETag: {representation.etag}\r\nLast-Modified: {representation.last_modified}\r\n"
+    return str.encode(base_header + f"content-length:{content_length}\r\n\r\n")
+
+
+def header_after(representation, content_length: int) -> bytes:
+    date = headers.date_cache.get()
+    return headers.response_head(headers.STATUS_OK, representation, date, content_length)
+
+
+def validate_before(header) -> bool:
+    # WriteMessage._is_valid_headers before the single pass
+    if not header:
+        return False
+    if "host" not in header or not header.get("Host", "").strip():
+        return False
+    transfer_encoding = header.get("Transfer-encoding")
+    content_length = header.get("Content-length")
+    if content_length and transfer_encoding:
+        return False
+    if content_length:
+        if not content_length.isdigit() or int(content_length) <= 0:
+            return False
+    if transfer_encoding:
+        if transfer_encoding.lower() != "chunked":
+            return False
+    seen_headers = set()
+    for name in header.keys():
+        if name.lower() in seen_headers:
+            return False
+    seen_headers.add(name.lower())
+    for key, value in header.items():
+        if key.strip() != key or value.strip() != value:
+            return False
+        if not re.match(r"^[A-Za-z0-9-]+$", key):
+            return False
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200_000)
+    args = parser.parse_args()
+    representation = Representation()
+    header = request()
+    cases = [
+        ("response header", header_before, header_after, (representation, 4800)),
+        ("header validation", validate_before, headers.is_valid_request, (header,)),
+    ]
+    print(f"python {sys.version.split()[0]}, {args.number} iterations")
+    for name, before, after, call_args in cases:
+        timings = []
+        for function in (before, after):
+            seconds = min(
+                timeit.repeat(lambda: function(*call_args), number=args.number, repeat=5)
+            )
+            timings.append(seconds / args.number * 1e9)
+        print(
+            f"{name:<18} before {timings[0]:8.0f} ns  after {timings[1]:8.0f} ns  ({timings[0] / timings[1]:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Throughput of HTTP/2 against HTTP/1.1 keep-alive on the same static tree.
+
+Runs the bench/run.py tree with the same number of requests in flight
+over both protocols: HTTP/1.1 needs a connection per request, HTTP/2
+multiplexes --streams requests on each of --connections connections.
+Prints req/s, latency, transferred megabytes and the server's CPU use
+for each.
+
+    python bench/http2.py [--connections 1,10] [--streams 10] [--duration 10]
+"""
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import h2.config
+import h2.events
+import h2.exceptions
+import h2.connection
+
+import run
+import loadgen
+
+
+def request_fields(host: str, target: loadgen.Target, rng: random.Random) -> list[tuple[str, str]]:
+    # the HTTP/2 version of loadgen.build_request
+    fields = [
+        (":method", "GET"), (":scheme", "http"), (":authority", host), (":path", target.path),
+        ("accept", "*/*"), ("accept-encoding", "gzip"),
+    ]
+    if target.range_bytes:
+        start = rng.randrange(0, max(1, target.size - target.range_bytes))
+        fields.append(("range", f"bytes={start}-{start + target.range_bytes - 1}"))
+    return fields
+
+
+async def connection(
+    host: str,
+    port: int,
+    targets: list[loadgen.Target],
+    streams: int,
+    deadline: float,
+    timeout: float,
+    result: loadgen.Result,
+    seed: int,
+) -> None:
+    # keeps `streams` requests in flight on one connection until the deadline
+    rng = random.Random(seed)
+    weights = [target.weight for target in targets]
+    session = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True))
+    # stream id -> [started, status, bytes read]
+    in_flight: dict[int, list] = {}
+
+    def issue() -> None:
+        target = rng.choices(targets, weights)[0]
+        stream_id = session.get_next_available_stream_id()
+        session.send_headers(stream_id, request_fields(f"{host}:{port}", target, rng), end_stream=True)
+        in_flight[stream_id] = [time.perf_counter(), 0, 0]
+
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        result.failures += streams
+        return
+    result.connections += 1
+    session.initiate_connection()
+    for _ in range(streams):
+        issue()
+    writer.write(session.data_to_send())
+    try:
+        while in_flight:
+            data = await asyncio.wait_for(reader.read(65536), timeout)
+            if not data:
+                break
+            for event in session.receive_data(data):
+                if isinstance(event, h2.events.ResponseReceived):
+                    in_flight[event.stream_id][1] = int(dict(event.headers)[b":status"])
+                elif isinstance(event, h2.events.DataReceived):
+                    in_flight[event.stream_id][2] += len(event.data)
+                    session.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    started, status, size = in_flight.pop(event.stream_id)
+                    result.latencies.append(time.perf_counter() - started)
+                    result.statuses[status] = result.statuses.get(status, 0) + 1
+                    result.bytes_read += size
+                    if time.monotonic() < deadline:
+                        issue()
+                elif isinstance(event, h2.events.StreamReset):
+                    in_flight.pop(event.stream_id)
+                    result.failures += 1
+                    if time.monotonic() < deadline:
+                        issue()
+            writer.write(session.data_to_send())
+    except (OSError, asyncio.TimeoutError, h2.exceptions.ProtocolError):
+        pass
+    # whatever is still in flight got no response
+    result.failures += len(in_flight)
+    writer.close()
+
+
+async def drive(
+    url: str, targets: list[loadgen.Target], connections: int, streams: int, duration: float, timeout: float
+) -> loadgen.Result:
+    parts = urlsplit(url)
+    result = loadgen.Result()
+    deadline = time.monotonic() + duration
+    await asyncio.gather(
+        *(
+            connection(parts.hostname, parts.port or 80, targets, streams, deadline, timeout, result, index)
+            for index in range(connections)
+        )
+    )
+    return result
+
+
+def measure(protocol: str, url: str, targets, server_pids: list[int], args, connections: int) -> dict:
+    cpu_before = run.cpu_seconds(server_pids)
+    started = time.monotonic()
+    if protocol == "HTTP/2":
+        result = asyncio.run(drive(url, targets, connections, args.streams, args.duration, args.timeout))
+    else:
+        result = loadgen.run(url, targets, connections * args.streams, args.duration, timeout=args.timeout)
+    elapsed = time.monotonic() - started
+    ordered = sorted(result.latencies)
+    return {
+        "protocol": protocol,
+        "in_flight": connections * args.streams,
+        "connections": result.connections,
+        "rps": result.requests / elapsed,
+        "errors": result.errors,
+        "megabytes": result.bytes_read / 1e6,
+        "p50": loadgen.percentile(ordered, 0.5) * 1000,
+        "p99": loadgen.percentile(ordered, 0.99) * 1000,
+        "cpu": (run.cpu_seconds(server_pids) - cpu_before) / elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", default="1,10", help="comma separated HTTP/2 connection counts")
+    parser.add_argument("--streams", type=int, default=10, help="requests in flight per HTTP/2 connection")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=10)
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="severt-http2-") as directory:
+        directory = Path(directory)
+        targets = run.build_tree(directory / "static")
+        port = run.free_port()
+        server = run.start_server(run.write_config(directory, port, 1, "selectors"), port)
+        try:
+            server_pids = run.process_tree(server.pid)
+            url = f"http://127.0.0.1:{port}"
+            for connections in (int(count) for count in args.connections.split(",")):
+                for protocol in ("HTTP/1.1", "HTTP/2"):
+                    rows.append(measure(protocol, url, targets, server_pids, args, connections))
+                    print(f"--- {protocol} with {rows[-1]['in_flight']} requests in flight", flush=True)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(
+        f"\n{'protocol':<9} {'in flight':>9} {'conns':>6} {'req/s':>8} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'MB':>8} {'cpu':>5} {'errors':>6}"
+    )
+    for row in rows:
+        print(
+            f"{row['protocol']:<9} {row['in_flight']:>9} {row['connections']:>6} {row['rps']:>8.0f} "
+            f"{row['p50']:>8.2f} {row['p99']:>8.2f} {row['megabytes']:>8.1f} {row['cpu']:>5.2f} "
+            f"{row['errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
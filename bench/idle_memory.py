@@ -0,0 +1,63 @@
+"""Server memory held per idle keep-alive connection.
+
+Opens N connections, sends one request on each and leaves them open,
+then divides the growth of the server's resident memory by N.
+
+    python bench/idle_memory.py [--connections N] [--src PATH]
+"""
+import time
+import socket
+import argparse
+import resource
+import tempfile
+from pathlib import Path
+
+import run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--src", type=Path, default=run.ROOT / "src", help="server tree to measure")
+    args = parser.parse_args()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < args.connections + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(args.connections + 64, hard), hard))
+
+    with tempfile.TemporaryDirectory(prefix="severt-bench-") as directory:
+        directory = Path(directory)
+        run.build_tree(directory / "static")
+        port = run.free_port()
+        server = run.start_server(run.write_config(directory, port, 1, "selectors"), port, args.src)
+        connections = []
+        try:
+            request = f"GET / HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode()
+            # warm the cache and the interpreter so only per-connection state is left to grow
+            for _ in range(50):
+                with socket.create_connection(("127.0.0.1", port)) as sock:
+                    sock.sendall(request)
+                    sock.recv(65536)
+            time.sleep(0.5)
+            before = run.rss_bytes([server.pid])
+            for _ in range(args.connections):
+                sock = socket.create_connection(("127.0.0.1", port))
+                sock.sendall(request)
+                connections.append(sock)
+            for sock in connections:
+                # the whole response is well under one recv
+                sock.recv(65536)
+            time.sleep(0.5)
+            after = run.rss_bytes([server.pid])
+        finally:
+            for sock in connections:
+                sock.close()
+            server.terminate()
+            server.wait()
+    print(
+        f"{args.connections} idle connections: {(after - before) / 2**20:.1f} MB, "
+        f"{(after - before) / args.connections:.0f} bytes each"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmarks each listener setting against the defaults.
+
+Runs bench/run.py once with the default listener settings and once per
+variant below, new connections for every request unless --keep-alive is
+given, and prints each variant's throughput, latency and errors next to
+the defaults.
+
+    python bench/listener.py [--concurrency 100,1000] [--duration 10] [--keep-alive]
+"""
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+VARIANTS = {
+    "defaults": [],
+    "accept_batch=1": ["accept_batch=1"],
+    "backlog=16": ["backlog=16"],
+    "nodelay=false": ["nodelay=false"],
+    "defer_accept=1": ["defer_accept=1"],
+    "fastopen=256": ["fastopen=256"],
+    "buffers=64k": ["send_buffer=65536", "receive_buffer=65536"],
+    "max_connections=50": ["max_connections=50"],
+}
+
+
+def run_variant(name: str, settings: list[str], output: Path, args, extra: list[str]) -> dict:
+    command = [
+        sys.executable, str(ROOT / "bench" / "run.py"),
+        "--concurrency", args.concurrency,
+        "--duration", str(args.duration),
+        "--engine", args.engine,
+        "--output", str(output),
+        *extra,
+    ]
+    for setting in settings:
+        command += ["--listener", setting]
+    if not args.keep_alive:
+        command.append("--no-keep-alive")
+    print(f"--- {name}", flush=True)
+    # a variant over the error rate still saved its results, see max_connections
+    subprocess.run(command, check=False)
+    return json.loads(output.read_text())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="100,1000")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--engine", choices=("selectors", "asyncio"), default="selectors")
+    parser.add_argument("--keep-alive", action="store_true")
+    parser.add_argument("--output", type=Path, help="all results in one JSON file")
+    args, extra = parser.parse_known_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="severt-listener-") as directory:
+        for name, settings in VARIANTS.items():
+            output = Path(directory) / f"{len(results)}.json"
+            results[name] = run_variant(name, settings, output, args, extra)
+
+    defaults = {run["concurrency"]: run for run in results["defaults"]["runs"]}
+    print(f"\n{'setting':<20} {'c':>5} {'req/s':>9} {'vs default':>10} {'p99 ms':>9} {'errors':>8}")
+    for name, result in results.items():
+        for run in result["runs"]:
+            base = defaults[run["concurrency"]]
+            change = run["rps"] / base["rps"] - 1 if base["rps"] else 0
+            print(
+                f"{name:<20} {run['concurrency']:>5} {run['rps']:>9.0f} {change:>+10.1%} "
+                f"{run['latency_ms']['p99']:>9.2f} {run['error_rate']:>8.2%}"
+            )
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
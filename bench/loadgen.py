@@ -0,0 +1,231 @@
+"""Closed-loop HTTP/1.1 load generator on asyncio streams.
+
+Every connection sends one request, reads the whole response and sends
+the next, so the concurrency is the number of requests in flight.
+
+    python bench/loadgen.py http://127.0.0.1:8000 [--concurrency N] [--duration S]
+"""
+import time
+import random
+import asyncio
+import argparse
+import resource
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor
+
+
+@dataclass(frozen=True)
+class Target:
+    path: str
+    # relative share of the requests that go to this path
+    weight: int = 1
+    # size of the file, ranges are drawn inside it when range_bytes is set
+    size: int = 0
+    range_bytes: int = 0
+
+
+@dataclass
+class Result:
+    # seconds from writing a request to reading the last byte of its response
+    latencies: list[float] = field(default_factory=list)
+    # requests that got no response, refused or reset connections and timeouts
+    failures: int = 0
+    statuses: dict[int, int] = field(default_factory=dict)
+    bytes_read: int = 0
+    connections: int = 0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + self.failures
+
+    @property
+    def errors(self) -> int:
+        return self.failures + sum(
+            count for status, count in self.statuses.items() if status >= 400
+        )
+
+    def merge(self, other: "Result") -> None:
+        self.latencies += other.latencies
+        self.failures += other.failures
+        self.bytes_read += other.bytes_read
+        self.connections += other.connections
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def build_request(host: str, target: Target, keep_alive: bool, rng: random.Random) -> bytes:
+    lines = [
+        f"GET {target.path} HTTP/1.1",
+        f"Host: {host}",
+        "Accept: */*",
+        "Accept-Encoding: gzip",
+        "Connection: keep-alive" if keep_alive else "Connection: close",
+    ]
+    if target.range_bytes:
+        start = rng.randrange(0, max(1, target.size - target.range_bytes))
+        lines.append(f"Range: bytes={start}-{start + target.range_bytes - 1}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+async def read_response(reader: asyncio.StreamReader) -> tuple[int, int, bool]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head[9:12])
+    length = 0
+    close = False
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"connection" and value.strip().lower() == b"close":
+            close = True
+    if length:
+        await reader.readexactly(length)
+    return status, len(head) + length, close
+
+
+async def connection(
+    host: str,
+    port: int,
+    targets: list[Target],
+    keep_alive: bool,
+    deadline: float,
+    timeout: float,
+    result: Result,
+    seed: int,
+) -> None:
+    rng = random.Random(seed)
+    weights = [target.weight for target in targets]
+    reader = writer = None
+    while time.monotonic() < deadline:
+        target = rng.choices(targets, weights)[0]
+        request = build_request(f"{host}:{port}", target, keep_alive, rng)
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port), timeout
+                )
+                result.connections += 1
+            writer.write(request)
+            status, size, close = await asyncio.wait_for(read_response(reader), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            result.failures += 1
+            close = True
+        else:
+            result.latencies.append(time.perf_counter() - started)
+            result.statuses[status] = result.statuses.get(status, 0) + 1
+            result.bytes_read += size
+        if close or not keep_alive:
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def drive(
+    url: str,
+    targets: list[Target],
+    concurrency: int,
+    duration: float,
+    keep_alive: bool,
+    timeout: float,
+    seed: int,
+) -> Result:
+    parts = urlsplit(url)
+    result = Result()
+    deadline = time.monotonic() + duration
+    await asyncio.gather(
+        *(
+            connection(
+                parts.hostname, parts.port or 80, targets, keep_alive,
+                deadline, timeout, result, seed + index,
+            )
+            for index in range(concurrency)
+        )
+    )
+    return result
+
+
+def run_process(
+    url: str,
+    targets: list[Target],
+    concurrency: int,
+    duration: float,
+    keep_alive: bool,
+    timeout: float,
+    seed: int,
+) -> Result:
+    # a thousand connections need more descriptors than the usual soft limit of 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = concurrency + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+    return asyncio.run(
+        drive(url, targets, concurrency, duration, keep_alive, timeout, seed)
+    )
+
+
+def run(
+    url: str,
+    targets: list[Target],
+    concurrency: int,
+    duration: float,
+    keep_alive: bool = True,
+    timeout: float = 10.0,
+    processes: int = 1,
+    seed: int = 0,
+) -> Result:
+    """Spreads the connections over `processes` event loops, a single Python
+    process runs out of CPU long before a server on other cores does."""
+    processes = max(1, min(processes, concurrency))
+    if processes == 1:
+        return run_process(url, targets, concurrency, duration, keep_alive, timeout, seed)
+    shares = [concurrency // processes + (i < concurrency % processes) for i in range(processes)]
+    result = Result()
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [
+            pool.submit(
+                run_process, url, targets, share, duration, keep_alive, timeout,
+                seed + index * concurrency,
+            )
+            for index, share in enumerate(shares)
+        ]
+        for future in futures:
+            result.merge(future.result())
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url")
+    parser.add_argument("--path", action="append", help="request paths, defaults to the url's")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--no-keep-alive", dest="keep_alive", action="store_false")
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+    targets = [Target(path) for path in args.path or [urlsplit(args.url).path or "/"]]
+    result = run(
+        args.url, targets, args.concurrency, args.duration, args.keep_alive,
+        processes=args.processes,
+    )
+    ordered = sorted(result.latencies)
+    print(
+        f"{result.requests / args.duration:.0f} req/s, {result.errors} errors, "
+        f"p50 {percentile(ordered, 0.5) * 1000:.2f} ms, "
+        f"p99 {percentile(ordered, 0.99) * 1000:.2f} ms, "
+        f"p99.9 {percentile(ordered, 0.999) * 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Load-tests severt against a generated static tree and saves the results.
+
+Starts the server from src/ with its own severt.yml, drives it at every
+concurrency level and writes RPS, latency percentiles, error rate and the
+server's CPU and memory use to a JSON file. With --baseline the results
+are compared to an earlier run and a regression fails the run.
+
+    python bench/run.py [--concurrency 10,100,1000] [--duration 10] [--baseline FILE]
+
+The two server engines are compared by running each and diffing the results:
+
+    python bench/run.py --engine selectors --output selectors.json
+    python bench/run.py --engine asyncio --output asyncio.json
+    python bench/compare.py selectors.json asyncio.json
+
+Listener settings are passed through with --listener, e.g. --listener nodelay=false,
+bench/listener.py runs one pass per setting.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import tempfile
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+
+import yaml
+
+import compare
+import loadgen
+
+ROOT = Path(__file__).resolve().parent.parent
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def build_tree(static: Path) -> list[loadgen.Target]:
+    """Small HTML, a mid-size stylesheet and multi-MB media read with ranges,
+    weighted roughly like a page load."""
+    static.mkdir(parents=True, exist_ok=True)
+    paragraph = "<p>" + "severt serves static files. " * 8 + "</p>\n"
+    (static / "index.html").write_text(
+        f"<!doctype html>\n<html><head><link rel=stylesheet href=/style.css></head>"
+        f"<body>{paragraph * 6}</body></html>\n"
+    )
+    rule = ".c{} {{ margin: {}px; padding: {}px; color: #{:06x}; }}\n"
+    (static / "style.css").write_text(
+        "".join(rule.format(i, i % 17, i % 11, i * 7919 % 0xFFFFFF) for i in range(1600))
+    )
+    media_size = 8 * 1024 * 1024
+    # random bytes so nothing along the way can compress them
+    (static / "media.mp4").write_bytes(os.urandom(media_size))
+    return [
+        loadgen.Target("/", weight=6),
+        loadgen.Target("/style.css", weight=3),
+        loadgen.Target("/media.mp4", weight=1, size=media_size, range_bytes=256 * 1024),
+    ]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_config(
+    directory: Path, port: int, workers: int, engine: str, listener: dict | None = None
+) -> Path:
+    (directory / "log").mkdir(exist_ok=True)
+    config = {
+        "name": "severt-bench",
+        "host": "127.0.0.1",
+        "port": port,
+        "workers": workers,
+        "engine": engine,
+        "location": {"static": str(directory / "static"), "log": str(directory / "log")},
+        # every connection is busy for the whole run, nothing should be reaped
+        "timeouts": {"keep_alive": 60},
+        "cache": {"stats_interval": 0},
+        "rate_limit": {"enabled": False},
+        "listener": listener or {},
+    }
+    path = directory / "severt.yml"
+    path.write_text(yaml.safe_dump(config))
+    return path
+
+
+def start_server(config: Path, port: int, src: Path = ROOT / "src") -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "main.py", "serve"],
+        cwd=src,
+        env={**os.environ, "SEVERT_CONFIG": str(config)},
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with code {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server did not start listening")
+
+
+def process_tree(pid: int) -> list[int]:
+    # the supervisor and its workers, read from /proc so no psutil is needed
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = Path(f"/proc/{entry}/stat").read_text()
+        except OSError:
+            continue
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            pids.append(int(entry))
+    return pids
+
+
+def cpu_seconds(pids: list[int]) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime
+        total += int(fields[11]) + int(fields[12])
+    return total / CLOCK_TICKS
+
+
+def rss_bytes(pids: list[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            total += int(Path(f"/proc/{pid}/statm").read_text().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+    return total
+
+
+class ResourceSampler(threading.Thread):
+    """Peak resident memory of the server's processes while a run is going."""
+
+    def __init__(self, pids: list[int], interval: float = 0.2) -> None:
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.peak_rss = 0
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.is_set():
+            self.peak_rss = max(self.peak_rss, rss_bytes(self.pids))
+            self._done.wait(self.interval)
+
+    def stop(self) -> int:
+        self._done.set()
+        self.join()
+        return self.peak_rss
+
+
+def measure(url: str, targets: list[loadgen.Target], server_pids: list[int], args, concurrency: int) -> dict:
+    sampler = ResourceSampler(server_pids)
+    cpu_before = cpu_seconds(server_pids)
+    started = time.monotonic()
+    sampler.start()
+    result = loadgen.run(
+        url, targets, concurrency, args.duration, args.keep_alive,
+        timeout=args.timeout, processes=args.processes,
+    )
+    elapsed = time.monotonic() - started
+    peak_rss = sampler.stop()
+    cpu = cpu_seconds(server_pids) - cpu_before
+    ordered = sorted(result.latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": result.requests,
+        "rps": round(result.requests / elapsed, 1),
+        "errors": result.errors,
+        "error_rate": round(result.errors / result.requests, 6) if result.requests else 1.0,
+        "statuses": {str(status): count for status, count in sorted(result.statuses.items())},
+        "connections": result.connections,
+        "megabytes_read": round(result.bytes_read / 1e6, 1),
+        "latency_ms": {
+            name: round(loadgen.percentile(ordered, fraction) * 1000, 3)
+            for name, fraction in (("p50", 0.5), ("p99", 0.99), ("p999", 0.999))
+        },
+        "cpu_seconds": round(cpu, 2),
+        # 1.0 is one core busy for the whole run
+        "cpu_utilization": round(cpu / elapsed, 3),
+        "peak_rss_mb": round(peak_rss / 2**20, 1),
+    }
+
+
+def parse_settings(pairs: list[str]) -> dict:
+    # KEY=VALUE with YAML values, so numbers and booleans come out typed
+    settings = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        settings[key] = yaml.safe_load(value)
+    return settings
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="10,100,1000", help="comma separated levels")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds before the first level")
+    parser.add_argument("--no-keep-alive", dest="keep_alive", action="store_false")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes")
+    parser.add_argument("--engine", choices=("selectors", "asyncio"), default="selectors")
+    parser.add_argument(
+        "--listener", action="append", default=[], metavar="KEY=VALUE",
+        help="listener setting for the server, repeatable",
+    )
+    parser.add_argument("--processes", type=int, default=1, help="load generator processes")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds before a request counts as failed")
+    parser.add_argument("--output", type=Path, help="defaults to bench/results/<commit>.json")
+    parser.add_argument("--baseline", type=Path, help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    listener = parse_settings(args.listener)
+    commit = git_commit()
+
+    with tempfile.TemporaryDirectory(prefix="severt-bench-") as directory:
+        directory = Path(directory)
+        targets = build_tree(directory / "static")
+        port = free_port()
+        server = start_server(write_config(directory, port, args.workers, args.engine, listener), port)
+        try:
+            # forked workers show up shortly after the listener does
+            time.sleep(0.5)
+            server_pids = process_tree(server.pid)
+            url = f"http://127.0.0.1:{port}"
+            if args.warmup:
+                loadgen.run(url, targets, min(levels), args.warmup, args.keep_alive)
+            runs = []
+            for concurrency in levels:
+                run = measure(url, targets, server_pids, args, concurrency)
+                runs.append(run)
+                print(
+                    f"c={concurrency:<5} {run['rps']:>8.0f} req/s  "
+                    f"p50 {run['latency_ms']['p50']:.2f} ms  p99 {run['latency_ms']['p99']:.2f} ms  "
+                    f"p99.9 {run['latency_ms']['p999']:.2f} ms  errors {run['error_rate']:.2%}  "
+                    f"cpu {run['cpu_utilization']:.2f}  rss {run['peak_rss_mb']} MB"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+    results = {
+        "commit": commit,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "duration": args.duration,
+            "keep_alive": args.keep_alive,
+            "workers": args.workers,
+            "engine": args.engine,
+            "processes": args.processes,
+            "listener": listener,
+        },
+        "runs": runs,
+    }
+    output = args.output or ROOT / "bench" / "results" / f"{commit}-{args.engine}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"Saved to {output}")
+
+    failures = compare.error_rate_failures(results, args.max_error_rate)
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        failures += compare.regressions(baseline, results, args.threshold)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,156 @@
+import os
 import yaml
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+# seconds, see Config.timeouts
+DEFAULT_TIMEOUTS = {
+    # a request has to finish sending its headers within this time
+    "header_read": 10,
+    # idle keep-alive connections are closed after this time
+    "keep_alive": 5,
+    # a response that makes no progress for this long is abandoned
+    "write_stall": 30,
+}
+
+# bytes, see Config.limits
+DEFAULT_LIMITS = {
+    # request line and headers, larger requests get a 431
+    "header_bytes": 8 * 1024,
+    # request bodies, larger ones get a 413
+    "body_bytes": 1024 * 1024,
+}
+
+# see Config.cache
+DEFAULT_CACHE = {
+    # total bytes of file contents kept in memory by each worker
+    "max_bytes": 64 * 1024 * 1024,
+    # larger files are never read into memory
+    "max_entry_bytes": 1024 * 1024,
+    # files above max_entry_bytes and up to this size are memory-mapped instead, the
+    # pages are shared by all workers through the page cache, 0 turns mapping off
+    "mmap_max_entry_bytes": 16 * 1024 * 1024,
+    # bytes of files kept mapped by each worker, larger files go out through sendfile
+    "mmap_max_bytes": 1024 * 1024 * 1024,
+    # seconds between cache statistics log lines, 0 turns them off
+    "stats_interval": 300,
+}
+
+# see Config.listener, sizes in bytes and 0 keeps the kernel's default
+DEFAULT_LISTENER = {
+    # connections the kernel queues for accept()
+    "backlog": 1024,
+    # connections accepted per wakeup before the loop gets back to the open ones
+    "accept_batch": 64,
+    # send small responses right away instead of waiting for Nagle's algorithm
+    "nodelay": True,
+    # seconds the kernel holds a connection back until its first data arrives (Linux)
+    "defer_accept": 0,
+    # pending TCP Fast Open requests, data in the SYN saves a round trip, 0 turns it off
+    "fastopen": 0,
+    # socket buffers of every connection, set on the listener before listen()
+    # so the window scale is negotiated for them
+    "send_buffer": 0,
+    "receive_buffer": 0,
+    # open connections per worker, more are answered with a 503 and closed, 0 is no limit
+    "max_connections": 10000,
+}
+
+# see Config.http2, the selectors engine speaks HTTP/2 when h2 is installed
+DEFAULT_HTTP2 = {
+    # cleartext HTTP/2 with prior knowledge and through Upgrade: h2c
+    "enabled": True,
+    # requests a client may have in flight on one connection
+    "max_concurrent_streams": 100,
+}
+
+# see Config.pool
+DEFAULT_POOL = {
+    # threads per worker opening, reading and mapping files and rescanning the
+    # static directory, 0 does all of it on the event loop
+    "threads": 4,
+    # jobs waiting for a thread, a job submitted to a full queue runs on the event loop
+    "queue_size": 1024,
+}
+
+# see Config.rate_limit, rates are per second
+DEFAULT_RATE_LIMIT = {
+    "enabled": False,
+    # per client address
+    "connections_per_second": 20,
+    "connection_burst": 40,
+    "requests_per_second": 100,
+    "request_burst": 200,
+    # per /24 (IPv4) or /64 (IPv6) network
+    "network_connections_per_second": 100,
+    "network_connection_burst": 200,
+    "network_requests_per_second": 500,
+    "network_request_burst": 1000,
+    # clients tracked at once, the least recently seen are forgotten first
+    "max_clients": 65536,
+}
+
+# see Config.index
+DEFAULT_INDEX = {
+    # seconds between scans of the static directory, 0 only scans at startup. a scan
+    # stats every directory and lists the ones whose mtime changed, files that were
+    # added, removed or renamed over show up within this time
+    "refresh_interval": 5,
+    # seconds between scans that stat every file, for files modified in place, which
+    # leave their directory as it was. these cost a stat per file on the blocking
+    # pool, the event loop only applies what changed. 0 never rescans in full
+    "full_scan_interval": 300,
+}
+
+# see Config.metrics
+DEFAULT_METRICS = {
+    # serves the endpoint below, the numbers themselves are always recorded
+    "enabled": True,
+    # requests for this path get the metrics instead of a static file
+    "path": "/metrics",
+    # client addresses allowed to read the metrics, everyone else gets a 404
+    "allow": ["127.0.0.1", "::1"],
+    # seconds between copies of per-worker cache counters into the shared metrics
+    "publish_interval": 1,
+}
+
+# see Config.profiling, reports are written to location.log
+DEFAULT_PROFILING = {
+    # SIGUSR1 profiles the event loop and times request phases, SIGUSR2 diffs
+    # allocations, sent to the supervisor they reach every worker
+    "signals": True,
+    # GET <path>?seconds=N&kind=cpu,memory,phases starts a session in the worker
+    # that answers it, "" turns the endpoint off
+    "path": "/debug/profile",
+    # client addresses allowed to start one, everyone else gets a 404
+    "allow": ["127.0.0.1", "::1"],
+    # length of a session when none is asked for, and the longest one
+    "seconds": 10,
+    "max_seconds": 300,
+    # stack frames kept per allocation, more tell callers apart but cost more while tracing
+    "frames": 1,
+    # functions and allocation sites listed in each report
+    "top": 40,
+}
+
+# see Config.logging, files are written to location.log
+DEFAULT_LOGGING = {
+    # one JSON line per response in access-<date>.log, see `main.py analytics`
+    "access_log": True,
+    # records waiting for the writer thread, more than that are counted and dropped
+    "queue_size": 10000,
+    # a log file that reaches this size is continued in <date>.1.log and so on
+    "max_bytes": 64 * 1024 * 1024,
+}
+
+# see Config.asyncio, only read by the asyncio engine
+DEFAULT_ASYNCIO = {
+    # runs on uvloop when it is installed
+    "uvloop": True,
+    # bytes buffered by a connection's transport before no further responses
+    # are written to it, and the level it has to drain to before they are
+    "write_high_water": 256 * 1024,
+    "write_low_water": 64 * 1024,
+}
 
 
 @dataclass(frozen=True)
@@ -8,7 +159,45 @@ class Config:
     location: dict[str, str]
     port: int = 8000
     host: str = "localhost"
+    # number of pre-forked worker processes, 1 runs the event loop in the current process
+    workers: int = 1
+    # a connection stops being read while this many requests wait for a response
+    max_pending_requests: int = 16
+    # "selectors" runs the hand-written event loop, "asyncio" runs service.HTTPProtocol
+    engine: str = "selectors"
+    listener: dict[str, int] = field(default_factory=dict)
+    timeouts: dict[str, float] = field(default_factory=dict)
+    limits: dict[str, int] = field(default_factory=dict)
+    cache: dict[str, int] = field(default_factory=dict)
+    index: dict[str, float] = field(default_factory=dict)
+    pool: dict[str, int] = field(default_factory=dict)
+    http2: dict = field(default_factory=dict)
+    rate_limit: dict[str, float] = field(default_factory=dict)
+    metrics: dict = field(default_factory=dict)
+    asyncio: dict = field(default_factory=dict)
+    logging: dict = field(default_factory=dict)
+    profiling: dict = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        # settings left out of severt.yml fall back to their defaults
+        object.__setattr__(self, "listener", {**DEFAULT_LISTENER, **self.listener})
+        object.__setattr__(self, "timeouts", {**DEFAULT_TIMEOUTS, **self.timeouts})
+        object.__setattr__(self, "limits", {**DEFAULT_LIMITS, **self.limits})
+        object.__setattr__(self, "cache", {**DEFAULT_CACHE, **self.cache})
+        object.__setattr__(self, "index", {**DEFAULT_INDEX, **self.index})
+        object.__setattr__(self, "pool", {**DEFAULT_POOL, **self.pool})
+        object.__setattr__(self, "http2", {**DEFAULT_HTTP2, **self.http2})
+        object.__setattr__(
+            self, "rate_limit", {**DEFAULT_RATE_LIMIT, **self.rate_limit}
+        )
+        object.__setattr__(self, "metrics", {**DEFAULT_METRICS, **self.metrics})
+        object.__setattr__(self, "asyncio", {**DEFAULT_ASYNCIO, **self.asyncio})
+        object.__setattr__(self, "logging", {**DEFAULT_LOGGING, **self.logging})
+        object.__setattr__(self, "profiling", {**DEFAULT_PROFILING, **self.profiling})
+        if self.engine not in ("selectors", "asyncio"):
+            raise ValueError(f"engine must be selectors or asyncio, not {self.engine!r}")
 
 
-with open("", "r") as file:
+# severt.yml can be swapped for another file, the bench suite runs against a generated one
+with open(os.environ.get("SEVERT_CONFIG", ""), "r") as file:
     CONFIG = Config(**yaml.safe_load(file))
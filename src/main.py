@@ -1,69 +1,309 @@
 import sys
 import time
+import asyncio
+import argparse
+import signal
 import socket
 import selectors
+from functools import partial
 from config import CONFIG
-from util import read_instance_ids, logger, write_instance_ids
-from service import ReadMessage, WriteMessage
+from supervisor import Supervisor, leave_loop
+from util import (
+    logger,
+    queue_handler,
+    TimerWheel,
+    content_cache,
+    mapped_files,
+    compress_tree,
+    static_index,
+    static_bundle,
+    pack_tree,
+    metrics,
+    CACHE_STATS,
+    MAPPED_STATS,
+    summarize,
+    blocking_pool,
+    profiler,
+    PROFILE_SIGNALS,
+)
+from service import Connection, HTTPProtocol, STATIC, admit
 
-# Chooses the most efficient polling based on platform
-sel = selectors.DefaultSelector()
+# uvloop is optional, the asyncio engine falls back to the standard event loop
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+LOOP_ITERATIONS = metrics.offset("severt_loop_iterations_total")
+LOG_DROPPED = metrics.offset("severt_log_dropped_total")
 
 
 # Creates a new socket to communicate with the client socket
-def accept_wrapper(sock) -> None:
-    conn, _ = sock.accept()
+def accept_wrapper(sock, sel, timers: TimerWheel) -> None:
+    # drains the backlog up to accept_batch connections per wakeup, so a
+    # connection storm costs one select() per batch instead of one per client
+    for _ in range(CONFIG.listener["accept_batch"]):
+        try:
+            conn, address = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # out of file descriptors, what is left waits in the backlog
+            logger.exception("AcceptError")
+            return
+        accept_connection(conn, address[0], sel, timers)
+
+
+def accept_connection(conn: socket.socket, peer: str, sel, timers: TimerWheel) -> None:
     conn.setblocking(False)
-    # register this socket to notify us on i/o read and write events
-    # when a i/o read or write event happens it also passes the
-    # selector and socket by using the data parameter
-    sel.register(
-        conn,
-        selectors.EVENT_READ | selectors.EVENT_WRITE,
-        data={"sock": conn, "sel": sel},
-    )
+    if (refusal := admit(peer)) is not None:
+        reject_connection(conn, refusal)
+        return
+    set_connection_options(conn)
+    # register this socket to notify us on i/o read events, write events are
+    # only watched while a response is queued (see Connection._set_interest)
+    # the connection rides along as the key's data so events need no lookups
+    connection = Connection(conn, sel, peer)
+    sel.register(conn, selectors.EVENT_READ, data=connection)
+    reap_connection(connection, timers)
 
 
-def main() -> None:
+def reap_connection(connection: Connection, timers: TimerWheel) -> None:
+    # timers are never cancelled, a connection that was already closed is simply dropped
+    if connection.closed:
+        return
+    deadline = connection.deadline()
+    if time.monotonic() < deadline:
+        # there was activity since this timer was set, check again at the new deadline
+        timers.schedule(deadline, partial(reap_connection, connection, timers))
+    else:
+        connection.close()
+
+
+def log_cache_stats(timers: TimerWheel) -> None:
+    stats = " ".join(f"{name}={value}" for name, value in content_cache.stats().items())
+    logger.info(f"Content cache: {stats}")
+    stats = " ".join(f"{name}={value}" for name, value in mapped_files.stats().items())
+    logger.info(f"Mapped files: {stats}")
+    interval = CONFIG.cache["stats_interval"]
+    timers.schedule(time.monotonic() + interval, partial(log_cache_stats, timers))
+
+
+def refresh_static_index(timers: TimerWheel) -> None:
+    # scanning a large tree would stall the loop, the index is only updated on it
+    # a bundle is only mapped again when a new one was renamed over it
+    blocking_pool.submit(STATIC.scan, partial(apply_static_index, timers))
+
+
+def apply_static_index(timers: TimerWheel, files, error: BaseException | None) -> None:
+    if error is not None:
+        logger.error("StaticIndexError", exc_info=error)
+    elif STATIC is static_bundle and (count := static_bundle.apply(files)):
+        logger.info(f"Bundle {static_bundle.path} swapped in, {count} file(s).")
+    elif STATIC is static_index and (changed := static_index.apply(files)):
+        logger.info(f"Static index refreshed, {changed} file(s) changed.")
+    interval = CONFIG.index["refresh_interval"]
+    timers.schedule(time.monotonic() + interval, partial(refresh_static_index, timers))
+
+
+def publish_metrics(timers: TimerWheel) -> None:
+    # the cache and the log count in plain attributes, copied over instead of touching
+    # the shared mapping on every lookup
+    for name, value in content_cache.stats().items():
+        metrics.set(metrics.offset(CACHE_STATS[name]), value)
+    for name, value in mapped_files.stats().items():
+        metrics.set(metrics.offset(MAPPED_STATS[name]), value)
+    metrics.set(LOG_DROPPED, queue_handler.dropped)
+    interval = CONFIG.metrics["publish_interval"]
+    timers.schedule(time.monotonic() + interval, partial(publish_metrics, timers))
+
+
+def create_listener() -> socket.socket:
     bsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     # set socket option
     bsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if CONFIG.workers > 1:
+        # every worker binds its own listener on the same port
+        # and the kernel spreads incoming connections across them
+        bsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    settings = CONFIG.listener
+    # accepted connections inherit the buffer sizes, they have to be set before
+    # listen() for the window scale to be negotiated from them
+    if settings["send_buffer"]:
+        bsock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, settings["send_buffer"])
+    if settings["receive_buffer"]:
+        bsock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, settings["receive_buffer"])
+    if settings["defer_accept"] and hasattr(socket, "TCP_DEFER_ACCEPT"):
+        bsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, settings["defer_accept"])
+    if settings["fastopen"] and hasattr(socket, "TCP_FASTOPEN"):
+        bsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_FASTOPEN, settings["fastopen"])
     bsock.bind((CONFIG.host, CONFIG.port))
-    bsock.listen()
-    start_stmt = f"Server started on http://{CONFIG.host}:{CONFIG.port}, serving directory {CONFIG.location['static']}."
-
-    logger.info(start_stmt)
+    bsock.listen(settings["backlog"])
     # set sockets to be unblocking
     bsock.setblocking(False)
+    return bsock
+
+
+def set_connection_options(conn: socket.socket) -> None:
+    if CONFIG.listener["nodelay"]:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def reject_connection(conn: socket.socket, refusal: bytes) -> None:
+    # what admit() refused the connection with, nothing when it is just dropped
+    if refusal:
+        try:
+            conn.send(refusal)
+        except OSError:
+            pass
+    conn.close()
+
+
+def schedule_periodic(timers: TimerWheel) -> None:
+    if CONFIG.index["refresh_interval"]:
+        timers.schedule(
+            time.monotonic() + CONFIG.index["refresh_interval"],
+            partial(refresh_static_index, timers),
+        )
+    if CONFIG.cache["stats_interval"]:
+        timers.schedule(
+            time.monotonic() + CONFIG.cache["stats_interval"],
+            partial(log_cache_stats, timers),
+        )
+    if CONFIG.metrics["enabled"]:
+        publish_metrics(timers)
+
+
+def serve(worker: int = 0) -> None:
+    metrics.bind(worker)
+    # a single worker is stopped like a forked one, see Supervisor._spawn
+    signal.signal(signal.SIGTERM, leave_loop)
+    if CONFIG.engine == "asyncio":
+        serve_asyncio()
+        return
+    # Chooses the most efficient polling based on platform
+    # each worker needs its own selector, an epoll fd shared across fork would mix events
+    sel = selectors.DefaultSelector()
+    timers = TimerWheel()
+    bsock = create_listener()
     # register this socket to receive notifications for I/O read events
     sel.register(bsock, selectors.EVENT_READ, data=None)
+    blocking_pool.start()
+    if blocking_pool.threads:
+        # readable when blocking jobs are done, see BlockingPool.run_completions
+        sel.register(blocking_pool.fileno(), selectors.EVENT_READ, data=blocking_pool)
+    profiler.attach(timers)
+    if CONFIG.profiling["signals"]:
+        # readable when SIGUSR1 or SIGUSR2 arrived, see Profiler.on_signals
+        sel.register(profiler.watch_signals(), selectors.EVENT_READ, data=profiler)
+    schedule_periodic(timers)
 
     # start of event loop
     while True:
-        events = sel.select()
+        # wake up in time for the next connection timeout
+        events = sel.select(timers.timeout())
+        metrics.inc(LOOP_ITERATIONS)
         for key, mask in events:
+            connection = key.data
             # setup client socket connection
-            if key.data is None:
-                accept_wrapper(key.fileobj)
-            elif mask & selectors.EVENT_READ:
-                # copy the code below this comment
-                message = key.data
-                socket_fd = message["sock"].fileno()
-                if socket_fd in read_instance_ids:
-                    read_instance = read_instance_ids[socket_fd]
-                else:
-                    read_instance = ReadMessage(**message)
-                    read_instance_ids[socket_fd] = read_instance
-                read_instance.read()
-            elif mask & selectors.EVENT_WRITE:
-                message = key.data
-                socket_fd = message["sock"].fileno()
-                if socket_fd in write_instance_ids:
-                    write_instance = write_instance_ids[socket_fd]
-                else:
-                    write_instance = WriteMessage(**message)
-                    write_instance_ids[socket_fd] = write_instance
-                write_instance.send()
+            if connection is None:
+                accept_wrapper(key.fileobj, sel, timers)
+                continue
+            if connection is blocking_pool:
+                blocking_pool.run_completions()
+                continue
+            if connection is profiler:
+                profiler.on_signals()
+                continue
+            if mask & selectors.EVENT_READ:
+                connection.on_read()
+            # reading may have closed it, a request and its response can share one wakeup
+            if mask & selectors.EVENT_WRITE and not connection.closed:
+                connection.on_write()
+        timers.advance()
+
+
+def advance_timers(loop: asyncio.AbstractEventLoop, timers: TimerWheel) -> None:
+    # the same wheel as the selectors engine, ticked by the event loop instead of select()
+    timers.advance()
+    loop.call_later(timers.resolution, advance_timers, loop, timers)
+
+
+async def serve_protocol() -> None:
+    loop = asyncio.get_running_loop()
+    timers = TimerWheel()
+    blocking_pool.start()
+    if blocking_pool.threads:
+        loop.add_reader(blocking_pool.fileno(), blocking_pool.run_completions)
+    profiler.attach(timers)
+    if CONFIG.profiling["signals"]:
+        for signum, kinds in PROFILE_SIGNALS.items():
+            loop.add_signal_handler(signum, profiler.start, kinds)
+    schedule_periodic(timers)
+    advance_timers(loop, timers)
+    # the loop accepts up to backlog connections per wakeup and sets TCP_NODELAY itself
+    server = await loop.create_server(
+        partial(HTTPProtocol, timers),
+        sock=create_listener(),
+        backlog=CONFIG.listener["backlog"],
+    )
+    await server.serve_forever()
+
+
+def serve_asyncio() -> None:
+    if CONFIG.asyncio["uvloop"] and uvloop is not None:
+        loop = uvloop.new_event_loop()
+    else:
+        loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(serve_protocol())
+    finally:
+        loop.close()
+
+
+def serve_forever() -> None:
+    serving = f"bundle {static_bundle.path}" if STATIC is static_bundle else f"directory {CONFIG.location['static']}"
+    start_stmt = f"Server started on http://{CONFIG.host}:{CONFIG.port} with {CONFIG.workers} {CONFIG.engine} worker(s), serving {serving}."
+    logger.info(start_stmt)
+    # built before forking so every worker starts out with the same index,
+    # for a bundle that's one mmap() the workers share
+    STATIC.refresh()
+    if CONFIG.workers > 1:
+        Supervisor(serve, CONFIG.workers).run()
+    else:
+        serve()
+
+
+def compress() -> None:
+    written = compress_tree(CONFIG.location["static"])
+    print(f"Wrote {written} precompressed file(s) under {CONFIG.location['static']}.")
+
+
+def pack() -> None:
+    if not static_bundle.path:
+        sys.exit("location.bundle has to name the bundle file to write.")
+    packed = pack_tree(CONFIG.location["static"], static_bundle.path)
+    print(f"Packed {packed} file(s) from {CONFIG.location['static']} into {static_bundle.path}.")
+
+
+def analytics(args: argparse.Namespace) -> None:
+    print(summarize(CONFIG.location["log"], args.since, args.top))
+
+
+def main() -> None:
+    commands = {
+        "serve": lambda args: serve_forever(),
+        "compress": lambda args: compress(),
+        "pack": lambda args: pack(),
+        "analytics": analytics,
+    }
+    parser = argparse.ArgumentParser(prog=CONFIG.name)
+    parser.add_argument("command", nargs="?", default="serve", choices=commands)
+    parser.add_argument("--since", default="", help="analytics: first day to include, YYYY-MM-DD")
+    parser.add_argument("--top", type=int, default=10, help="analytics: endpoints to list")
+    args = parser.parse_args()
+    commands[args.command](args)
 
 
 if __name__ == "__main__":
@@ -1,2 +1,4 @@
-from .read_message import ReadMessage
-from .write_message import WriteMessage
+from .connection import Connection
+from .http_protocol import HTTPProtocol
+from .response import OVERLOADED, STATIC
+from .accounting import admit
@@ -0,0 +1,86 @@
+import math
+from config import CONFIG
+from http.client import HTTPMessage
+from util import log_access, rate_limiter, metrics, profiler
+from .response import OVERLOADED
+
+# the steps every engine takes for a connection and its responses, so that
+# both count, limit and log them the same way
+
+CONNECTIONS = metrics.offset("severt_connections_total")
+OPEN_CONNECTIONS = metrics.offset("severt_open_connections")
+REJECTED = metrics.offset("severt_connections_rejected_total")
+RESPONSE_BYTES = metrics.offset("severt_response_bytes_total")
+TIME_TO_FIRST_BYTE = metrics.offset("severt_time_to_first_byte_seconds")
+RESPONSE_TIME = metrics.offset("severt_response_seconds")
+
+# connections of this worker, checked against listener.max_connections
+open_connections = 0
+
+
+def admit(peer: str) -> bytes | None:
+    """Decides on a new connection, returns None when it is served or else
+    what to send it before it is closed."""
+    global open_connections
+    if rate_limiter.connection_delay(peer):
+        # over the connection rate, dropped before it costs anything
+        return b""
+    limit = CONFIG.listener["max_connections"]
+    if limit and open_connections >= limit:
+        # the client is told to come back instead of being reset
+        metrics.inc(REJECTED)
+        metrics.count_status(503)
+        return OVERLOADED
+    open_connections += 1
+    metrics.inc(CONNECTIONS)
+    metrics.inc(OPEN_CONNECTIONS)
+    return None
+
+
+def release() -> None:
+    # an admitted connection was closed
+    global open_connections
+    open_connections -= 1
+    metrics.inc(OPEN_CONNECTIONS, -1)
+
+
+def rejected(status: str, received_at: float) -> HTTPMessage:
+    # a request that couldn't be read, answered with status, see build_response
+    header = HTTPMessage()
+    header.received_at = received_at
+    header["Error"] = status
+    return header
+
+
+def throttle(peer: str, header: HTTPMessage) -> bool:
+    """Turns header into a 429 when the client is over its request rate,
+    returns whether it did."""
+    if retry_after := rate_limiter.request_delay(peer):
+        header["Error"] = "429 Too Many Requests"
+        header["Retry-After"] = str(math.ceil(retry_after))
+        return True
+    return False
+
+
+def first_byte(header: HTTPMessage, now: float) -> None:
+    metrics.observe(TIME_TO_FIRST_BYTE, now - header.received_at)
+
+
+def record(peer: str, header: HTTPMessage, status: int, size: int, finished: float) -> None:
+    """Counts a response in the metrics and the profiler's phases and logs it,
+    finished is when its last byte was handed on."""
+    duration = finished - header.received_at
+    metrics.count_status(status)
+    metrics.inc(RESPONSE_BYTES, size)
+    metrics.observe(RESPONSE_TIME, duration)
+    if profiler.timing:
+        profiler.record("send", finished - header.responded_at)
+        profiler.record("total", duration)
+    log_access(
+        peer,
+        header.get("Method", "-"),
+        header.get("Location", "-"),
+        status,
+        size,
+        duration,
+    )
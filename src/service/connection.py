@@ -0,0 +1,434 @@
+import os
+import time
+import socket
+from io import BufferedReader
+from collections import deque
+from config import CONFIG
+from http.client import HTTPMessage
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from functools import partial
+from util import logger, SendQueue, ObjectPool, MappedFile, metrics, blocking_pool
+from .request_parser import RequestParser, RequestError
+from .response import Part, Response, PendingBody, build_response, finish_response
+from .accounting import release, rejected, throttle, first_byte, record
+from . import http2
+
+MSG_MORE = getattr(socket, "MSG_MORE", 0)
+RECV_SIZE = 64 * 1024
+
+HTTP2_CONNECTIONS = metrics.offset("severt_http2_connections_total")
+
+# a worker reads one socket at a time, so every connection receives into the
+# same buffer and the parser copies out what it keeps
+recv_buffer = memoryview(bytearray(RECV_SIZE))
+parsers: ObjectPool[RequestParser] = ObjectPool(
+    lambda: RequestParser(CONFIG.limits["header_bytes"], CONFIG.limits["body_bytes"]),
+    RequestParser.reset,
+)
+send_queues: ObjectPool[SendQueue] = ObjectPool(SendQueue, SendQueue.clear)
+
+
+class Connection:
+    """A client connection on the selectors engine, attached as its selector key's data.
+
+    Reading, the requests waiting for a response and the response being
+    written all live here, so an event goes straight from the key to its
+    connection. The parser, the request queue and the send queue are only
+    held while they have something in them, the parser and send queue
+    coming from pools, so an idle keep-alive connection is little more
+    than this object. close() is the only way a connection is torn down.
+    """
+
+    __slots__ = (
+        "sock",
+        "sel",
+        "peer",
+        "events",
+        "_interest",
+        "_parked",
+        "closed",
+        "_parser",
+        "_http2",
+        "_preface",
+        "_rejected",
+        "_pending",
+        "_send_queue",
+        "_close_after_write",
+        "_parts",
+        "_file",
+        "_mapped",
+        "_file_offset",
+        "_file_end",
+        "last_activity",
+        "last_progress",
+        "request_started",
+        "_status",
+        "_first_byte_sent",
+        "_bytes_sent",
+    )
+
+    def __init__(self, sock: socket.socket, sel: DefaultSelector, peer: str = "") -> None:
+        self.sock = sock
+        self.sel = sel
+        # client address, used for rate limiting and the metrics endpoint
+        self.peer = peer
+        # interest the socket is registered with and the one it should have,
+        # they differ while the connection is parked, see _set_interest
+        self.events = EVENT_READ
+        self._interest = EVENT_READ
+        # waiting for the blocking pool to load a response body
+        self._parked = False
+        self.closed = False
+        self._parser: RequestParser | None = None
+        # set once the connection switched to HTTP/2, every event goes to it from then on
+        self._http2: http2.HTTP2Session | None = None
+        # the start of a first read too short to tell HTTP/2's preface from a request
+        self._preface = b""
+        # a rejected request loses the framing, anything after it is discarded
+        self._rejected = False
+        # parsed requests waiting for their response, in order
+        self._pending: deque[HTTPMessage] | None = None
+        self._send_queue: SendQueue | None = None
+        # error responses and OPTIONS close the connection once they are written
+        self._close_after_write = False
+        # body parts of the response that are not queued yet, last one first
+        self._parts: list[Part] | None = None
+        # file the response's ranges are sent from and the range os.sendfile is on
+        self._file: BufferedReader | None = None
+        self._file_offset = 0
+        self._file_end = 0
+        # mapping the parts are sliced from, released with the file
+        self._mapped: MappedFile | None = None
+        # monotonic timestamps read by the idle connection reaper
+        self.last_activity: float = time.monotonic()
+        self.last_progress: float = 0
+        # when the first byte of a request that is still incomplete arrived, 0 when none is
+        self.request_started: float = 0
+        # per response numbers for the metrics, see record
+        self._status = 0
+        self._first_byte_sent = False
+        self._bytes_sent = 0
+
+    @property
+    def is_writing(self) -> bool:
+        return bool(self._send_queue or self._file or self._parts)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending) if self._pending else 0
+
+    def deadline(self) -> float:
+        # when the reaper closes this connection unless something happens first
+        return connection_deadline(
+            self.is_writing or bool(self._pending) or (self._http2 is not None and self._http2.busy),
+            self.request_started,
+            max(self.last_activity, self.last_progress),
+        )
+
+    def on_read(self) -> None:
+        try:
+            received = self.sock.recv_into(recv_buffer)
+            # ensure the client didn't close the connection by checking for 0 bytes
+            if not received:
+                self.close()
+                return
+            if self._rejected:
+                return
+            self.last_activity = time.monotonic()
+            if self._http2 is not None:
+                self._http2.receive(recv_buffer[:received])
+                self.resume_http2()
+                return
+            data = recv_buffer[:received]
+            if self._parser is None and not self._pending and http2.is_available():
+                if self._preface:
+                    data = self._preface + data
+                    self._preface = b""
+                if len(data) < len(http2.PREFACE) and http2.PREFACE.startswith(data):
+                    # too short to tell yet, the next read decides
+                    self._preface = bytes(data)
+                    if not self.request_started:
+                        self.request_started = self.last_activity
+                    return
+                if data[: len(http2.PREFACE)] == http2.PREFACE:
+                    # HTTP/2 with prior knowledge, the preface is part of what h2 reads
+                    self.request_started = 0
+                    self._start_http2()
+                    self._http2.receive(data)
+                    self.resume_http2()
+                    return
+            if self._parser is None:
+                self._parser = parsers.acquire()
+            queued = False
+            try:
+                # every complete request in the buffer is queued in order,
+                # pipelined requests included
+                for header in self._parser.feed(data):
+                    # response latency in the metrics is measured from here
+                    header.received_at = self.last_activity
+                    if throttle(self.peer, header):
+                        self._reject(header)
+                        return
+                    self._queue(header)
+                    queued = True
+            except RequestError as error:
+                self._reject(rejected(error.status, self.last_activity))
+                return
+            if self._parser.in_progress:
+                if not self.request_started:
+                    self.request_started = self.last_activity
+            else:
+                # nothing buffered, the parser goes back until the next request
+                self.request_started = 0
+                parsers.release(self._parser)
+                self._parser = None
+            if queued:
+                if self.pending >= CONFIG.max_pending_requests:
+                    # stop reading until the responses catch up
+                    self._set_interest(EVENT_WRITE)
+                else:
+                    self._set_interest(EVENT_READ | EVENT_WRITE)
+        except BlockingIOError:
+            pass
+        except Exception:
+            self.close()
+
+    def on_write(self) -> None:
+        if self._http2 is not None:
+            self.resume_http2()
+        # the previous response is still being written, continue where it left off
+        elif self.is_writing:
+            self._write()
+        elif self._pending:
+            self._process_request(self._pending[0])
+
+    def resume_http2(self) -> None:
+        # sends what the HTTP/2 session has for the socket, write events are
+        # only watched while there is more
+        try:
+            self._http2.send(self.sock)
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.close()
+            return
+        if self._http2.closing and not self._http2.wants_write:
+            self.close()
+        elif self._http2.wants_write:
+            self._set_interest(EVENT_READ | EVENT_WRITE)
+        else:
+            self._set_interest(EVENT_READ)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._http2 is not None:
+            self._http2.close()
+        try:
+            self.sel.unregister(self.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # the client already reset the connection
+            pass
+        self.sock.close()
+        release()
+        self._pending = None
+        self._parts = None
+        if self._parser is not None:
+            parsers.release(self._parser)
+            self._parser = None
+        if self._send_queue is not None:
+            send_queues.release(self._send_queue)
+            self._send_queue = None
+        # after the queue, a mapping can only be unmapped once no slice of it is left
+        self._release_body()
+
+    def _queue(self, header: HTTPMessage) -> None:
+        if self._pending is None:
+            self._pending = deque()
+        self._pending.append(header)
+
+    def _reject(self, header: HTTPMessage) -> None:
+        # the error is answered once the requests before it are done
+        self._rejected = True
+        parsers.release(self._parser)
+        self._parser = None
+        self.request_started = 0
+        self._queue(header)
+        self._set_interest(EVENT_WRITE)
+
+    def _set_interest(self, events: int) -> None:
+        self._interest = events
+        if self._parked:
+            # the socket is always writable, a parked connection is woken by
+            # the blocking pool instead
+            events &= ~EVENT_WRITE
+        # only touch the selector when the interest actually changes,
+        # modify() is a syscall on epoll and kqueue
+        if events == self.events:
+            return
+        if not events:
+            # parked and not reading either, see max_pending_requests
+            self.sel.unregister(self.sock)
+        elif not self.events:
+            self.sel.register(self.sock, events, self)
+        else:
+            self.sel.modify(self.sock, events, self)
+        self.events = events
+
+    def _start_http2(self, upgrade: HTTPMessage | None = None) -> None:
+        metrics.inc(HTTP2_CONNECTIONS)
+        self._http2 = http2.HTTP2Session(self)
+        self._http2.start(upgrade)
+
+    def _process_request(self, header: HTTPMessage) -> None:
+        if (
+            self._parser is None
+            and len(self._pending) == 1
+            and http2.is_upgrade(header)
+            and http2.is_available()
+        ):
+            # Upgrade: h2c, nothing was read past the request so the next bytes are HTTP/2
+            self._pending = None
+            try:
+                self._start_http2(header)
+            except Exception:
+                # a malformed HTTP2-Settings header, the connection can't go on
+                self.close()
+                return
+            self.resume_http2()
+            return
+        self.last_progress = time.monotonic()
+        self._first_byte_sent = False
+        self._bytes_sent = 0
+        response = build_response(header, self.peer)
+        if isinstance(response, PendingBody):
+            # parked until the blocking pool has the file, see _resume
+            self._parked = True
+            self._set_interest(self._interest)
+            blocking_pool.submit(response.load, partial(self._resume, response))
+            return
+        self._start_response(response)
+
+    def _resume(self, pending: PendingBody, loaded, error: BaseException | None) -> None:
+        self._parked = False
+        response = finish_response(pending, loaded, error)
+        if self.closed:
+            # reaped or reset while it waited
+            response.release()
+            return
+        self._set_interest(self._interest)
+        self._start_response(response)
+
+    def _start_response(self, response: Response) -> None:
+        self._status = response.status
+        # for the profiler's send phase
+        self._pending[0].responded_at = time.monotonic()
+        # headers and a cached body go out together in one sendmsg
+        self._send_queue = send_queues.acquire()
+        self._send_queue.append(response.head)
+        self._parts = response.parts[::-1]
+        self._file = response.file
+        self._mapped = response.mapped
+        self._close_after_write = response.close
+        self._queue_parts()
+        self._write()
+
+    def _queue_parts(self) -> None:
+        # parts in memory join the send queue up to the next file range, which
+        # becomes the sendfile range once everything queued in front of it is out
+        parts = self._parts
+        while parts:
+            part = parts[-1]
+            if isinstance(part, tuple):
+                if self._send_queue or self._file_offset < self._file_end:
+                    return
+                self._file_offset, self._file_end = parts.pop()
+                return
+            self._send_queue.append(parts.pop())
+
+    def _write(self) -> None:
+        try:
+            while True:
+                if self._send_queue:
+                    # MSG_MORE holds back a short last packet when a file range follows
+                    more = self._parts or self._file_offset < self._file_end
+                    self._bytes_sent += self._send_queue.send(
+                        self.sock, MSG_MORE if more else 0
+                    )
+                    self.last_progress = time.monotonic()
+                    if not self._first_byte_sent:
+                        self._first_byte_sent = True
+                        first_byte(self._pending[0], self.last_progress)
+                    if self._send_queue:
+                        # the socket buffer is full, the rest goes on the next write event
+                        return
+                # a file range only follows once every byte in front of it is out
+                if self._file_offset < self._file_end:
+                    self._sendfile()
+                if not self._parts:
+                    break
+                self._queue_parts()
+            self._parts = None
+            self._release_body()
+            record(self.peer, self._pending[0], self._status, self._bytes_sent, self.last_progress)
+            if self._close_after_write:
+                self.close()
+                return
+            # the response went out in full so the request is no longer needed
+            send_queues.release(self._send_queue)
+            self._send_queue = None
+            self._pending.popleft()
+            if not self._pending:
+                self._pending = None
+                # nothing left to send, an idle socket is always writable
+                # so watching it for writes would spin the event loop
+                self._set_interest(EVENT_READ)
+            elif len(self._pending) < CONFIG.max_pending_requests and not self._rejected:
+                self._set_interest(EVENT_READ | EVENT_WRITE)
+        except BlockingIOError:
+            pass  # This error will throw if the buffer is full
+        except Exception:
+            logger.exception("ConnectionWriteError")
+            self.close()
+
+    def _sendfile(self) -> None:
+        # the kernel copies the file straight into the socket as it drains, the offset
+        # is kept so a BlockingIOError resumes here on the next write event
+        while self._file_offset < self._file_end:
+            sent = os.sendfile(
+                self.sock.fileno(),
+                self._file.fileno(),
+                self._file_offset,
+                self._file_end - self._file_offset,
+            )
+            if sent == 0:
+                # the file was truncated after content-length went out
+                raise EOFError(f"{self._file.name} ended at offset {self._file_offset}")
+            self._file_offset += sent
+            self._bytes_sent += sent
+            self.last_progress = time.monotonic()
+
+    def _release_body(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._mapped:
+            self._mapped.release()
+            self._mapped = None
+
+
+def connection_deadline(busy: bool, request_started: float, last_active: float) -> float:
+    """When an idle, slow or stalled connection is reaped, the same rules for
+    both engines: a connection with a response to write gets write_stall
+    since it last made progress, one in the middle of its request headers
+    header_read since they started and an idle one keep_alive."""
+    if busy:
+        return last_active + CONFIG.timeouts["write_stall"]
+    if request_started:
+        return request_started + CONFIG.timeouts["header_read"]
+    return last_active + CONFIG.timeouts["keep_alive"]
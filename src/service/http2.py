@@ -0,0 +1,401 @@
+import os
+import time
+from collections import deque
+from config import CONFIG
+from functools import partial
+from http.client import HTTPMessage
+from util import logger, SendQueue, metrics, blocking_pool, profiler
+from .response import Part, Response, PendingBody, build_response, finish_response
+from .accounting import throttle, first_byte, record
+
+# h2 is optional, without it every connection stays on HTTP/1.1
+try:
+    import h2.config
+    import h2.errors
+    import h2.events
+    import h2.settings
+    import h2.exceptions
+    import h2.connection
+    from hpack import HPACKError
+except ImportError:
+    h2 = None
+
+STREAMS = metrics.offset("severt_http2_streams_total")
+
+# the start of the client connection preface, RFC 9113 section 3.4
+PREFACE = b"PRI * HTTP/2.0\r\n"
+SWITCHING_PROTOCOLS = b"HTTP/1.1 101 Switching Protocols\r\nConnection: Upgrade\r\nUpgrade: h2c\r\n\r\n"
+# connection-specific fields of the HTTP/1.1 head that HTTP/2 forbids, RFC 9113 section 8.2.2
+CONNECTION_FIELDS = {b"connection", b"keep-alive", b"proxy-connection", b"transfer-encoding", b"upgrade"}
+# frames are only generated while less than this is waiting for the socket,
+# so a large response can't pile up in memory ahead of a slow client
+OUTPUT_HIGH_WATER = 128 * 1024
+# bytes of a file range read ahead on the blocking pool for a stream at a time
+READ_AHEAD = 128 * 1024
+COMPRESSION_ERROR = (0x9).to_bytes(4, "big")
+
+
+def is_available() -> bool:
+    return h2 is not None and CONFIG.http2["enabled"]
+
+
+def is_upgrade(header: HTTPMessage) -> bool:
+    # h2c upgrades are only taken for requests without a body, RFC 7540 section 3.2
+    upgrade = header.get("Upgrade", "")
+    return (
+        "h2c" in (token.strip().lower() for token in upgrade.split(","))
+        and header.get("HTTP2-Settings") is not None
+        and header.get("Method") in ("GET", "HEAD")
+        and not header.get_payload()
+    )
+
+
+class Stream:
+    """One request on an HTTP/2 connection and the response being sent on it."""
+
+    __slots__ = ("id", "header", "response", "parts", "remaining", "buffer")
+
+    def __init__(self, stream_id: int, header: HTTPMessage) -> None:
+        self.id = stream_id
+        self.header = header
+        self.response: Response | None = None
+        # body parts not sent yet, last one first, like Connection._parts
+        self.parts: list[Part] = []
+        # body bytes left to send
+        self.remaining = 0
+        # what was read ahead from the start of the file range in front, see HTTP2Session._read
+        self.buffer = memoryview(b"")
+
+    def take(self, size: int) -> bytes | memoryview | None:
+        # the next at most size bytes of the body, None when the file range in
+        # front has to be read first. every DATA frame needs its own frame header
+        # in front so file ranges can't go out through sendfile
+        part = self.parts[-1]
+        if isinstance(part, tuple):
+            if not self.buffer:
+                return None
+            start, end = part
+            chunk = self.buffer[:size]
+            self.buffer = self.buffer[len(chunk) :]
+            if start + len(chunk) < end:
+                self.parts[-1] = (start + len(chunk), end)
+            else:
+                self.parts.pop()
+            return chunk
+        chunk = part[:size]
+        if len(part) > size:
+            self.parts[-1] = part[size:]
+        else:
+            self.parts.pop()
+        return chunk
+
+
+class HTTP2Session:
+    """HTTP/2 on a connection of the selectors engine (RFC 9113), entered with
+    prior knowledge or an h2c upgrade.
+
+    h2 does the framing, HPACK and the flow control bookkeeping. Every
+    stream's request goes through build_response like an HTTP/1.1 request,
+    bodies that need the file system wait on the blocking pool without
+    holding up the other streams. Streams with body left send one DATA
+    frame each in turn, as large as their window and the peer's frame size
+    allow, so a large download never starves the small assets next to it.
+    A stream whose window is used up waits for the client's WINDOW_UPDATE,
+    one sending a file range waits for the next READ_AHEAD bytes of it to
+    be read on the blocking pool.
+    """
+
+    __slots__ = (
+        "connection",
+        "h2",
+        "streams",
+        "_ready",
+        "_blocked",
+        "_out",
+        "_greeted",
+        "_pumping",
+        "closing",
+    )
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.h2 = h2.connection.H2Connection(
+            h2.config.H2Configuration(
+                client_side=False,
+                header_encoding=None,
+                # response heads come from build_response and are well-formed already,
+                # checking them again costs more than encoding them
+                validate_outbound_headers=False,
+                normalize_outbound_headers=False,
+            )
+        )
+        self.h2.local_settings = h2.settings.Settings(
+            client=False,
+            initial_values={
+                h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: CONFIG.http2["max_concurrent_streams"],
+                h2.settings.SettingCodes.ENABLE_PUSH: 0,
+            },
+        )
+        self.streams: dict[int, Stream] = {}
+        # streams with body left and window to send it, in turn
+        self._ready: deque[Stream] = deque()
+        # streams waiting for a WINDOW_UPDATE
+        self._blocked: list[Stream] = []
+        self._out = SendQueue()
+        # the client's preface arrived, until then an upgraded connection only sends
+        # the 101 and its own preface, some clients can't take a response body along with them
+        self._greeted = False
+        # frames are being generated, a read finishing inline must not start sending
+        self._pumping = False
+        # the connection closes once everything queued is sent
+        self.closing = False
+
+    @property
+    def wants_write(self) -> bool:
+        return bool(self._out or (self._ready and self._greeted))
+
+    @property
+    def busy(self) -> bool:
+        # streams in progress keep the connection from being reaped as idle
+        return bool(self.streams or self._out)
+
+    def start(self, upgrade: HTTPMessage | None = None) -> None:
+        if upgrade is None:
+            self.h2.initiate_connection()
+        else:
+            # the upgrade request becomes stream 1, answered over HTTP/2
+            self.h2.initiate_upgrade_connection(upgrade["HTTP2-Settings"])
+            self._out.append(SWITCHING_PROTOCOLS)
+            self._request(1, upgrade)
+
+    def receive(self, data: memoryview) -> None:
+        try:
+            if profiler.timing:
+                # frames and HPACK, for every stream they carry
+                started = time.perf_counter()
+                events = self.h2.receive_data(bytes(data))
+                profiler.record("parse", time.perf_counter() - started)
+            else:
+                events = self.h2.receive_data(bytes(data))
+        except h2.exceptions.ProtocolError as error:
+            # h2 queued a GOAWAY with the error code, nothing more is read
+            self.closing = True
+            if self.h2.state_machine.state is not h2.connection.ConnectionState.CLOSED:
+                # a broken client preface is rejected before h2 reads frames, without a GOAWAY
+                self.h2.close_connection(error.error_code)
+            elif (
+                isinstance(error.__cause__, HPACKError)
+                and error.error_code == h2.errors.ErrorCodes.PROTOCOL_ERROR
+            ):
+                # h2 reports a header block it can't decode as a PROTOCOL_ERROR, RFC 9113
+                # section 4.3 wants a COMPRESSION_ERROR, the GOAWAY ends with the code
+                self._out.append(self.h2.data_to_send()[:-4] + COMPRESSION_ERROR)
+            return
+        if events:
+            self._greeted = True
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                self._request(event.stream_id, self._header(event.headers))
+            elif isinstance(event, h2.events.DataReceived):
+                # request bodies aren't used, the window is given back right away
+                self.h2.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.WindowUpdated):
+                self._unblock(event.stream_id)
+            elif isinstance(event, h2.events.RemoteSettingsChanged):
+                # a new initial window size changes every stream's window
+                self._unblock(0)
+            elif isinstance(event, h2.events.StreamReset):
+                self._drop(event.stream_id)
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.closing = True
+
+    def send(self, sock) -> None:
+        # frames are generated as the socket drains, BlockingIOError means it is full
+        while True:
+            self._pump()
+            if data := self.h2.data_to_send():
+                self._out.append(data)
+            if not self._out:
+                return
+            self._out.send(sock)
+            self.connection.last_progress = time.monotonic()
+            if self._out:
+                return
+
+    def close(self) -> None:
+        # the client is told with a GOAWAY when there is room for it
+        if not self.closing:
+            try:
+                self.h2.close_connection()
+                self.connection.sock.send(self.h2.data_to_send())
+            except Exception:
+                pass
+        for stream in self.streams.values():
+            if stream.response is not None:
+                stream.response.release()
+        self.streams.clear()
+        self._ready.clear()
+        self._blocked.clear()
+
+    def _header(self, fields: list[tuple[bytes, bytes]]) -> HTTPMessage:
+        # the pseudo-header fields become what RequestParser puts into an HTTPMessage
+        header = HTTPMessage()
+        for name, value in fields:
+            name, value = name.decode("latin-1"), value.decode("latin-1")
+            if name == ":method":
+                header["Method"] = value
+            elif name == ":path":
+                header["Location"] = value
+            elif name == ":authority":
+                header["Host"] = value
+            elif name[0] == ":" or name in ("method", "location", "error"):
+                continue
+            elif name == "host" and "Host" in header:
+                # :authority takes precedence, RFC 9113 section 8.3.1
+                continue
+            else:
+                header[name] = value
+        header.received_at = time.monotonic()
+        return header
+
+    def _request(self, stream_id: int, header: HTTPMessage) -> None:
+        metrics.inc(STREAMS)
+        stream = self.streams[stream_id] = Stream(stream_id, header)
+        throttle(self.connection.peer, header)
+        response = build_response(header, self.connection.peer)
+        if isinstance(response, PendingBody):
+            # only this stream waits for the file, see _resume
+            blocking_pool.submit(response.load, partial(self._resume, stream, response))
+            return
+        self._respond(stream, response)
+
+    def _resume(self, stream: Stream, pending: PendingBody, loaded, error: BaseException | None) -> None:
+        response = finish_response(pending, loaded, error)
+        if self.connection.closed or self.streams.get(stream.id) is not stream:
+            # the connection or the stream was reset while it waited
+            response.release()
+            return
+        self._respond(stream, response)
+        self.connection.resume_http2()
+
+    def _respond(self, stream: Stream, response: Response) -> None:
+        stream.response = response
+        stream.parts = response.parts[::-1]
+        stream.remaining = response.length - len(response.head)
+        stream.header.responded_at = time.monotonic()
+        self.h2.send_headers(stream.id, _fields(response.head), end_stream=not stream.remaining)
+        first_byte(stream.header, time.monotonic())
+        if stream.remaining:
+            self._ready.append(stream)
+        else:
+            self._finish(stream)
+
+    def _pump(self) -> None:
+        self._pumping = True
+        try:
+            self._generate()
+        finally:
+            self._pumping = False
+
+    def _generate(self) -> None:
+        # one DATA frame per stream in turn, until enough waits for the socket
+        queued = len(self._out)
+        while self._ready and self._greeted and queued < OUTPUT_HIGH_WATER:
+            stream = self._ready.popleft()
+            if self.streams.get(stream.id) is not stream:
+                continue
+            size = min(
+                self.h2.local_flow_control_window(stream.id), self.h2.max_outbound_frame_size
+            )
+            if size <= 0:
+                self._blocked.append(stream)
+                continue
+            try:
+                chunk = stream.take(min(size, stream.remaining))
+            except Exception:
+                logger.exception("HTTP2StreamError")
+                self.h2.reset_stream(stream.id)
+                self._drop(stream.id)
+                continue
+            if chunk is None:
+                # parked until _filled, the other streams go on sending
+                self._read(stream)
+                continue
+            stream.remaining -= len(chunk)
+            self.h2.send_data(stream.id, chunk, end_stream=not stream.remaining)
+            queued += len(chunk)
+            if stream.remaining:
+                self._ready.append(stream)
+            else:
+                self._finish(stream)
+
+    def _read(self, stream: Stream) -> None:
+        # file reads never run on the event loop, see blocking_pool
+        start, end = stream.parts[-1]
+        blocking_pool.submit(
+            partial(_read_range, stream.response.file, start, min(end, start + READ_AHEAD)),
+            partial(self._filled, stream),
+        )
+
+    def _filled(self, stream: Stream, chunk: bytes | None, error: BaseException | None) -> None:
+        if self.connection.closed or self.streams.get(stream.id) is not stream:
+            # the connection or the stream was reset while it waited
+            return
+        if error is not None:
+            logger.error("HTTP2StreamError", exc_info=error)
+            self.h2.reset_stream(stream.id)
+            self._drop(stream.id)
+        else:
+            stream.buffer = memoryview(chunk)
+            self._ready.append(stream)
+        if not self._pumping:
+            self.connection.resume_http2()
+
+    def _unblock(self, stream_id: int) -> None:
+        # a connection level WINDOW_UPDATE (stream 0) can unblock every stream
+        if stream_id == 0:
+            self._ready.extend(self._blocked)
+            self._blocked.clear()
+        else:
+            for stream in self._blocked:
+                if stream.id == stream_id:
+                    self._blocked.remove(stream)
+                    self._ready.append(stream)
+                    break
+
+    def _finish(self, stream: Stream) -> None:
+        del self.streams[stream.id]
+        response = stream.response
+        # until the last DATA frame was generated, the socket may still hold some of it
+        record(
+            self.connection.peer, stream.header, response.status, response.length, time.monotonic()
+        )
+        response.release()
+
+    def _drop(self, stream_id: int) -> None:
+        stream = self.streams.pop(stream_id, None)
+        if stream is not None and stream.response is not None:
+            stream.response.release()
+
+
+def _read_range(file, start: int, end: int) -> bytes:
+    # runs on the blocking pool
+    chunk = os.pread(file.fileno(), end - start, start)
+    if not chunk:
+        # the file was truncated after content-length went out
+        raise EOFError(f"{file.name} ended at offset {start}")
+    return chunk
+
+
+def _fields(head: bytes) -> list[tuple[bytes, bytes]]:
+    # the HTTP/1.1 head build_response made, as HTTP/2 header fields
+    status_line, *lines = head.split(b"\r\n")
+    fields = [(b":status", status_line[9:12])]
+    for line in lines:
+        if not line:
+            break
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name not in CONNECTION_FIELDS:
+            fields.append((name, value.strip()))
+    return fields
@@ -0,0 +1,260 @@
+import time
+import socket
+import asyncio
+from collections import deque
+from config import CONFIG
+from http.client import HTTPMessage
+from functools import partial
+from util import logger, TimerWheel, blocking_pool
+from .request_parser import RequestParser, RequestError
+from .response import Response, PendingBody, build_response, finish_response
+from .connection import connection_deadline
+from .accounting import admit, release, rejected, throttle, first_byte, record
+
+
+class HTTPProtocol(asyncio.Protocol):
+    """A connection on the asyncio engine (engine: asyncio in severt.yml).
+
+    Requests go through the same parser and build_response as on the
+    selectors engine. Responses are handed to the transport, which buffers
+    what the socket can't take yet; once that buffer passes the high
+    watermark pause_writing holds back the next response until it drains.
+    File ranges go out through loop.sendfile.
+    """
+
+    __slots__ = (
+        "timers",
+        "loop",
+        "transport",
+        "peer",
+        "_parser",
+        "_pending",
+        "_write_paused",
+        "_read_paused",
+        "_sendfile_task",
+        "_parked",
+        "_open",
+        "last_activity",
+        "last_progress",
+        "request_started",
+    )
+
+    # file ranges are sent in pieces so the reaper sees progress on long downloads
+    SENDFILE_CHUNK = 1024 * 1024
+
+    def __init__(self, timers: TimerWheel) -> None:
+        self.timers = timers
+        self.loop = asyncio.get_running_loop()
+        self.transport: asyncio.Transport | None = None
+        self.peer = ""
+        self._parser: RequestParser | None = RequestParser(
+            CONFIG.limits["header_bytes"], CONFIG.limits["body_bytes"]
+        )
+        # parsed requests waiting for their response, in order
+        self._pending: deque[HTTPMessage] = deque()
+        self._write_paused = False
+        self._read_paused = False
+        self._sendfile_task: asyncio.Task | None = None
+        # waiting for the blocking pool to load a response body
+        self._parked = False
+        self._open = False
+        # monotonic timestamps read by the idle connection reaper, see Connection
+        self.last_activity: float = time.monotonic()
+        self.last_progress: float = 0
+        self.request_started: float = 0
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.peer = transport.get_extra_info("peername")[0]
+        if (refusal := admit(self.peer)) is not None:
+            # what admit() refused the connection with, nothing when it is just dropped
+            if refusal:
+                transport.write(refusal)
+                transport.close()
+            else:
+                transport.abort()
+            return
+        if not CONFIG.listener["nodelay"]:
+            # the event loop turns Nagle's algorithm off on every connection
+            transport.get_extra_info("socket").setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 0
+            )
+        self._open = True
+        transport.set_write_buffer_limits(
+            high=CONFIG.asyncio["write_high_water"], low=CONFIG.asyncio["write_low_water"]
+        )
+        self.timers.schedule(self._deadline(), self._reap)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if self._open:
+            self._open = False
+            release()
+        self._pending.clear()
+        if self._sendfile_task:
+            self._sendfile_task.cancel()
+
+    def data_received(self, data: bytes) -> None:
+        if self._parser is None:
+            # the request was rejected, anything that follows is discarded
+            return
+        self.last_activity = time.monotonic()
+        try:
+            # every complete request in the buffer is queued in order,
+            # pipelined requests included
+            for header in self._parser.feed(data):
+                # response latency in the metrics is measured from here
+                header.received_at = self.last_activity
+                if throttle(self.peer, header):
+                    self._reject(header)
+                    return
+                self._pending.append(header)
+        except RequestError as error:
+            self._reject(rejected(error.status, self.last_activity))
+            return
+        if not self._parser.in_progress:
+            self.request_started = 0
+        elif not self.request_started:
+            self.request_started = self.last_activity
+        if len(self._pending) >= CONFIG.max_pending_requests and not self._read_paused:
+            # stop reading until the responses catch up
+            self._read_paused = True
+            self.transport.pause_reading()
+        self._respond()
+
+    def pause_writing(self) -> None:
+        self._write_paused = True
+
+    def resume_writing(self) -> None:
+        self._write_paused = False
+        self.last_progress = time.monotonic()
+        self._respond()
+
+    def _reject(self, header: HTTPMessage) -> None:
+        # answered once the requests before it are done,
+        # nothing more is read from a connection whose framing is lost
+        self._parser = None
+        self._pending.append(header)
+        if not self._read_paused:
+            self._read_paused = True
+            self.transport.pause_reading()
+        self._respond()
+
+    def _respond(self) -> None:
+        # bodies in memory are written right away, only file ranges need a task
+        while (
+            self._pending
+            and not self._write_paused
+            and self._sendfile_task is None
+            and not self._parked
+            and not self.transport.is_closing()
+        ):
+            header = self._pending.popleft()
+            response = build_response(header, self.peer)
+            if isinstance(response, PendingBody):
+                # parked until the blocking pool has the file, see _resume
+                self._parked = True
+                blocking_pool.submit(response.load, partial(self._resume, header, response))
+                return
+            if not self._send(response, header):
+                return
+        if (
+            self._read_paused
+            and self._parser is not None
+            and len(self._pending) < CONFIG.max_pending_requests
+            and not self.transport.is_closing()
+        ):
+            self._read_paused = False
+            self.transport.resume_reading()
+
+    def _resume(self, header: HTTPMessage, pending: PendingBody, loaded, error: BaseException | None) -> None:
+        self._parked = False
+        response = finish_response(pending, loaded, error)
+        if not self._open or self.transport.is_closing():
+            # reaped or reset while it waited
+            response.release()
+            return
+        if self._send(response, header):
+            self._respond()
+
+    def _send(self, response: Response, header: HTTPMessage) -> bool:
+        # False when the next response has to wait, for a sendfile task or forever
+        self.last_progress = header.responded_at = time.monotonic()
+        first_byte(header, self.last_progress)
+        if response.file:
+            self.transport.write(response.head)
+            self._sendfile_task = self.loop.create_task(self._sendfile(response, header))
+            return False
+        if response.mapped:
+            # writelines would join a mapped body into one copy, separate writes
+            # only copy what the socket doesn't take right away
+            self.transport.write(response.head)
+            for part in response.parts:
+                self.transport.write(part)
+            response.release()
+        else:
+            self.transport.writelines((response.head, *response.parts))
+        record(self.peer, header, response.status, response.length, time.monotonic())
+        if response.close:
+            self.transport.close()
+            return False
+        return True
+
+    async def _sendfile(self, response: Response, header: HTTPMessage) -> None:
+        # parts in memory go through the transport, file ranges through loop.sendfile,
+        # which waits for the transport's buffer to drain first
+        try:
+            for part in response.parts:
+                if not isinstance(part, tuple):
+                    self.transport.write(part)
+                    continue
+                offset, end = part
+                while offset < end:
+                    sent = await self.loop.sendfile(
+                        self.transport,
+                        response.file,
+                        offset,
+                        min(self.SENDFILE_CHUNK, end - offset),
+                    )
+                    if sent == 0:
+                        # the file was truncated after content-length went out
+                        raise EOFError(f"{response.file.name} ended at offset {offset}")
+                    offset += sent
+                    self.last_progress = time.monotonic()
+        except (ConnectionError, RuntimeError):
+            # the client went away, RuntimeError is raised for a closing transport
+            self.transport.abort()
+            return
+        except Exception:
+            logger.exception("SendfileError")
+            self.transport.abort()
+            return
+        finally:
+            response.release()
+            self._sendfile_task = None
+        record(self.peer, header, response.status, response.length, time.monotonic())
+        if response.close:
+            self.transport.close()
+        else:
+            self._respond()
+
+    def _deadline(self) -> float:
+        return connection_deadline(
+            bool(
+                self._pending
+                or self._sendfile_task
+                or self._parked
+                or self.transport.get_write_buffer_size()
+            ),
+            self.request_started,
+            max(self.last_activity, self.last_progress),
+        )
+
+    def _reap(self) -> None:
+        # timers are never cancelled, a connection that was already closed is simply dropped
+        if not self._open or self.transport.is_closing():
+            return
+        deadline = self._deadline()
+        if time.monotonic() < deadline:
+            self.timers.schedule(deadline, self._reap)
+        else:
+            self.transport.abort()
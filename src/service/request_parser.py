@@ -0,0 +1,204 @@
+import time
+from typing import Iterator
+from http.client import HTTPMessage
+from util import profiler
+
+CRLF = b"\r\n"
+HEADER_END = b"\r\n\r\n"
+
+# parser states
+HEAD, BODY, CHUNK_SIZE, CHUNK_DATA, CHUNK_END, TRAILER = range(6)
+
+
+class RequestError(Exception):
+    """A request that can't be parsed, answered with `status` before the connection is closed."""
+
+    def __init__(self, status: str) -> None:
+        super().__init__(status)
+        self.status = status
+
+
+class RequestParser:
+    """Incremental HTTP/1.1 request parser.
+
+    Bytes are appended to a bytearray and a scan cursor remembers how far
+    the buffer was already searched, so every byte is only looked at once
+    no matter how many recv() calls a request is split over. Each complete
+    request (pipelined ones included) is yielded in order as an HTTPMessage
+    with the "Method" and "Location" keys the rest of the service expects
+    and the body, if any, as its payload.
+    """
+
+    __slots__ = (
+        "max_header_bytes",
+        "max_body_bytes",
+        "_buffer",
+        "_cursor",
+        "_scan",
+        "_state",
+        "_header",
+        "_body",
+        "_remaining",
+    )
+
+    def __init__(self, max_header_bytes: int, max_body_bytes: int) -> None:
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self._buffer = bytearray()
+        # start of the bytes that were not consumed yet
+        self._cursor = 0
+        # where the next search for a delimiter starts
+        self._scan = 0
+        self._state = HEAD
+        self._header: HTTPMessage | None = None
+        self._body = bytearray()
+        # body or chunk bytes still expected
+        self._remaining = 0
+
+    def reset(self) -> None:
+        # back to a fresh parser so it can be reused by another connection
+        self._buffer.clear()
+        self._cursor = self._scan = 0
+        self._state = HEAD
+        self._header = None
+        self._body.clear()
+        self._remaining = 0
+
+    @property
+    def in_progress(self) -> bool:
+        # true while part of a request sits in the buffer
+        return self._state != HEAD or self._cursor < len(self._buffer)
+
+    def feed(self, data: bytes) -> Iterator[HTTPMessage]:
+        self._buffer += data
+        while True:
+            if self._state == HEAD:
+                end = self._buffer.find(HEADER_END, self._scan)
+                if end == -1:
+                    if len(self._buffer) - self._cursor > self.max_header_bytes:
+                        raise RequestError("431 Request Header Fields Too Large")
+                    # the delimiter may straddle two reads
+                    self._scan = max(self._cursor, len(self._buffer) - len(HEADER_END) + 1)
+                    break
+                if end - self._cursor > self.max_header_bytes:
+                    raise RequestError("431 Request Header Fields Too Large")
+                if profiler.timing:
+                    started = time.perf_counter()
+                    self._header = self._parse_head(self._buffer[self._cursor : end])
+                    profiler.record("parse", time.perf_counter() - started)
+                else:
+                    self._header = self._parse_head(self._buffer[self._cursor : end])
+                self._cursor = self._scan = end + len(HEADER_END)
+                self._state = self._body_state()
+            elif self._state == BODY:
+                if not self._take_body():
+                    break
+            elif self._state == CHUNK_SIZE:
+                line = self._take_line()
+                if line is None:
+                    break
+                size = line.split(b";", 1)[0].strip()
+                try:
+                    self._remaining = int(size, 16)
+                except ValueError:
+                    raise RequestError("400 Bad Request")
+                if len(self._body) + self._remaining > self.max_body_bytes:
+                    raise RequestError("413 Content Too Large")
+                self._state = CHUNK_DATA if self._remaining else TRAILER
+            elif self._state == CHUNK_DATA:
+                if not self._take_body():
+                    break
+                self._state = CHUNK_END
+            elif self._state == CHUNK_END:
+                line = self._take_line()
+                if line is None:
+                    break
+                if line:
+                    raise RequestError("400 Bad Request")
+                self._state = CHUNK_SIZE
+            elif self._state == TRAILER:
+                # trailer fields are read past and dropped, an empty line ends the body
+                line = self._take_line()
+                if line is None:
+                    break
+                if not line:
+                    self._state = BODY
+                    self._remaining = 0
+            if self._state == BODY and not self._remaining:
+                yield self._complete()
+        self._compact()
+
+    def _parse_head(self, head: bytearray) -> HTTPMessage:
+        start_line, *lines = bytes(head).split(CRLF)
+        try:
+            method, location, version = start_line.decode("utf-8").split(" ")
+        except ValueError:
+            raise RequestError("400 Bad Request")
+        if not version.startswith("HTTP/1."):
+            raise RequestError("505 HTTP Version Not Supported")
+        header = HTTPMessage()
+        for line in lines:
+            name, sep, value = line.decode("latin-1").partition(":")
+            # obsolete line folding is rejected, RFC 9112 section 5.2
+            if not sep or not name or name[0] in " \t":
+                raise RequestError("400 Bad Request")
+            header[name] = value.strip(" \t")
+        # the service keeps request metadata next to the headers,
+        # a client can't smuggle those names in
+        for name in ("Method", "Location", "Error"):
+            del header[name]
+        header["Method"] = method
+        header["Location"] = location
+        return header
+
+    def _body_state(self) -> int:
+        transfer_encoding = self._header.get("Transfer-Encoding")
+        content_length = self._header.get("Content-Length")
+        if transfer_encoding is not None:
+            # a request with both is a classic smuggling vector
+            if content_length is not None or transfer_encoding.lower() != "chunked":
+                raise RequestError("400 Bad Request")
+            return CHUNK_SIZE
+        if content_length is not None:
+            if not content_length.isdigit():
+                raise RequestError("400 Bad Request")
+            self._remaining = int(content_length)
+            if self._remaining > self.max_body_bytes:
+                raise RequestError("413 Content Too Large")
+        return BODY
+
+    def _take_body(self) -> bool:
+        # copies up to the expected number of body bytes, true once they all arrived
+        available = min(self._remaining, len(self._buffer) - self._cursor)
+        self._body += self._buffer[self._cursor : self._cursor + available]
+        self._cursor += available
+        self._remaining -= available
+        self._scan = self._cursor
+        return not self._remaining
+
+    def _take_line(self) -> bytes | None:
+        end = self._buffer.find(CRLF, self._scan)
+        if end == -1:
+            if len(self._buffer) - self._cursor > self.max_header_bytes:
+                raise RequestError("400 Bad Request")
+            self._scan = max(self._cursor, len(self._buffer) - 1)
+            return None
+        line = bytes(self._buffer[self._cursor : end])
+        self._cursor = self._scan = end + len(CRLF)
+        return line
+
+    def _complete(self) -> HTTPMessage:
+        header = self._header
+        if self._body:
+            header.set_payload(bytes(self._body))
+            self._body = bytearray()
+        self._header = None
+        self._state = HEAD
+        return header
+
+    def _compact(self) -> None:
+        # drop consumed bytes once per feed so only a partial request is ever moved
+        if self._cursor:
+            del self._buffer[: self._cursor]
+            self._scan -= self._cursor
+            self._cursor = 0
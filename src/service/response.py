@@ -0,0 +1,409 @@
+import os
+import math
+import time
+from io import BufferedReader
+from config import CONFIG
+from urllib.parse import unquote, parse_qs
+from http.client import HTTPMessage
+from util import (
+    content_cache,
+    mapped_files,
+    map_file,
+    MappedFile,
+    etag_matches,
+    not_modified_since,
+    static_index,
+    Representation,
+    static_bundle,
+    PackedFile,
+    STATUS_OK,
+    STATUS_PARTIAL_CONTENT,
+    date_cache,
+    response_head,
+    not_modified_head,
+    content_range,
+    multipart_head,
+    multipart_part,
+    range_not_satisfiable_head,
+    parse_range,
+    is_valid_request,
+    metrics,
+    profiler,
+    PROFILE_KINDS,
+)
+
+# sent to connections over listener.max_connections before they are closed
+OVERLOADED = b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+METRICS_HEAD = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nCache-Control: no-store\r\n"
+PROFILE_HEAD = b"Content-Type: text/plain; charset=utf-8\r\nCache-Control: no-store\r\n"
+# location.bundle serves a bundle built by `main.py pack` instead of the static directory
+STATIC = static_bundle if static_bundle.path else static_index
+
+
+# a part of a response body, bytes held in memory or a [start, end) range of Response.file
+Part = bytes | memoryview | tuple[int, int]
+
+
+class Response:
+    """Everything that goes out for one request, independent of how it is sent:
+    the head and the body as parts, sent one after the other. File ranges
+    go out through sendfile as the socket drains, so a response costs the
+    same memory whatever its size. Parts sliced from a mapped file keep a
+    reference to the mapping until release()."""
+
+    __slots__ = ("head", "parts", "file", "mapped", "close")
+
+    def __init__(
+        self,
+        head: bytes,
+        parts: list[Part] | None = None,
+        file: BufferedReader | None = None,
+        mapped: MappedFile | None = None,
+        close: bool = False,
+    ) -> None:
+        self.head = head
+        self.parts = parts or []
+        self.file = file
+        self.mapped = mapped
+        # error responses and OPTIONS close the connection once they are written
+        self.close = close
+
+    @property
+    def length(self) -> int:
+        # bytes of the head and body
+        return len(self.head) + sum(
+            part[1] - part[0] if isinstance(part, tuple) else len(part) for part in self.parts
+        )
+
+    @property
+    def status(self) -> int:
+        # every head starts with b"HTTP/1.1 " followed by the status code
+        return int(self.head[9:12])
+
+    def release(self) -> None:
+        # once the body is written, or the connection is gone
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.mapped:
+            self.mapped.release()
+            self.mapped = None
+
+
+class PendingBody:
+    """The body of a response that needs the file system first, built in two steps
+    so the blocking one can run on the blocking pool.
+
+    load() opens, reads or maps the file and touches nothing else, finish()
+    then runs on the event loop, fills the cache and returns the response.
+    """
+
+    __slots__ = ("head", "layout", "representation")
+
+    def __init__(self, head: bytes, layout: list[Part], representation: Representation) -> None:
+        self.head = head
+        self.layout = layout
+        self.representation = representation
+
+    def load(self) -> bytes | MappedFile | BufferedReader:
+        if profiler.timing:
+            started = time.perf_counter()
+            loaded = self._load()
+            profiler.record("read", time.perf_counter() - started)
+            return loaded
+        return self._load()
+
+    def _load(self) -> bytes | MappedFile | BufferedReader:
+        representation = self.representation
+        if representation.size <= content_cache.max_entry_bytes:
+            file = open(representation.full_path, mode="rb")
+            try:
+                stat = os.fstat(file.fileno())
+                if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == representation.version:
+                    content = file.read()
+                    # a write in place can still change it while it is read
+                    if len(content) == representation.size:
+                        file.close()
+                        return content
+            except BaseException:
+                file.close()
+                raise
+            # changed since the static index saw it, sent from the file like map_file()'s
+            # fallback so bytes of another version are never cached or framed as this one
+            return file
+        if representation.size <= mapped_files.max_entry_bytes and (
+            mapped := map_file(representation.full_path, representation.version)
+        ):
+            return mapped
+        return open(representation.full_path, mode="rb")
+
+    def finish(self, loaded: bytes | MappedFile | BufferedReader) -> Response:
+        representation = self.representation
+        if isinstance(loaded, bytes):
+            # compressed variants are sidecar files (see `main.py compress`) and cached under their own path
+            content_cache.put(representation.full_path, representation.version, loaded)
+            return Response(self.head, _slices(memoryview(loaded), self.layout))
+        if isinstance(loaded, MappedFile):
+            mapped = mapped_files.add(representation.full_path, loaded)
+            return Response(self.head, _slices(mapped.view, self.layout), mapped=mapped)
+        return Response(self.head, self.layout, loaded)
+
+
+def error_response(status: str, extra: str = "") -> Response:
+    return Response(
+        str.encode(f"HTTP/1.1 {status}\r\n{extra}Connection: close\r\n\r\n"), close=True
+    )
+
+
+def build_response(header: HTTPMessage, peer: str) -> Response | PendingBody:
+    """Answers a parsed request, both server engines send what this returns.
+
+    A PendingBody is finished with finish_response() once its load() ran on
+    the blocking pool."""
+    if profiler.timing:
+        started = time.perf_counter()
+        response = _build_response(header, peer)
+        profiler.record("negotiate", time.perf_counter() - started)
+        return response
+    return _build_response(header, peer)
+
+
+def _build_response(header: HTTPMessage, peer: str) -> Response | PendingBody:
+    try:
+        if error := header.get("Error"):
+            # the request was rejected while reading, see Connection._reject
+            retry_after = header.get("Retry-After")
+            return error_response(
+                error, f"Retry-After: {retry_after}\r\n" if retry_after else ""
+            )
+        if not _is_valid_headers(header):
+            # malformed headers
+            return error_response("400 Bad Request")
+        method = header.get("Method")
+        if method in ("GET", "HEAD") and _is_metrics_request(header, peer):
+            return _metrics_request(method == "HEAD")
+        if method == "GET" and _is_profile_request(header, peer):
+            return _profile_request(header)
+        if method == "GET":
+            return _get_request(header)
+        if method == "OPTIONS":
+            return Response(
+                b"HTTP/1.1 200 OK\r\nAllow: OPTIONS, GET, HEAD\r\n\r\n", close=True
+            )
+        if method == "HEAD":
+            return _head_request(header)
+        # For methods outside of GET,OPTIONS,HEAD
+        return error_response("405 Method Not Allowed")
+    except FileNotFoundError:
+        return error_response("404 Not Found")
+    except Exception:
+        return error_response("500 Internal Server Error")
+
+
+def finish_response(
+    pending: PendingBody, loaded: bytes | MappedFile | BufferedReader | None, error: BaseException | None
+) -> Response:
+    if error is None:
+        return pending.finish(loaded)
+    if isinstance(error, FileNotFoundError):
+        # removed after the static index saw it
+        return error_response("404 Not Found")
+    return error_response("500 Internal Server Error")
+
+
+def _is_valid_headers(header: HTTPMessage) -> bool:
+    try:
+        return is_valid_request(header)
+    except Exception:
+        return False
+
+
+def _get_request(header: HTTPMessage) -> Response:
+    representation = _content_negotiation(header)
+    date = date_cache.get()
+    if _is_not_modified(header, representation):
+        return Response(not_modified_head(representation, date))
+    size = representation.size
+    ranges = None
+    if (range_header := header.get("Range")) and _if_range_matches(header, representation):
+        ranges = parse_range(range_header, size)
+        if ranges == []:
+            return Response(range_not_satisfiable_head(representation, date))
+        if ranges and len(ranges) > 1 and representation.encoding != "identity":
+            # the parts of a multipart body can't carry a content-coding,
+            # the whole representation is sent instead
+            ranges = None
+    if not ranges:
+        head = response_head(STATUS_OK, representation, date, size)
+        layout: list[Part] = [(0, size)]
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        head = response_head(
+            STATUS_PARTIAL_CONTENT,
+            representation,
+            date,
+            end - start,
+            content_range(start, end, size),
+        )
+        layout = [(start, end)]
+    else:
+        head, layout = _multipart(representation, ranges, date)
+    if isinstance(representation, PackedFile):
+        return _packed_response(head, layout, representation)
+    # small files are served from the cache, header and body in one sendmsg
+    if size <= content_cache.max_entry_bytes:
+        if (content := content_cache.get(representation.full_path, representation.version)) is not None:
+            return Response(head, _slices(memoryview(content), layout))
+    # mid-size ones from a mapping shared with the other workers,
+    # acquired last so nothing above can leave it referenced
+    elif size <= mapped_files.max_entry_bytes and (
+        mapped := mapped_files.get(representation.full_path, representation.version)
+    ):
+        return Response(head, _slices(mapped.view, layout), mapped=mapped)
+    # anything else waits for the file system
+    return PendingBody(head, layout, representation)
+
+
+def _packed_response(head: bytes, layout: list[Part], packed: PackedFile) -> Response:
+    # the ranges are moved to where the file starts in the bundle, which is always mapped
+    bundle = packed.bundle
+    layout = [
+        (part[0] + packed.offset, part[1] + packed.offset) if isinstance(part, tuple) else part
+        for part in layout
+    ]
+    if packed.size <= mapped_files.max_entry_bytes:
+        return Response(head, _slices(bundle.view, layout), mapped=bundle.acquire())
+    # larger ones go out through sendfile like any other large file, from a
+    # descriptor of its own that keeps this bundle open when a new one is swapped in
+    return Response(head, layout, os.fdopen(os.dup(bundle.file.fileno()), mode="rb"))
+
+
+def _slices(content: memoryview, layout: list[Part]) -> list[Part]:
+    # file ranges of the layout as slices of content held in memory, no bytes are copied
+    return [
+        content[part[0] : part[1]] if isinstance(part, tuple) else part for part in layout
+    ]
+
+
+def _multipart(
+    representation: Representation, ranges: list[tuple[int, int]], date: bytes
+) -> tuple[bytes, list[Part]]:
+    # multipart/byteranges, RFC 9110 section 14.6
+    boundary = os.urandom(12).hex().encode()
+    layout: list[Part] = []
+    length = 0
+    for start, end in ranges:
+        delimiter = multipart_part(representation, boundary, start, end)
+        layout += [delimiter, (start, end)]
+        length += len(delimiter) + end - start
+    closing = b"\r\n--%s--\r\n" % boundary
+    layout.append(closing)
+    length += len(closing)
+    return multipart_head(representation, boundary, date, length), layout
+
+
+def _content_negotiation(header: HTTPMessage) -> Representation:
+    # the index is built from the static directory or its bundle, so this is a few dict
+    # lookups and a path outside of it can never be resolved
+    location = unquote(header["Location"].split("?", 1)[0])
+    representation = STATIC.negotiate(
+        "/index.html" if location == "/" else location,
+        # Accept is in a format like 'text/html,application/xhtml+xml,application/xml'
+        header.get("Accept"),
+        header.get("Accept-Encoding", ""),
+    )
+    if representation is None:
+        raise FileNotFoundError(location)
+    return representation
+
+
+def _is_not_modified(header: HTTPMessage, representation: Representation) -> bool:
+    # If-None-Match takes precedence, If-Modified-Since is only looked at without it
+    if (if_none_match := header.get("If-None-Match")) is not None:
+        return etag_matches(if_none_match, representation.etag)
+    if if_modified_since := header.get("If-Modified-Since"):
+        return not_modified_since(if_modified_since, representation.mtime)
+    return False
+
+
+def _if_range_matches(header: HTTPMessage, representation: Representation) -> bool:
+    # a Range whose If-Range validator is stale gets the whole file instead
+    if (if_range := header.get("If-Range")) is None:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return etag_matches(if_range, representation.etag, weak=False)
+    return if_range == representation.last_modified
+
+
+def _head_request(header: HTTPMessage) -> Response:
+    # the same header a GET gets, without the body
+    representation = _content_negotiation(header)
+    date = date_cache.get()
+    if _is_not_modified(header, representation):
+        return Response(not_modified_head(representation, date))
+    return Response(response_head(STATUS_OK, representation, date, representation.size))
+
+
+def _is_metrics_request(header: HTTPMessage, peer: str) -> bool:
+    if not CONFIG.metrics["enabled"]:
+        return False
+    if header["Location"].split("?", 1)[0] != CONFIG.metrics["path"]:
+        return False
+    if peer not in CONFIG.metrics["allow"]:
+        # to everyone else the endpoint doesn't exist
+        raise FileNotFoundError(CONFIG.metrics["path"])
+    return True
+
+
+def _metrics_request(head_only: bool) -> Response:
+    body = metrics.render()
+    head = b"%sDate: %s\r\nContent-Length: %d\r\n\r\n" % (
+        METRICS_HEAD,
+        date_cache.get(),
+        len(body),
+    )
+    return Response(head, [] if head_only else [body])
+
+
+def _is_profile_request(header: HTTPMessage, peer: str) -> bool:
+    # the same rules as the metrics endpoint
+    path = CONFIG.profiling["path"]
+    if not path or header["Location"].split("?", 1)[0] != path:
+        return False
+    if peer not in CONFIG.profiling["allow"]:
+        raise FileNotFoundError(path)
+    return True
+
+
+def _profile_request(header: HTTPMessage) -> Response:
+    # ?seconds=N&kind=cpu,memory,phases, the session runs in the worker that answers
+    query = parse_qs(header["Location"].partition("?")[2])
+    kinds = tuple(
+        kind for value in query.get("kind", ["cpu,phases"]) for kind in value.split(",") if kind
+    )
+    try:
+        seconds = float(query.get("seconds", ["0"])[0])
+    except ValueError:
+        seconds = -1
+    # float() takes nan and inf, a timer can't be armed for either
+    if not kinds or not set(kinds) <= set(PROFILE_KINDS) or not math.isfinite(seconds) or seconds < 0:
+        return _text_response(
+            b"400 Bad Request", f"kind is one or more of {', '.join(PROFILE_KINDS)}, seconds a number\n"
+        )
+    if not (seconds := profiler.start(kinds, seconds)):
+        return _text_response(b"409 Conflict", f"already profiling {', '.join(profiler.kinds)}\n")
+    return _text_response(
+        b"202 Accepted",
+        f"profiling {', '.join(kinds)} for {seconds:g}s, the reports go to {CONFIG.location['log']}\n",
+    )
+
+
+def _text_response(status: bytes, text: str) -> Response:
+    body = text.encode()
+    head = b"HTTP/1.1 %s\r\n%sDate: %s\r\nContent-Length: %d\r\n\r\n" % (
+        status,
+        PROFILE_HEAD,
+        date_cache.get(),
+        len(body),
+    )
+    return Response(head, [body])
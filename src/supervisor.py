@@ -0,0 +1,93 @@
+import os
+import time
+import signal
+from typing import Callable
+from util import logger, log_writer, PROFILE_SIGNALS
+
+
+class Supervisor:
+    """Pre-forks worker processes, restarts the ones that crash and
+    forwards shutdown and profiling signals to them.
+
+    Every worker gets a slot number from 0 to workers - 1 that a restarted
+    worker inherits, so per-worker shared state (see util.metrics) survives restarts.
+    """
+
+    __slots__ = ("target", "workers", "_children", "_stopping")
+
+    # a worker that dies sooner than this after being forked is restarted with a delay
+    # so a broken config doesn't turn into a fork loop
+    RESTART_BACKOFF = 1.0
+
+    def __init__(self, target: Callable[[int], None], workers: int) -> None:
+        self.target = target
+        self.workers = workers
+        # maps worker pid to its slot and the monotonic time it was started
+        self._children: dict[int, tuple[int, float]] = {}
+        self._stopping = False
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for signum in PROFILE_SIGNALS:
+            signal.signal(signum, self._forward)
+        for slot in range(self.workers):
+            self._spawn(slot)
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            child = self._children.pop(pid, None)
+            if child is None or self._stopping:
+                continue
+            slot, started = child
+            logger.warning(
+                f"Worker {pid} exited with code {os.waitstatus_to_exitcode(status)}, restarting."
+            )
+            if time.monotonic() - started < self.RESTART_BACKOFF:
+                time.sleep(self.RESTART_BACKOFF)
+            if not self._stopping:
+                self._spawn(slot)
+        logger.info("All workers stopped.")
+
+    def _spawn(self, slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # the supervisor decides when workers stop, ctrl-c in a terminal
+            # reaches the whole process group so it is ignored here
+            signal.signal(signal.SIGTERM, leave_loop)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            # until the worker's loop watches them, see Profiler
+            for signum in PROFILE_SIGNALS:
+                signal.signal(signum, signal.SIG_IGN)
+            exit_code = 0
+            try:
+                self.target(slot)
+            except Exception:
+                logger.exception("WorkerError")
+                exit_code = 1
+            finally:
+                # os._exit() skips atexit, what is still queued is written first
+                signal.signal(signal.SIGTERM, signal.SIG_IGN)
+                log_writer.stop()
+                # never return into the supervisor's stack
+                os._exit(exit_code)
+        self._children[pid] = (slot, time.monotonic())
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+        self._forward(signal.SIGTERM, frame)
+
+    def _forward(self, signum, frame) -> None:
+        for pid in self._children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+
+def leave_loop(signum, frame) -> None:
+    # SIGTERM unwinds the event loop instead of killing the process, so the
+    # log writer gets to drain the queue before it exits
+    raise SystemExit(0)
@@ -1,4 +1,29 @@
-from .logger import logger
-from .pending_writes import pendingWrites
+from .logger import logger, log_access, queue_handler, log_writer
 from .mime import mime_mapping, content_type_mapping
-from .instance_ids import write_instance_ids, read_instance_ids
+from .send_queue import SendQueue
+from .pool import ObjectPool
+from .timer_wheel import TimerWheel
+from .content_cache import content_cache
+from .mapped_files import mapped_files, map_file, MappedFile
+from .compression import SIDECARS, is_compressible, preferred_encodings, compress_tree
+from .validators import etag_matches, not_modified_since
+from .static_index import static_index, Representation
+from .bundle import static_bundle, PackedFile, pack_tree
+from .headers import (
+    STATUS_OK,
+    STATUS_PARTIAL_CONTENT,
+    date_cache,
+    response_head,
+    not_modified_head,
+    content_range,
+    multipart_head,
+    multipart_part,
+    range_not_satisfiable_head,
+    is_valid_request,
+)
+from .ranges import parse_range
+from .rate_limit import rate_limiter
+from .metrics import metrics, CACHE_STATS, MAPPED_STATS
+from .analytics import summarize
+from .blocking_pool import blocking_pool
+from .profiler import profiler, PROFILE_KINDS, PROFILE_SIGNALS
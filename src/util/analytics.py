@@ -0,0 +1,87 @@
+import os
+import json
+from collections import Counter
+from typing import Iterator
+
+
+class EndpointStats:
+    __slots__ = ("requests", "errors", "bytes", "duration_ms")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.duration_ms = 0.0
+
+
+def access_logs(directory: str, since: str = "") -> list[str]:
+    # access-<date>.log and its .1, .2 ... parts, oldest first
+    names = [
+        name
+        for name in os.listdir(directory)
+        if name.startswith("access-") and name.endswith(".log") and name[7:17] >= since
+    ]
+    names.sort(key=lambda name: (name[7:17], int(name[18:-4] or 0)))
+    return [os.path.join(directory, name) for name in names]
+
+
+def read_entries(paths: list[str]) -> Iterator[dict]:
+    # one line at a time, a month of logs never has to fit in memory
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash
+                    continue
+
+
+def summarize(directory: str, since: str = "", top: int = 10) -> str:
+    """Usage report over the access logs: totals, status codes, the busiest
+    endpoints and the ones failing most often."""
+    paths = access_logs(directory, since)
+    endpoints: dict[str, EndpointStats] = {}
+    statuses: Counter[int] = Counter()
+    peers: set[str] = set()
+    for entry in read_entries(paths):
+        # the query string doesn't make a different endpoint
+        path = entry["path"].split("?", 1)[0]
+        if (stats := endpoints.get(path)) is None:
+            stats = endpoints[path] = EndpointStats()
+        stats.requests += 1
+        stats.errors += entry["status"] >= 400
+        stats.bytes += entry["bytes"]
+        stats.duration_ms += entry["duration_ms"]
+        statuses[entry["status"]] += 1
+        peers.add(entry["peer"])
+    total = sum(statuses.values())
+    if not total:
+        return f"No requests in {len(paths)} access log file(s)."
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    lines = [
+        f"{total} requests from {len(peers)} client(s) in {len(paths)} file(s), "
+        f"error rate {errors / total:.2%}",
+        "",
+        "Status codes:",
+    ]
+    lines += [f"  {status}  {count:>10}  {count / total:7.2%}" for status, count in sorted(statuses.items())]
+    lines += ["", f"Top {top} endpoints:"]
+    busiest = sorted(endpoints.items(), key=lambda item: item[1].requests, reverse=True)
+    lines += [
+        f"  {stats.requests:>10}  {stats.errors / stats.requests:7.2%} errors  "
+        f"{stats.duration_ms / stats.requests:8.2f} ms  {stats.bytes / 2**20:10.1f} MB  {path}"
+        for path, stats in busiest[:top]
+    ]
+    failing = sorted(
+        ((path, stats) for path, stats in endpoints.items() if stats.errors),
+        key=lambda item: (item[1].errors / item[1].requests, item[1].errors),
+        reverse=True,
+    )
+    if failing:
+        lines += ["", f"Top {top} endpoints by error rate:"]
+        lines += [
+            f"  {stats.errors / stats.requests:7.2%}  {stats.errors:>10} of {stats.requests:<10}  {path}"
+            for path, stats in failing[:top]
+        ]
+    return "\n".join(lines)
@@ -0,0 +1,138 @@
+import os
+import time
+import queue
+import socket
+import threading
+from collections import deque
+from typing import Any, Callable
+from config import CONFIG
+from .metrics import metrics
+
+QUEUE_DEPTH = metrics.offset("severt_pool_queue_depth")
+JOBS = metrics.offset("severt_pool_jobs_total")
+INLINE = metrics.offset("severt_pool_inline_total")
+WAIT_TIME = metrics.offset("severt_pool_wait_seconds")
+
+# callback(result, error), error is None when the job succeeded
+Callback = Callable[[Any, BaseException | None], None]
+
+
+class BlockingPool:
+    """A few threads for the file system work that would stall the event loop.
+
+    Jobs only touch files, everything they produce is handed back to the
+    event loop: finished jobs are queued and the loop is woken through a
+    file descriptor it watches next to the sockets (an eventfd where there
+    is one, a socketpair elsewhere). run_completions() then calls every
+    callback on the loop's thread, so nothing else needs a lock. A
+    connection waiting for a job isn't polled, it is only woken by its
+    callback.
+
+    When the queue is full the job runs right away on the caller's thread,
+    the loop slows down instead of piling up work it can't keep up with.
+    """
+
+    __slots__ = (
+        "threads",
+        "_jobs",
+        "_done",
+        "_signaled",
+        "_workers",
+        "_read_fd",
+        "_write_fd",
+        "_sockets",
+    )
+
+    def __init__(self, threads: int, queue_size: int) -> None:
+        self.threads = threads
+        self._jobs: queue.Queue = queue.Queue(queue_size)
+        # (callback, result, error, waited) of finished jobs, appended by the threads
+        self._done: deque = deque()
+        # a wakeup is pending, the threads skip writing another one
+        self._signaled = False
+        self._workers: list[threading.Thread] = []
+        self._sockets: tuple[socket.socket, socket.socket] | None = None
+        self._read_fd = self._write_fd = -1
+
+    def start(self) -> None:
+        # called by each worker process, threads don't survive fork()
+        if not self.threads or self._workers:
+            return
+        if hasattr(os, "eventfd"):
+            self._read_fd = self._write_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        else:
+            self._sockets = socket.socketpair()
+            for sock in self._sockets:
+                sock.setblocking(False)
+            self._read_fd, self._write_fd = (sock.fileno() for sock in self._sockets)
+        for index in range(self.threads):
+            worker = threading.Thread(target=self._work, name=f"blocking-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def fileno(self) -> int:
+        # readable when run_completions() has callbacks to run
+        return self._read_fd
+
+    def submit(self, job: Callable[[], Any], callback: Callback) -> None:
+        metrics.inc(JOBS)
+        if self._workers:
+            try:
+                self._jobs.put_nowait((job, callback, time.monotonic()))
+                metrics.set(QUEUE_DEPTH, self._jobs.qsize())
+                return
+            except queue.Full:
+                metrics.inc(INLINE)
+        try:
+            result = job()
+        except Exception as error:
+            callback(None, error)
+        else:
+            callback(result, None)
+
+    def run_completions(self) -> None:
+        # the wakeup is consumed before the flag is cleared, a thread that finishes in
+        # between sees the flag cleared and writes a new one
+        self._drain()
+        self._signaled = False
+        done = self._done
+        while done:
+            callback, result, error, waited = done.popleft()
+            metrics.observe(WAIT_TIME, waited)
+            callback(result, error)
+        metrics.set(QUEUE_DEPTH, self._jobs.qsize())
+
+    def _work(self) -> None:
+        while True:
+            job, callback, submitted = self._jobs.get()
+            waited = time.monotonic() - submitted
+            try:
+                self._done.append((callback, job(), None, waited))
+            except Exception as error:
+                self._done.append((callback, None, error, waited))
+            if not self._signaled:
+                self._signaled = True
+                self._wake()
+
+    def _wake(self) -> None:
+        if self._sockets is None:
+            os.eventfd_write(self._write_fd, 1)
+        else:
+            try:
+                self._sockets[1].send(b"\0")
+            except BlockingIOError:
+                # the socket is full of wakeups already
+                pass
+
+    def _drain(self) -> None:
+        try:
+            if self._sockets is None:
+                os.eventfd_read(self._read_fd)
+            else:
+                while self._sockets[0].recv(4096):
+                    pass
+        except BlockingIOError:
+            pass
+
+
+blocking_pool = BlockingPool(CONFIG.pool["threads"], CONFIG.pool["queue_size"])
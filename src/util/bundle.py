@@ -0,0 +1,293 @@
+import os
+import mmap
+import zlib
+import struct
+import shutil
+from config import CONFIG
+from .mapped_files import MappedFile
+from .headers import content_headers, cache_headers
+from .compression import is_compressible
+from .static_index import StaticIndex, Representation
+
+# severt bundle, format 1
+MAGIC = b"SEVERTB\x00"
+FORMAT = 1
+# magic, format, hash slots, stems, files, offset of the file contents
+HEADER = struct.Struct("<8sIIIIQ")
+# crc32 of the stem, unused, offset of its record, 0 marks an empty slot
+SLOT = struct.Struct("<IIQ")
+# a stem record starts with the stem's length and how many files share it
+RECORD = struct.Struct("<HH")
+# a file in a record, the length of its url path and how many compressed variants follow it
+FILE = struct.Struct("<HH")
+# offset from the start of the contents, size, mtime, then the lengths of the
+# encoding, content type, etag and last-modified strings that follow
+ENTRY = struct.Struct("<QQdHHHH")
+
+
+class Bundle(MappedFile):
+    """A mapped bundle file. It stays open for the responses sending large
+    entries through sendfile and is closed with the mapping after the last
+    one, so swapping in a new bundle never cuts off a response."""
+
+    __slots__ = ("file",)
+
+    def __init__(self, version: tuple, mapping: mmap.mmap, file) -> None:
+        super().__init__(version, mapping)
+        self.file = file
+
+    def release(self) -> None:
+        super().release()
+        if not self.refs:
+            self.file.close()
+
+
+class PackedFile(Representation):
+    """A file of a bundle, a Representation whose contents are
+    [offset, offset + size) of the bundle instead of a file of its own."""
+
+    __slots__ = ("offset", "bundle")
+
+    def __init__(
+        self,
+        bundle: Bundle,
+        offset: int,
+        size: int,
+        mtime: float,
+        encoding: str,
+        content_type: str,
+        etag: str,
+        last_modified: str,
+    ) -> None:
+        self.bundle = bundle
+        self.offset = offset
+        self.full_path = bundle.file.name
+        self.content_type = content_type
+        self.encoding = encoding
+        self.size = size
+        self.mtime = mtime
+        self.version = (bundle.version, offset)
+        # the validators were taken from the files when the bundle was packed,
+        # moving from the directory to its bundle keeps every etag
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_headers = content_headers(content_type, encoding)
+        self.cache_headers = cache_headers(etag, last_modified, is_compressible(content_type))
+
+
+class StaticBundle(StaticIndex):
+    """Serves the static files from a bundle built by `main.py pack` (see
+    pack_tree) instead of the directory.
+
+    Opening it is one mmap(), nothing is read up front: the hash table
+    sits in the mapping and a stem is decoded into the same dicts the
+    StaticIndex negotiates from the first time it is asked for. The
+    pages are shared by all workers through the page cache. A new bundle
+    renamed over the path is mapped by refresh() and replaces the old one
+    at once, which is unmapped after its last response.
+    """
+
+    __slots__ = ("path", "_bundle", "_slots", "_data")
+
+    def __init__(self, path: str) -> None:
+        super().__init__("")
+        self.path = path
+        self._bundle: Bundle | None = None
+        self._slots = 0
+        self._data = 0
+
+    def __len__(self) -> int:
+        if self._bundle is None:
+            return 0
+        return HEADER.unpack_from(self._bundle.view)[4]
+
+    def scan(self) -> Bundle | None:
+        # maps the bundle if it was replaced, only touches the file so it can run on the blocking pool
+        stat = os.stat(self.path)
+        if self._bundle is not None and self._bundle.version == (
+            stat.st_ino,
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            return None
+        return open_bundle(self.path)
+
+    def apply(self, bundle: Bundle | None) -> int:
+        # swaps in the new bundle, returns how many files it has
+        if bundle is None:
+            return 0
+        previous = self._bundle
+        self._bundle = bundle
+        _, _, self._slots, _, _, self._data = HEADER.unpack_from(bundle.view)
+        # stems decoded from the previous bundle point into it
+        self._files, self._stems, self._encoded = {}, {}, {}
+        if previous is not None:
+            previous.release()
+        return len(self)
+
+    def negotiate(
+        self, path: str, accept: str | None, accept_encoding: str
+    ) -> Representation | None:
+        if path.endswith("/"):
+            path += "index.html"
+        stem, _ = os.path.splitext(path)
+        if stem not in self._stems:
+            self._decode(stem)
+        return super().negotiate(path, accept, accept_encoding)
+
+    def _find(self, key: bytes) -> int:
+        # open addressing with linear probing, returns the offset of the record or 0
+        view = self._bundle.view
+        hashed = zlib.crc32(key)
+        mask = self._slots - 1
+        slot = hashed & mask
+        while True:
+            slot_hash, _, offset = SLOT.unpack_from(view, HEADER.size + slot * SLOT.size)
+            if not offset:
+                return 0
+            if slot_hash == hashed:
+                length, _ = RECORD.unpack_from(view, offset)
+                start = offset + RECORD.size
+                if length == len(key) and view[start : start + length] == key:
+                    return offset
+            slot = (slot + 1) & mask
+
+    def _decode(self, stem: str) -> None:
+        # unknown stems aren't remembered, a scan for missing paths can't grow the dicts
+        offset = self._find(stem.encode("utf-8", "surrogateescape"))
+        if not offset:
+            return
+        view = self._bundle.view
+        length, count = RECORD.unpack_from(view, offset)
+        offset += RECORD.size + length
+        types = self._stems.setdefault(stem, {})
+        for _ in range(count):
+            length, variants = FILE.unpack_from(view, offset)
+            offset += FILE.size
+            url = str(view[offset : offset + length], "utf-8", "surrogateescape")
+            offset += length
+            packed, offset = self._entry(view, offset)
+            self._files[url] = packed
+            types[packed.content_type] = url
+            for _ in range(variants):
+                variant, offset = self._entry(view, offset)
+                self._encoded.setdefault(url, {})[variant.encoding] = variant
+        if len(types) > 1:
+            self._mark_negotiated(stem)
+
+    def _entry(self, view: memoryview, offset: int) -> tuple[PackedFile, int]:
+        start, size, mtime, *lengths = ENTRY.unpack_from(view, offset)
+        offset += ENTRY.size
+        strings = []
+        for length in lengths:
+            strings.append(str(view[offset : offset + length], "latin-1"))
+            offset += length
+        encoding, content_type, etag, last_modified = strings
+        packed = PackedFile(
+            self._bundle, self._data + start, size, mtime, encoding, content_type, etag, last_modified
+        )
+        return packed, offset
+
+
+def open_bundle(path: str) -> Bundle:
+    file = open(path, mode="rb")
+    try:
+        stat = os.fstat(file.fileno())
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except BaseException:
+        file.close()
+        raise
+    magic, version, slots = HEADER.unpack_from(mapping)[:3]
+    if magic != MAGIC or version != FORMAT or slots & (slots - 1):
+        mapping.close()
+        file.close()
+        raise ValueError(
+            f"{path} is not a severt bundle of format {FORMAT}, run `python src/main.py pack`"
+        )
+    return Bundle((stat.st_ino, stat.st_mtime_ns, stat.st_size), mapping, file)
+
+
+def pack_tree(root: str, path: str) -> int:
+    """Packs every file under root and its precompressed sidecars into the
+    bundle at path and returns how many files it holds.
+
+    The bundle is a header, a hash table from each url path without its
+    extension to a record of the files sharing it, the records, and the
+    file contents starting on a page boundary. Content types and
+    validators are stored in the records. It is written next to path and
+    renamed over it, a running server swaps to it on its next refresh.
+    """
+    index = StaticIndex(root)
+    index.refresh()
+    # each file's contents are stored once, a sidecar is both a file and a variant
+    contents: dict[str, tuple[int, Representation]] = {}
+    size = 0
+    for _, representation in index.representations():
+        contents[representation.full_path] = (size, representation)
+        size += representation.size
+
+    def entry(representation: Representation) -> bytes:
+        strings = [
+            value.encode("latin-1")
+            for value in (
+                representation.encoding,
+                representation.content_type,
+                representation.etag,
+                representation.last_modified,
+            )
+        ]
+        return ENTRY.pack(
+            contents[representation.full_path][0],
+            representation.size,
+            representation.mtime,
+            *map(len, strings),
+        ) + b"".join(strings)
+
+    records = []
+    stems: dict[str, list[str]] = {}
+    files = dict(index.representations())
+    for url in files:
+        stems.setdefault(os.path.splitext(url)[0], []).append(url)
+    for stem, urls in stems.items():
+        # the url the index negotiates to for a content type goes last, so it wins again when decoded
+        chosen = set(index.types(stem).values())
+        key = stem.encode("utf-8", "surrogateescape")
+        record = [RECORD.pack(len(key), len(urls)), key]
+        for url in sorted(urls, key=lambda url: url in chosen):
+            encoded_url = url.encode("utf-8", "surrogateescape")
+            variants = index.variants(url)
+            record += [FILE.pack(len(encoded_url), len(variants)), encoded_url, entry(files[url])]
+            record += [entry(variant) for variant in variants.values()]
+        records.append((key, b"".join(record)))
+
+    # at most half full so a missing stem is found after a probe or two
+    slots = 1
+    while slots < 2 * len(records):
+        slots *= 2
+    table = bytearray(slots * SLOT.size)
+    offset = HEADER.size + len(table)
+    for key, record in records:
+        hashed = zlib.crc32(key)
+        slot = hashed & (slots - 1)
+        while SLOT.unpack_from(table, slot * SLOT.size)[2]:
+            slot = (slot + 1) & (slots - 1)
+        SLOT.pack_into(table, slot * SLOT.size, hashed, 0, offset)
+        offset += len(record)
+    data = -(-offset // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    with open(path + ".tmp", mode="wb") as bundle:
+        bundle.write(HEADER.pack(MAGIC, FORMAT, slots, len(records), len(index), data))
+        bundle.write(table)
+        for _, record in records:
+            bundle.write(record)
+        bundle.write(bytes(data - offset))
+        for start, representation in contents.values():
+            with open(representation.full_path, mode="rb") as file:
+                shutil.copyfileobj(file, bundle)
+            if bundle.tell() != data + start + representation.size:
+                raise ValueError(f"{representation.full_path} changed while it was packed")
+    os.replace(path + ".tmp", path)
+    return len(index)
+
+
+static_bundle = StaticBundle(CONFIG.location.get("bundle", ""))
@@ -0,0 +1,128 @@
+import os
+import gzip
+from typing import Callable
+from .mime import mime_mapping
+
+# brotli and zstandard are optional, without them only gzip sidecars are written
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# content-coding -> sidecar suffix, ordered by preference when q-values tie
+SIDECARS = {"br": ".br", "zstd": ".zst", "gzip": ".gz"}
+
+# types worth compressing on top of text/*, formats that are already compressed are left out
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/ld+json",
+    "application/xml",
+    "application/xhtml+xml",
+    "application/vnd.mozilla.xul+xml",
+    "application/rtf",
+    "application/x-sh",
+    "application/x-csh",
+    "application/x-httpd-php",
+    "application/x-tar",
+    "application/vnd.ms-fontobject",
+    "application/msword",
+    "application/vnd.ms-excel",
+    "application/vnd.ms-powerpoint",
+    "image/svg+xml",
+    "image/bmp",
+    "image/vnd.microsoft.icon",
+    "font/otf",
+    "font/ttf",
+    "audio/wav",
+}
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+
+def compressors() -> dict[str, Callable[[bytes], bytes]]:
+    # sidecars are built ahead of time so the slowest, smallest settings are used
+    available = {"gzip": lambda content: gzip.compress(content, 9, mtime=0)}
+    if brotli:
+        available["br"] = lambda content: brotli.compress(content, quality=11)
+    if zstandard:
+        available["zstd"] = zstandard.ZstdCompressor(level=19).compress
+    return available
+
+
+def preferred_encodings(accept_encoding: str) -> list[str]:
+    """Content-codings with a sidecar the client accepts, best first, with
+    "identity" ranked among them.
+
+    Accept-Encoding looks like 'gzip;q=0.8, br, *;q=0.1', a coding without a
+    q-value has q=1 and q=0 means the client refuses it. identity is
+    acceptable unless it is refused explicitly or through '*;q=0'.
+    """
+    qvalues: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        qvalue = 1.0
+        param, _, value = params.partition("=")
+        if param.strip().lower() == "q":
+            try:
+                qvalue = float(value)
+            except ValueError:
+                qvalue = 0.0
+        if coding:
+            qvalues[coding] = qvalue
+    wildcard = qvalues.get("*", 0.0)
+    ranked = [
+        (qvalues.get(coding, wildcard), -order, coding)
+        for order, coding in enumerate(SIDECARS)
+    ]
+    # on a tie any sidecar is preferred over sending the file as is
+    identity = qvalues.get("identity", 0.0 if qvalues.get("*") == 0 else 1.0)
+    ranked.append((identity, -len(SIDECARS), "identity"))
+    return [coding for qvalue, _, coding in sorted(ranked, reverse=True) if qvalue > 0]
+
+
+def compress_tree(root: str) -> int:
+    """Writes a sidecar next to every compressible file under root for each
+    available coding and returns how many were written. Sidecars that are
+    newer than their source are kept, ones that wouldn't be smaller than the
+    source are removed so the original is served instead."""
+    written = 0
+    sidecar_suffixes = tuple(SIDECARS.values())
+    encoders = compressors()
+    for directory, _, files in os.walk(root):
+        for name in files:
+            _, ext = os.path.splitext(name)
+            if name.endswith(sidecar_suffixes) or not is_compressible(
+                mime_mapping.get(ext.lower(), "")
+            ):
+                continue
+            source = os.path.join(directory, name)
+            source_mtime = os.stat(source).st_mtime_ns
+            content = None
+            for coding, compress in encoders.items():
+                sidecar = source + SIDECARS[coding]
+                if (
+                    os.path.exists(sidecar)
+                    and os.stat(sidecar).st_mtime_ns >= source_mtime
+                ):
+                    continue
+                if content is None:
+                    with open(source, mode="rb") as f:
+                        content = f.read()
+                compressed = compress(content)
+                if len(compressed) >= len(content):
+                    if os.path.exists(sidecar):
+                        os.remove(sidecar)
+                    continue
+                # written next to the sidecar and renamed so a running server never sees half a file
+                with open(sidecar + ".tmp", mode="wb") as f:
+                    f.write(compressed)
+                os.replace(sidecar + ".tmp", sidecar)
+                written += 1
+    return written
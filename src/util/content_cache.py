@@ -0,0 +1,118 @@
+from config import CONFIG
+from typing import Hashable
+from collections import OrderedDict
+
+
+class ContentCache:
+    """Byte-budgeted segmented LRU cache for static file contents.
+
+    New entries land in the probation segment and are only promoted to the
+    protected segment on their second hit, so a scan over many files that
+    are requested once can't push the hot set out. Every entry carries the
+    validator of the file it was read from (inode, mtime, size) and is
+    dropped when the file on disk no longer matches it.
+    """
+
+    __slots__ = (
+        "max_bytes",
+        "max_entry_bytes",
+        "_protected_max",
+        "_probation",
+        "_protected",
+        "_probation_bytes",
+        "_protected_bytes",
+        "hits",
+        "misses",
+        "evictions",
+        "invalidations",
+    )
+
+    # share of the budget reserved for entries that were hit more than once
+    PROTECTED_SHARE = 0.8
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self._protected_max = int(max_bytes * self.PROTECTED_SHARE)
+        # both map key -> (validator, content), least recently used first
+        self._probation: OrderedDict[Hashable, tuple[tuple, bytes]] = OrderedDict()
+        self._protected: OrderedDict[Hashable, tuple[tuple, bytes]] = OrderedDict()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._probation) + len(self._protected)
+
+    @property
+    def size(self) -> int:
+        return self._probation_bytes + self._protected_bytes
+
+    def get(self, key: Hashable, validator: tuple) -> bytes | None:
+        if key in self._protected:
+            entry = self._protected[key]
+            if entry[0] == validator:
+                self._protected.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._protected[key]
+            self._protected_bytes -= len(entry[1])
+            self.invalidations += 1
+        elif key in self._probation:
+            entry = self._probation.pop(key)
+            self._probation_bytes -= len(entry[1])
+            if entry[0] == validator:
+                self._promote(key, entry)
+                self.hits += 1
+                return entry[1]
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, validator: tuple, content: bytes) -> None:
+        if len(content) > self.max_entry_bytes or key in self._protected:
+            return
+        if key in self._probation:
+            self._probation_bytes -= len(self._probation.pop(key)[1])
+        self._probation[key] = (validator, content)
+        self._probation_bytes += len(content)
+        self._evict()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _promote(self, key: Hashable, entry: tuple[tuple, bytes]) -> None:
+        self._protected[key] = entry
+        self._protected_bytes += len(entry[1])
+        # the protected segment overflows into probation, not out of the cache
+        while self._protected_bytes > self._protected_max:
+            demoted_key, demoted = self._protected.popitem(last=False)
+            self._protected_bytes -= len(demoted[1])
+            self._probation[demoted_key] = demoted
+            self._probation_bytes += len(demoted[1])
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes:
+            segment = self._probation if self._probation else self._protected
+            _, (_, content) = segment.popitem(last=False)
+            if segment is self._probation:
+                self._probation_bytes -= len(content)
+            else:
+                self._protected_bytes -= len(content)
+            self.evictions += 1
+
+
+content_cache = ContentCache(
+    CONFIG.cache["max_bytes"], CONFIG.cache["max_entry_bytes"]
+)
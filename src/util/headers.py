@@ -0,0 +1,156 @@
+import re
+import time
+from email.utils import formatdate
+
+STATUS_OK = b"HTTP/1.1 200 OK\r\n"
+STATUS_PARTIAL_CONTENT = b"HTTP/1.1 206 Partial Content\r\n"
+STATUS_NOT_MODIFIED = b"HTTP/1.1 304 Not Modified\r\n"
+STATUS_RANGE_NOT_SATISFIABLE = b"HTTP/1.1 416 Range Not Satisfiable\r\n"
+
+# RFC 9110 section 5.6.2, field values may not contain CR, LF or NUL
+FIELD_NAME = re.compile(r"[!#$%&'*+.^_`|~0-9A-Za-z-]+")
+FIELD_VALUE = re.compile(r"[^\x00-\x08\x0a-\x1f\x7f]*")
+# fields that frame the request, a second copy is a smuggling attempt
+SINGLETON_FIELDS = {"host", "content-length", "transfer-encoding"}
+
+
+class DateCache:
+    """The Date header value, formatted at most once per second."""
+
+    __slots__ = ("_second", "_value")
+
+    def __init__(self) -> None:
+        self._second = -1
+        self._value = b""
+
+    def get(self) -> bytes:
+        now = int(time.time())
+        if now != self._second:
+            self._second = now
+            self._value = formatdate(now, usegmt=True).encode()
+        return self._value
+
+
+def content_headers(content_type: str, encoding: str) -> bytes:
+    headers = f"content-type: {content_type}\r\naccept-ranges: bytes\r\n"
+    if encoding != "identity":
+        headers += f"content-encoding: {encoding}\r\n"
+    return headers.encode("latin-1")
+
+
+def cache_headers(etag: str, last_modified: str, compressible: bool, negotiated: bool = False) -> bytes:
+    # everything a 304 has to repeat from the 200 it stands for, negotiated is set
+    # when the file shares its stem with other content types, see StaticIndex.negotiate
+    headers = f"Cache-Control: public, max-age=3600, must-revalidate\r\nETag: {etag}\r\nLast-Modified: {last_modified}\r\n"
+    vary = []
+    if negotiated:
+        vary.append("Accept")
+    if compressible:
+        vary.append("Accept-Encoding")
+    if vary:
+        headers += f"Vary: {', '.join(vary)}\r\n"
+    return headers.encode("latin-1")
+
+
+def response_head(
+    status: bytes, representation, date: bytes, content_length: int, extra: bytes = b""
+) -> bytes:
+    # the representation carries its header blocks pre-encoded,
+    # only the date and the length change between responses
+    return b"".join(
+        (
+            status,
+            representation.content_headers,
+            representation.cache_headers,
+            extra,
+            b"date: ",
+            date,
+            b"\r\ncontent-length: %d\r\n\r\n" % content_length,
+        )
+    )
+
+
+def not_modified_head(representation, date: bytes) -> bytes:
+    return b"".join(
+        (STATUS_NOT_MODIFIED, representation.cache_headers, b"date: ", date, b"\r\n\r\n")
+    )
+
+
+def content_range(start: int, end: int, size: int) -> bytes:
+    # end is exclusive here and inclusive on the wire
+    return b"content-range: bytes %d-%d/%d\r\n" % (start, end - 1, size)
+
+
+def multipart_head(representation, boundary: bytes, date: bytes, content_length: int) -> bytes:
+    # the representation's type moves into the parts, see multipart_part
+    return b"".join(
+        (
+            STATUS_PARTIAL_CONTENT,
+            b"content-type: multipart/byteranges; boundary=",
+            boundary,
+            b"\r\naccept-ranges: bytes\r\n",
+            representation.cache_headers,
+            b"date: ",
+            date,
+            b"\r\ncontent-length: %d\r\n\r\n" % content_length,
+        )
+    )
+
+
+def multipart_part(representation, boundary: bytes, start: int, end: int) -> bytes:
+    # the delimiter and headers in front of one part, RFC 9110 section 14.6
+    return b"".join(
+        (
+            b"\r\n--",
+            boundary,
+            b"\r\ncontent-type: ",
+            representation.content_type.encode("latin-1"),
+            b"\r\n",
+            content_range(start, end, representation.size),
+            b"\r\n",
+        )
+    )
+
+
+def range_not_satisfiable_head(representation, date: bytes) -> bytes:
+    return b"".join(
+        (
+            STATUS_RANGE_NOT_SATISFIABLE,
+            b"content-range: bytes */%d\r\n" % representation.size,
+            representation.cache_headers,
+            b"date: ",
+            date,
+            b"\r\ncontent-length: 0\r\n\r\n",
+        )
+    )
+
+
+def is_valid_request(header) -> bool:
+    # one pass over the fields with precompiled patterns
+    if not header:
+        return False
+    seen = set()
+    has_host = False
+    for name, value in header.raw_items():
+        if not FIELD_NAME.fullmatch(name) or not FIELD_VALUE.fullmatch(value):
+            return False
+        # helps mitigate some forms of request smuggling
+        if value.strip() != value:
+            return False
+        name = name.lower()
+        if name in SINGLETON_FIELDS:
+            if name in seen:
+                return False
+            seen.add(name)
+            if name == "host":
+                has_host = bool(value)
+            elif name == "content-length" and not value.isdigit():
+                return False
+            elif name == "transfer-encoding" and value.lower() != "chunked":
+                return False
+    if "content-length" in seen and "transfer-encoding" in seen:
+        return False
+    return has_host
+
+
+date_cache = DateCache()
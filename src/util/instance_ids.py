@@ -1,2 +0,0 @@
-write_instance_ids = {}
-read_instance_ids = {}
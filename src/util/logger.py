@@ -1,14 +1,210 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
 import logging as logger
+from logging.handlers import QueueHandler
 from config import CONFIG
-from datetime import datetime
-
-file_name = datetime.now().strftime("%Y-%m-%d")
-logger.basicConfig(
-    filename=CONFIG.location["log"] + f"/{file_name}.log",
-    encoding="utf-8",
-    filemode="a",
-    format="{asctime} - {levelname} - {message}",
-    style="{",
-    datefmt="%Y-%m-%d %H:%M",
-    level=logger.INFO,
+
+ACCESS_LOGGER = "severt.access"
+# records the writer thread takes off the queue per write
+BATCH_SIZE = 256
+# queued by BatchingWriter.stop(), the writer exits once everything in front of it is written
+STOP = object()
+
+# nothing in the formats below uses these, skipping them makes every record cheaper
+logger.logThreads = False
+logger.logProcesses = False
+logger.logMultiprocessing = False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the writer thread without ever blocking the event loop.
+
+    When the queue is full the record is counted and dropped, the writer
+    reports the count in the server log once it catches up.
+    """
+
+    def __init__(self, records: queue.Queue) -> None:
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logger.LogRecord) -> logger.LogRecord:
+        # formatting is left to the writer thread
+        return record
+
+    def enqueue(self, record: logger.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RotatingLogFile(logger.Handler):
+    """Appends to <prefix><date>.log, a new file every day, continued in
+    <prefix><date>.1.log, .2.log and so on whenever max_bytes is reached."""
+
+    def __init__(self, directory: str, prefix: str, max_bytes: int) -> None:
+        super().__init__()
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self._date = ""
+        self._part = 0
+        self._file = None
+
+    def emit(self, record: logger.LogRecord) -> None:
+        self.write_batch([record])
+
+    def write_batch(self, records: list[logger.LogRecord]) -> None:
+        if not records:
+            return
+        data = "".join(f"{self.format(record)}\n" for record in records).encode()
+        date = time.strftime("%Y-%m-%d")
+        if date != self._date:
+            self._open(date, 0)
+        # workers append to the same file, the offset the last write ended at
+        # includes theirs where a count of our own bytes wouldn't
+        elif self._file.tell() and self._file.tell() + len(data) > self.max_bytes:
+            self._open(date, self._part + 1)
+        # one write and one flush for the whole batch
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+        super().close()
+
+    def _open(self, date: str, part: int) -> None:
+        if self._file:
+            self._file.close()
+        while True:
+            suffix = f".{part}" if part else ""
+            path = os.path.join(self.directory, f"{self.prefix}{date}{suffix}.log")
+            # a restarted process continues in the last part that still has room
+            if not os.path.exists(path) or os.path.getsize(path) < self.max_bytes:
+                break
+            part += 1
+        self._file = open(path, "ab")
+        self._date = date
+        self._part = part
+
+
+class AccessFormatter(logger.Formatter):
+    def format(self, record: logger.LogRecord) -> str:
+        peer, method, path, status, size, duration = record.access
+        return json.dumps(
+            {
+                "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+                "peer": peer,
+                "method": method,
+                "path": path,
+                "status": status,
+                "bytes": size,
+                "duration_ms": round(duration * 1000, 3),
+            },
+            separators=(",", ":"),
+        )
+
+
+class BatchingWriter:
+    """The writer thread. Writes everything that is queued when it wakes up
+    in one go, so a busy server does one write per batch instead of one per
+    record."""
+
+    __slots__ = ("records", "handler", "files", "_reported", "_thread")
+
+    def __init__(self, records: queue.Queue, handler: DroppingQueueHandler, *files: RotatingLogFile) -> None:
+        self.records = records
+        self.handler = handler
+        self.files = files
+        self._reported = 0
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # returns once everything queued before it is written
+        if self._thread is None:
+            return
+        # waits for room when the queue is full, the record must not be dropped
+        self.records.put(STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        records = self.records
+        while True:
+            batch = [records.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = any(record is STOP for record in batch)
+            if stopping:
+                batch = [record for record in batch if record is not STOP]
+            if self.handler.dropped != self._reported:
+                warning = logger.makeLogRecord(
+                    {
+                        "levelno": logger.WARNING,
+                        "levelname": "WARNING",
+                        "msg": f"Log queue full, dropped {self.handler.dropped - self._reported} record(s).",
+                    }
+                )
+                batch.append(warning)
+                self._reported = self.handler.dropped
+            for file in self.files:
+                records_for_file = [record for record in batch if file.filter(record)]
+                try:
+                    file.write_batch(records_for_file)
+                except Exception:
+                    # a full disk loses this batch, not the writer
+                    file.handleError(records_for_file[0])
+            if stopping:
+                return
+
+
+def is_access(record: logger.LogRecord) -> bool:
+    return record.name == ACCESS_LOGGER
+
+
+settings = CONFIG.logging
+records: queue.Queue = queue.Queue(settings["queue_size"])
+queue_handler = DroppingQueueHandler(records)
+
+server_log = RotatingLogFile(CONFIG.location["log"], "", settings["max_bytes"])
+server_log.setFormatter(
+    logger.Formatter("{asctime} - {levelname} - {message}", "%Y-%m-%d %H:%M", style="{")
+)
+server_log.addFilter(lambda record: not is_access(record))
+access_log_file = RotatingLogFile(CONFIG.location["log"], "access-", settings["max_bytes"])
+access_log_file.setFormatter(AccessFormatter())
+access_log_file.addFilter(is_access)
+
+log_writer = BatchingWriter(records, queue_handler, server_log, access_log_file)
+logger.basicConfig(handlers=[queue_handler], level=logger.INFO)
+
+# a thread doesn't survive fork(), the writer is stopped around it and started again on both sides
+os.register_at_fork(
+    before=log_writer.stop,
+    after_in_parent=log_writer.start,
+    after_in_child=log_writer.start,
 )
+atexit.register(log_writer.stop)
+log_writer.start()
+
+
+def log_access(peer: str, method: str, path: str, status: int, size: int, duration: float) -> None:
+    """Queues one access log line, formatting and writing happen on the writer thread."""
+    if not settings["access_log"]:
+        return
+    record = logger.LogRecord(ACCESS_LOGGER, logger.INFO, "", 0, "", None, None)
+    record.access = (peer, method, path, status, size, duration)
+    queue_handler.enqueue(record)
@@ -0,0 +1,148 @@
+import os
+import mmap
+from config import CONFIG
+from collections import OrderedDict
+
+
+class MappedFile:
+    """A read-only shared mapping of one version of a static file.
+
+    Responses send memoryview slices of it and hold a reference until they
+    are written. The table holds one more, so a mapping that is dropped
+    from it because the file changed or it was evicted stays valid for the
+    responses still sending from it and is unmapped after the last one.
+    """
+
+    __slots__ = ("version", "view", "refs", "_mapping")
+
+    def __init__(self, version: tuple, mapping: mmap.mmap) -> None:
+        self.version = version
+        self.view = memoryview(mapping)
+        # the table's reference
+        self.refs = 1
+        self._mapping = mapping
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def acquire(self) -> "MappedFile":
+        self.refs += 1
+        return self
+
+    def release(self) -> None:
+        self.refs -= 1
+        if self.refs:
+            return
+        self.view.release()
+        try:
+            self._mapping.close()
+        except BufferError:
+            # a transport still buffers a slice, the mapping goes with the last of them
+            pass
+
+
+class MappedFiles:
+    """Memory-mapped static files too large for the content cache.
+
+    The pages of a MAP_SHARED mapping belong to the OS page cache, so every
+    worker that maps a file reads the same physical memory instead of
+    keeping its own copy, and filling an entry costs an mmap() call instead
+    of reading the whole file. Entries are keyed like the content cache and
+    replaced when the file's version changes; the least recently used are
+    unmapped once the mapped bytes pass max_bytes.
+
+    A file that is truncated in place while it is mapped makes reads past
+    its new end fault, static files should be replaced by renaming a new
+    file over them (which is what the static index expects anyway).
+    """
+
+    __slots__ = (
+        "max_bytes",
+        "max_entry_bytes",
+        "size",
+        "_files",
+        "hits",
+        "misses",
+        "evictions",
+        "invalidations",
+    )
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.size = 0
+        # key -> mapping, least recently used first
+        self._files: OrderedDict[str, MappedFile] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def get(self, full_path: str, version: tuple) -> MappedFile | None:
+        """A reference to the mapping of this version of the file, None when it isn't
+        mapped yet. The caller releases it once the response is written."""
+        mapped = self._files.get(full_path)
+        if mapped is not None:
+            if mapped.version == version:
+                self._files.move_to_end(full_path)
+                self.hits += 1
+                return mapped.acquire()
+            self._drop(full_path)
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    def add(self, full_path: str, mapped: MappedFile) -> MappedFile:
+        """Keeps a mapping made by map_file(), returns a reference for the caller."""
+        current = self._files.get(full_path)
+        if current is not None:
+            if current.version == mapped.version:
+                # mapped by two requests at once, the second mapping is dropped
+                mapped.release()
+                return current.acquire()
+            self._drop(full_path)
+            self.invalidations += 1
+        self._files[full_path] = mapped
+        self.size += len(mapped)
+        # acquired before evicting, a file larger than what's left must not be unmapped under us
+        mapped.acquire()
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self._files)))
+            self.evictions += 1
+        return mapped
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _drop(self, full_path: str) -> None:
+        mapped = self._files.pop(full_path)
+        self.size -= len(mapped)
+        mapped.release()
+
+
+def map_file(full_path: str, version: tuple) -> MappedFile | None:
+    """Maps the file when it is still the version the static index saw, only touches
+    the file so it can run on the blocking pool."""
+    with open(full_path, mode="rb") as file:
+        stat = os.fstat(file.fileno())
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != version or not stat.st_size:
+            # changed since the static index saw it, sent from the file until the index
+            # catches up so the body always matches the headers
+            return None
+        # the mapping keeps its own reference to the file, the descriptor is closed
+        return MappedFile(version, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+mapped_files = MappedFiles(
+    CONFIG.cache["mmap_max_bytes"], CONFIG.cache["mmap_max_entry_bytes"]
+)
@@ -0,0 +1,150 @@
+import mmap
+from bisect import bisect_left
+from config import CONFIG
+
+# upper bounds in seconds, the last bucket is +Inf
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+# statuses the server sends, anything else is counted as "other"
+STATUSES = (200, 202, 206, 304, 400, 404, 405, 413, 409, 416, 429, 431, 500, 503, 505)
+
+COUNTERS = {
+    "severt_response_bytes_total": "Bytes of responses written to sockets.",
+    "severt_loop_iterations_total": "Iterations of the selector loop.",
+    "severt_connections_total": "Accepted connections.",
+    "severt_http2_connections_total": "Connections that switched to HTTP/2.",
+    "severt_http2_streams_total": "Requests received on HTTP/2 streams.",
+    "severt_connections_rejected_total": "Connections answered with a 503 because listener.max_connections was reached.",
+    "severt_log_dropped_total": "Log records dropped because the log queue was full.",
+    "severt_cache_hits_total": "Content cache hits.",
+    "severt_cache_misses_total": "Content cache misses.",
+    "severt_cache_evictions_total": "Content cache evictions.",
+    "severt_cache_invalidations_total": "Content cache entries dropped because the file changed.",
+    "severt_mapped_hits_total": "Requests served from an existing file mapping.",
+    "severt_mapped_misses_total": "Requests that had to map their file.",
+    "severt_mapped_evictions_total": "File mappings dropped to stay within the mapped bytes budget.",
+    "severt_mapped_invalidations_total": "File mappings dropped because the file changed.",
+    "severt_pool_jobs_total": "Blocking file system jobs submitted to the thread pool.",
+    "severt_pool_inline_total": "Jobs run on the event loop because the pool's queue was full.",
+}
+GAUGES = {
+    "severt_open_connections": "Connections currently open.",
+    "severt_cache_entries": "Entries in the content cache.",
+    "severt_cache_bytes": "Bytes held by the content cache.",
+    "severt_mapped_files": "Files memory-mapped for serving.",
+    "severt_mapped_bytes": "Bytes of memory-mapped files, shared with the other workers.",
+    "severt_pool_queue_depth": "Jobs waiting for a thread of the blocking pool.",
+}
+# ContentCache.stats() keys to the metrics they are published as
+CACHE_STATS = {
+    "entries": "severt_cache_entries",
+    "bytes": "severt_cache_bytes",
+    "hits": "severt_cache_hits_total",
+    "misses": "severt_cache_misses_total",
+    "evictions": "severt_cache_evictions_total",
+    "invalidations": "severt_cache_invalidations_total",
+}
+# the same for MappedFiles.stats()
+MAPPED_STATS = {
+    "entries": "severt_mapped_files",
+    "bytes": "severt_mapped_bytes",
+    "hits": "severt_mapped_hits_total",
+    "misses": "severt_mapped_misses_total",
+    "evictions": "severt_mapped_evictions_total",
+    "invalidations": "severt_mapped_invalidations_total",
+}
+HISTOGRAMS = {
+    "severt_time_to_first_byte_seconds": "Time from a complete request to its first response byte.",
+    "severt_response_seconds": "Time from a complete request to its last response byte.",
+    "severt_pool_wait_seconds": "Time a blocking job waited for a thread of the pool.",
+}
+
+
+class Metrics:
+    """Counters, gauges and fixed-bucket histograms in a flat array of doubles.
+
+    The array lives in a shared anonymous mapping created before the
+    workers are forked. Every worker only writes its own region, so
+    recording is a single float add with no locking, and whichever worker
+    serves the endpoint sums all regions to report the whole server.
+    """
+
+    __slots__ = ("workers", "_slots", "_mapping", "_all", "_values", "_offsets")
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self._offsets: dict[str, int] = {}
+        index = 0
+        for status in STATUSES + ("other",):
+            self._offsets[f"status_{status}"] = index
+            index += 1
+        for name in (*COUNTERS, *GAUGES):
+            self._offsets[name] = index
+            index += 1
+        for name in HISTOGRAMS:
+            self._offsets[name] = index
+            # one slot per bucket plus +Inf, then the sum
+            index += len(LATENCY_BUCKETS) + 2
+        self._slots = index
+        self._mapping = mmap.mmap(-1, workers * self._slots * 8)
+        self._all = memoryview(self._mapping).cast("d")
+        self._values = self._all[: self._slots]
+
+    def bind(self, worker: int) -> None:
+        # a restarted worker keeps its counters but nothing it had open survived
+        self._values = self._all[worker * self._slots : (worker + 1) * self._slots]
+        self._values[self._offsets["severt_open_connections"]] = 0
+
+    def offset(self, name: str) -> int:
+        return self._offsets[name]
+
+    def inc(self, offset: int, amount: float = 1) -> None:
+        self._values[offset] += amount
+
+    def set(self, offset: int, value: float) -> None:
+        self._values[offset] = value
+
+    def count_status(self, status: int) -> None:
+        offset = self._offsets.get(f"status_{status}", self._offsets["status_other"])
+        self._values[offset] += 1
+
+    def observe(self, offset: int, seconds: float) -> None:
+        self._values[offset + bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self._values[offset + len(LATENCY_BUCKETS) + 1] += seconds
+
+    def render(self) -> bytes:
+        """Prometheus text exposition format, summed over every worker."""
+        totals = [0.0] * self._slots
+        for worker in range(self.workers):
+            region = self._all[worker * self._slots : (worker + 1) * self._slots]
+            for index, value in enumerate(region):
+                totals[index] += value
+        lines = [
+            "# HELP severt_requests_total Responses by status code.",
+            "# TYPE severt_requests_total counter",
+        ]
+        for status in STATUSES + ("other",):
+            lines.append(
+                f'severt_requests_total{{status="{status}"}} {totals[self._offsets[f"status_{status}"]]:.0f}'
+            )
+        for kind, metrics in (("counter", COUNTERS), ("gauge", GAUGES)):
+            for name, help_text in metrics.items():
+                lines += [
+                    f"# HELP {name} {help_text}",
+                    f"# TYPE {name} {kind}",
+                    f"{name} {totals[self._offsets[name]]:.0f}",
+                ]
+        for name, help_text in HISTOGRAMS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            offset = self._offsets[name]
+            cumulative = 0.0
+            for index, bound in enumerate(LATENCY_BUCKETS + ("+Inf",)):
+                cumulative += totals[offset + index]
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative:.0f}')
+            lines.append(f"{name}_sum {totals[offset + len(LATENCY_BUCKETS) + 1]}")
+            lines.append(f"{name}_count {cumulative:.0f}")
+        return ("\n".join(lines) + "\n").encode()
+
+
+metrics = Metrics(CONFIG.workers)
@@ -0,0 +1,31 @@
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class ObjectPool(Generic[T]):
+    """Free list of per-connection objects.
+
+    Objects are handed back once a connection has no more use for them and
+    the next connection that needs one gets it reset instead of building a
+    new one. At most `max_size` are kept, the rest is left to the GC.
+    """
+
+    __slots__ = ("_factory", "_reset", "_free", "max_size")
+
+    def __init__(self, factory: Callable[[], T], reset: Callable[[T], None], max_size: int = 256) -> None:
+        self._factory = factory
+        self._reset = reset
+        self._free: list[T] = []
+        self.max_size = max_size
+
+    def __len__(self) -> int:
+        return len(self._free)
+
+    def acquire(self) -> T:
+        return self._free.pop() if self._free else self._factory()
+
+    def release(self, item: T) -> None:
+        if len(self._free) < self.max_size:
+            self._reset(item)
+            self._free.append(item)
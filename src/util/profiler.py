@@ -0,0 +1,219 @@
+import os
+import math
+import time
+import pstats
+import signal
+import socket
+import cProfile
+import tracemalloc
+from io import StringIO
+from functools import partial
+from config import CONFIG
+from .logger import logger
+from .timer_wheel import TimerWheel
+from .blocking_pool import blocking_pool
+
+# what a session can collect, see Profiler
+PROFILE_KINDS = ("cpu", "memory", "phases")
+# request phases in the order they happen, total runs from the complete request to its last byte
+PHASES = ("parse", "negotiate", "read", "send", "total")
+# what each signal starts, in every worker when sent to the supervisor
+PROFILE_SIGNALS = {signal.SIGUSR1: ("cpu", "phases"), signal.SIGUSR2: ("memory",)}
+# samples kept per phase, a session on a busy server stops collecting past this
+MAX_SAMPLES = 1_000_000
+
+
+class Profiler:
+    """Profiles a running worker for a few seconds at a time, started by a
+    signal or through the admin endpoint (profiling.path).
+
+    A session can profile the event loop's thread with cProfile, diff two
+    tracemalloc snapshots taken at its start and end, and time the phases
+    of every request. The reports are written to the log directory when it
+    ends. Nothing is recorded between sessions, the request path only
+    checks the `timing` flag.
+    """
+
+    __slots__ = ("timing", "kinds", "_timers", "_cpu", "_snapshot", "_traced", "_samples", "_wakeup")
+
+    def __init__(self) -> None:
+        # read on the request path, True while a session times phases
+        self.timing = False
+        # what the running session collects, empty between sessions
+        self.kinds: tuple[str, ...] = ()
+        self._timers: TimerWheel | None = None
+        self._cpu: cProfile.Profile | None = None
+        self._snapshot: tracemalloc.Snapshot | None = None
+        # tracemalloc was started by the session and is stopped with it
+        self._traced = False
+        self._samples: dict[str, list[float]] = {}
+        self._wakeup: tuple[socket.socket, socket.socket] | None = None
+
+    def attach(self, timers: TimerWheel) -> None:
+        # sessions end on the worker's timer wheel
+        self._timers = timers
+
+    def watch_signals(self) -> int:
+        """Makes the signals in PROFILE_SIGNALS wake the selectors loop, returns the descriptor
+        to watch. on_signals() then starts the sessions on the loop's thread."""
+        self._wakeup = socket.socketpair()
+        for sock in self._wakeup:
+            sock.setblocking(False)
+        signal.set_wakeup_fd(self._wakeup[1].fileno())
+        for signum in PROFILE_SIGNALS:
+            # the wakeup byte does the work, a handler is still needed to not be killed
+            signal.signal(signum, lambda signum, frame: None)
+        return self._wakeup[0].fileno()
+
+    def on_signals(self) -> None:
+        try:
+            received = self._wakeup[0].recv(64)
+        except BlockingIOError:
+            return
+        for signum in received:
+            if signum in PROFILE_SIGNALS:
+                self.start(PROFILE_SIGNALS[signum])
+
+    def start(self, kinds: tuple[str, ...], seconds: float = 0) -> float:
+        """Starts a session collecting kinds, returns its length in seconds or 0 when
+        one is already running."""
+        if self.kinds:
+            logger.warning(f"Profiling {', '.join(self.kinds)} already, {', '.join(kinds)} not started.")
+            return 0
+        settings = CONFIG.profiling
+        seconds = min(seconds or settings["seconds"], settings["max_seconds"])
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError(f"profiling for {seconds} seconds")
+        self.kinds = kinds
+        # the stop is armed before anything is collected, a session never outlives its timer
+        try:
+            self._timers.schedule(time.monotonic() + seconds, partial(self.stop, time.time(), seconds))
+        except BaseException:
+            self.kinds = ()
+            raise
+        if "memory" in kinds:
+            self._traced = not tracemalloc.is_tracing()
+            if self._traced:
+                tracemalloc.start(settings["frames"])
+            self._snapshot = tracemalloc.take_snapshot()
+        if "phases" in kinds:
+            self._samples = {phase: [] for phase in PHASES}
+            self.timing = True
+        if "cpu" in kinds:
+            self._cpu = cProfile.Profile()
+            self._cpu.enable()
+        logger.info(f"Profiling {', '.join(kinds)} for {seconds:g}s.")
+        return seconds
+
+    def record(self, phase: str, seconds: float) -> None:
+        # called for every request while timing, "read" comes from the blocking pool's threads
+        # a file read that started during the session can finish after it
+        samples = self._samples.get(phase)
+        if samples is not None and len(samples) < MAX_SAMPLES:
+            samples.append(seconds)
+
+    def stop(self, started: float, seconds: float) -> None:
+        cpu, snapshot, samples = self._cpu, None, None
+        if cpu is not None:
+            cpu.disable()
+        if self._snapshot is not None:
+            snapshot = tracemalloc.take_snapshot()
+            if self._traced:
+                tracemalloc.stop()
+        if self.timing:
+            samples = self._samples
+        self.timing = False
+        self.kinds = ()
+        # the reports are rendered and written off the loop
+        blocking_pool.submit(
+            partial(_write_reports, started, seconds, cpu, self._snapshot, snapshot, samples),
+            _reports_written,
+        )
+        self._cpu = self._snapshot = None
+        self._samples = {}
+
+
+def _write_reports(
+    started: float,
+    seconds: float,
+    cpu: cProfile.Profile | None,
+    before: tracemalloc.Snapshot | None,
+    after: tracemalloc.Snapshot | None,
+    samples: dict[str, list[float]] | None,
+) -> list[str]:
+    # profile-<time>-<pid>.txt and .prof, memory-<time>-<pid>.txt
+    name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(started))}-{os.getpid()}"
+    directory = CONFIG.location["log"]
+    top = CONFIG.profiling["top"]
+    written = []
+    if cpu is not None or samples is not None:
+        report = StringIO()
+        report.write(f"Worker {os.getpid()}, {seconds:g}s from {time.ctime(started)}\n\n")
+        if samples is not None:
+            report.write(_phase_table(samples) + "\n")
+        if cpu is not None:
+            path = os.path.join(directory, f"profile-{name}.prof")
+            # for pstats, snakeviz and the like
+            cpu.dump_stats(path)
+            written.append(path)
+            stats = pstats.Stats(cpu, stream=report)
+            for order in ("tottime", "cumulative"):
+                report.write(f"Event loop by {order}, {top} functions:\n")
+                stats.sort_stats(order).print_stats(top)
+        path = os.path.join(directory, f"profile-{name}.txt")
+        with open(path, "w") as file:
+            file.write(report.getvalue())
+        written.append(path)
+    if after is not None:
+        ignored = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        )
+        diff = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "traceback")
+        lines = [
+            f"Worker {os.getpid()}, allocations over {seconds:g}s from {time.ctime(started)}",
+            f"{sum(stat.size_diff for stat in diff) / 1024:+.1f} KiB in "
+            f"{sum(stat.count_diff for stat in diff):+d} blocks, largest changes first:",
+            "",
+        ]
+        for stat in diff[:top]:
+            lines.append(
+                f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks "
+                f"{stat.size / 1024:10.1f} KiB now"
+            )
+            lines += [f"    {line}" for line in stat.traceback.format()]
+        path = os.path.join(directory, f"memory-{name}.txt")
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        written.append(path)
+    return written
+
+
+def _phase_table(samples: dict[str, list[float]]) -> str:
+    lines = [
+        f"{'phase':<10} {'count':>8} {'total ms':>10} {'mean ms':>9} "
+        f"{'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    ]
+    for phase in PHASES:
+        ordered = sorted(samples[phase])
+        if not ordered:
+            lines.append(f"{phase:<10} {0:>8}")
+            continue
+        total = sum(ordered)
+        lines.append(
+            f"{phase:<10} {len(ordered):>8} {total * 1000:>10.1f} {total / len(ordered) * 1000:>9.3f} "
+            f"{ordered[len(ordered) // 2] * 1000:>9.3f} "
+            f"{ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000:>9.3f} "
+            f"{ordered[-1] * 1000:>9.3f}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _reports_written(written: list[str] | None, error: BaseException | None) -> None:
+    if error is not None:
+        logger.error("ProfileReportError", exc_info=error)
+    else:
+        logger.info(f"Profile written to {', '.join(written)}.")
+
+
+profiler = Profiler()
@@ -0,0 +1,61 @@
+# more ranges than this in one request is treated as abuse and the header is ignored
+MAX_RANGES = 32
+
+
+def _is_digits(value: str) -> bool:
+    return value.isascii() and value.isdigit()
+
+
+def parse_range(value: str, size: int) -> list[tuple[int, int]] | None:
+    """Byte ranges of a Range header (RFC 9110 section 14.2) as [start, end) pairs.
+
+    Returns None when the header has to be ignored (another unit, bad syntax,
+    too many ranges) and an empty list when it is valid but no range overlaps
+    the representation, which is answered with a 416.
+    """
+    unit, sep, specs = value.partition("=")
+    if not sep or unit.strip().lower() != "bytes":
+        return None
+    specs = [spec.strip() for spec in specs.split(",")]
+    # empty list elements are allowed, a header with nothing else is not
+    specs = [spec for spec in specs if spec]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.partition("-")
+        first, last = first.strip(), last.strip()
+        if not dash:
+            return None
+        if not first:
+            # suffix range, the last N bytes
+            if not _is_digits(last):
+                return None
+            length = int(last)
+            if length and size:
+                ranges.append((max(0, size - length), size))
+            continue
+        if not _is_digits(first) or (last and not _is_digits(last)):
+            return None
+        start = int(first)
+        end = int(last) + 1 if last else size
+        if last and end <= start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size)))
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # ranges that overlap or touch are merged so no byte is sent twice,
+    # otherwise the order the client asked for is kept
+    ordered = sorted(ranges)
+    if all(ordered[i][1] < ordered[i + 1][0] for i in range(len(ordered) - 1)):
+        return ranges
+    merged = [ordered[0]]
+    for start, end in ordered[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
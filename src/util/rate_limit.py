@@ -0,0 +1,105 @@
+import time
+import ipaddress
+from config import CONFIG
+from typing import Hashable
+from collections import OrderedDict
+
+
+class TokenBucketTable:
+    """Token buckets for a bounded number of clients.
+
+    The table holds at most max_entries buckets and forgets the least
+    recently seen client first, so memory stays flat however many
+    (spoofed) addresses show up. A forgotten client starts over with a
+    full bucket, which only ever errs on the side of letting it through.
+    """
+
+    __slots__ = ("rate", "burst", "max_entries", "_buckets")
+
+    def __init__(self, rate: float, burst: float, max_entries: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_entries = max_entries
+        # key -> [tokens, monotonic time of the last refill]
+        self._buckets: OrderedDict[Hashable, list[float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: Hashable, now: float) -> float:
+        """Takes a token, returns 0 when there was one or else the seconds until there is."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_entries:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+
+class RateLimiter:
+    """Connection and request rate limits per client address and per
+    network (/24 for IPv4, /64 for IPv6), a client has to be within both."""
+
+    __slots__ = ("enabled", "_connections", "_requests")
+
+    def __init__(self, settings: dict) -> None:
+        self.enabled = settings["enabled"]
+        if self.enabled:
+            # a bucket that never refills or never holds a token would fail on the request path
+            for key, value in settings.items():
+                if key.endswith("_per_second") and not value > 0:
+                    raise ValueError(f"rate_limit.{key} must be above 0, not {value!r}")
+                if key.endswith("_burst") or key == "max_clients":
+                    if not value >= 1:
+                        raise ValueError(f"rate_limit.{key} must be at least 1, not {value!r}")
+        max_clients = settings["max_clients"]
+        self._connections = (
+            TokenBucketTable(
+                settings["connections_per_second"], settings["connection_burst"], max_clients
+            ),
+            TokenBucketTable(
+                settings["network_connections_per_second"],
+                settings["network_connection_burst"],
+                max_clients,
+            ),
+        )
+        self._requests = (
+            TokenBucketTable(
+                settings["requests_per_second"], settings["request_burst"], max_clients
+            ),
+            TokenBucketTable(
+                settings["network_requests_per_second"],
+                settings["network_request_burst"],
+                max_clients,
+            ),
+        )
+
+    def connection_delay(self, address: str) -> float:
+        return self._delay(self._connections, address) if self.enabled else 0.0
+
+    def request_delay(self, address: str) -> float:
+        return self._delay(self._requests, address) if self.enabled else 0.0
+
+    def _delay(self, tables: tuple[TokenBucketTable, TokenBucketTable], address: str) -> float:
+        now = time.monotonic()
+        client, network = tables
+        # a client over its own limit doesn't spend its neighbours' budget too
+        if delay := client.take(address, now):
+            return delay
+        return network.take(network_of(address), now)
+
+
+def network_of(address: str) -> str:
+    if ":" not in address:
+        return address.rpartition(".")[0]
+    return ipaddress.IPv6Address(address.partition("%")[0]).packed[:8].hex()
+
+
+rate_limiter = RateLimiter(CONFIG.rate_limit)
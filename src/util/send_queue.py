@@ -0,0 +1,58 @@
+from typing import Deque
+from itertools import islice
+from collections import deque
+
+
+class SendQueue:
+    """Outgoing bytes of a connection kept as memoryview segments.
+
+    A partial send moves an offset into the first segment instead of
+    copying whatever is left, and headers and body go out together through
+    a single sendmsg call.
+    """
+
+    __slots__ = ("_segments", "_offset", "_size")
+
+    # keeps each sendmsg call well below IOV_MAX
+    MAX_SEGMENTS = 64
+
+    def __init__(self) -> None:
+        self._segments: Deque[memoryview] = deque()
+        # bytes of the first segment that were already sent
+        self._offset = 0
+        # bytes left to send across all segments
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def append(self, data: bytes | memoryview) -> None:
+        if data:
+            self._segments.append(memoryview(data))
+            self._size += len(data)
+
+    def clear(self) -> None:
+        self._segments.clear()
+        self._offset = 0
+        self._size = 0
+
+    def send(self, sock, flags: int = 0) -> int:
+        buffers = [self._segments[0][self._offset :]]
+        buffers.extend(islice(self._segments, 1, self.MAX_SEGMENTS))
+        sent = sock.sendmsg(buffers, (), flags)
+        self._consume(sent)
+        return sent
+
+    def _consume(self, sent: int) -> None:
+        self._size -= sent
+        while sent:
+            left = len(self._segments[0]) - self._offset
+            if sent < left:
+                self._offset += sent
+                return
+            sent -= left
+            self._segments.popleft()
+            self._offset = 0
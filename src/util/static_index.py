@@ -0,0 +1,317 @@
+import os
+import time
+from typing import Iterator
+from config import CONFIG
+from email.utils import formatdate
+from .mime import mime_mapping
+from .validators import make_etag
+from .headers import content_headers, cache_headers
+from .compression import SIDECARS, preferred_encodings, is_compressible
+
+DEFAULT_TYPE = "application/octet-stream"
+
+
+class Representation:
+    """One file that can be sent for a resource, with everything the
+    response needs precomputed when the file is indexed."""
+
+    __slots__ = (
+        "full_path",
+        "content_type",
+        "encoding",
+        "size",
+        "mtime",
+        "version",
+        "etag",
+        "last_modified",
+        "content_headers",
+        "cache_headers",
+    )
+
+    def __init__(
+        self, full_path: str, content_type: str, encoding: str, stat: os.stat_result
+    ) -> None:
+        self.full_path = full_path
+        self.content_type = content_type
+        self.encoding = encoding
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        # a file replaced or modified on disk gets a new version
+        self.version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.etag = make_etag(stat)
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        # pre-encoded header blocks, a response only adds status, date and length
+        self.content_headers = content_headers(content_type, encoding)
+        self.cache_headers = cache_headers(
+            self.etag, self.last_modified, is_compressible(content_type)
+        )
+
+    def set_negotiated(self, negotiated: bool) -> None:
+        # the file may be sent for the urls of other types sharing its stem, caches have to key on Accept
+        self.cache_headers = cache_headers(
+            self.etag, self.last_modified, is_compressible(self.content_type), negotiated
+        )
+
+
+class StaticIndex:
+    """In-memory index of the static directory.
+
+    Maps every URL path to the file behind it, every path without its
+    extension (the stem) to the content types available for it and every
+    file to its precompressed sidecars, so negotiating a request is a few
+    dict lookups and never touches the filesystem.
+
+    refresh() updates the index incrementally. A scan stats every
+    directory and only lists and stats the files of the directories whose
+    mtime changed, which covers files that are added, removed or renamed
+    over. Files modified in place don't change their directory, those are
+    picked up by a full rescan every index.full_scan_interval seconds.
+    Scans compare the files with the index themselves, so apply() on the
+    event loop only costs as much as what changed.
+    """
+
+    __slots__ = ("root", "_files", "_stems", "_encoded", "_dirs", "_full_scanned")
+
+    # a directory modified less than this long before it was listed can still
+    # change within the same mtime tick, it is listed again on the next scan
+    RACY_NS = 1_000_000_000
+
+    def __init__(self, root: str) -> None:
+        self.root = root.rstrip("/")
+        # url path -> the file itself
+        self._files: dict[str, Representation] = {}
+        # url path without extension -> content type -> url path
+        self._stems: dict[str, dict[str, str]] = {}
+        # url path -> content-coding -> sidecar
+        self._encoded: dict[str, dict[str, Representation]] = {}
+        # url path of a directory, "" for the root -> (mtime when listed, subdirectory names, file url paths)
+        self._dirs: dict[str, tuple[int, tuple[str, ...], frozenset[str]]] = {}
+        self._full_scanned = 0.0
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def refresh(self) -> int:
+        """Brings the index in line with the directory, returns how many entries changed."""
+        return self.apply(self.scan())
+
+    def scan(self) -> tuple[dict, list[tuple[str, os.stat_result]], list[str]]:
+        """What changed on disk since the last scan: the new state of every
+        directory that was listed or is gone, the files to add or update and
+        the url paths to remove.
+
+        Only reads the file system and the index so it can run on the
+        blocking pool, the index is never applied to while a scan runs.
+        """
+        interval = CONFIG.index["full_scan_interval"]
+        now = time.monotonic()
+        full = not self._dirs or (interval and now - self._full_scanned >= interval)
+        if full:
+            self._full_scanned = now
+        dirs: dict[str, tuple | None] = {}
+        updated: list[tuple[str, os.stat_result]] = []
+        removed: list[str] = []
+        visited: set[str] = set()
+        pending = [("", self.root)]
+        while pending:
+            prefix, directory = pending.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                # removed since its parent was listed, the parent's next listing drops it
+                continue
+            visited.add(prefix)
+            known = self._dirs.get(prefix)
+            if not full and known is not None and known[0] == mtime:
+                subdirs = known[1]
+            else:
+                subdirs, urls = self._list(prefix, directory, updated)
+                if known is not None:
+                    removed += known[2] - urls
+                if time.time_ns() - mtime < self.RACY_NS:
+                    mtime = -1
+                dirs[prefix] = (mtime, subdirs, urls)
+            pending += [(f"{prefix}/{name}", f"{directory}/{name}") for name in subdirs]
+        for prefix in self._dirs.keys() - visited:
+            dirs[prefix] = None
+            removed += self._dirs[prefix][2]
+        return dirs, updated, removed
+
+    def apply(self, changes: tuple[dict, list[tuple[str, os.stat_result]], list[str]]) -> int:
+        # updates the entries found by scan(), returns how many changed
+        dirs, updated, removed = changes
+        for prefix, state in dirs.items():
+            if state is None:
+                self._dirs.pop(prefix, None)
+            else:
+                self._dirs[prefix] = state
+        for url, stat in updated:
+            self._add(url, stat)
+        changed = len(updated)
+        for url in removed:
+            if url in self._files:
+                self._remove(url)
+                changed += 1
+        return changed
+
+    def representations(self) -> Iterator[tuple[str, Representation]]:
+        # every file with its url path, sidecars included
+        return iter(self._files.items())
+
+    def variants(self, url: str) -> dict[str, Representation]:
+        # content-coding -> the file's precompressed sidecar
+        return dict(self._encoded.get(url, {}))
+
+    def types(self, stem: str) -> dict[str, str]:
+        # content type -> the url path negotiation picks for it among the files sharing stem
+        return dict(self._stems.get(stem, {}))
+
+    def negotiate(
+        self, path: str, accept: str | None, accept_encoding: str
+    ) -> Representation | None:
+        if path.endswith("/"):
+            path += "index.html"
+        url = self._negotiate_type(path, accept)
+        if url is None:
+            return None
+        if variants := self._encoded.get(url):
+            for encoding in preferred_encodings(accept_encoding):
+                if encoding == "identity":
+                    break
+                if encoding in variants:
+                    return variants[encoding]
+        return self._files[url]
+
+    def _negotiate_type(self, path: str, accept: str | None) -> str | None:
+        # files sharing a stem are representations of the same resource,
+        # /logo.png may be answered with /logo.webp when the client prefers it
+        stem, _ = os.path.splitext(path)
+        candidates = self._stems.get(stem)
+        if not accept or not candidates:
+            return path if path in self._files else None
+        ranges = parse_accept(accept)
+        best, best_score = None, None
+        for content_type, url in candidates.items():
+            qvalue, specificity = accept_quality(ranges, content_type)
+            # ties go to the more specific media range, then to the file that was asked for
+            score = (qvalue, specificity, url == path)
+            if qvalue > 0 and (best_score is None or score > best_score):
+                best, best_score = url, score
+        if best is None:
+            return path if path in self._files else None
+        return best
+
+    def _list(
+        self, prefix: str, directory: str, updated: list[tuple[str, os.stat_result]]
+    ) -> tuple[tuple[str, ...], frozenset[str]]:
+        # the directory's subdirectories and files, the files that aren't
+        # in the index in this version yet go to updated
+        subdirs, urls = [], set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                url = f"{prefix}/{entry.name}"
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    urls.add(url)
+                    current = self._files.get(url)
+                    if current is None or current.version != (
+                        stat.st_ino,
+                        stat.st_mtime_ns,
+                        stat.st_size,
+                    ):
+                        updated.append((url, stat))
+        return tuple(subdirs), frozenset(urls)
+
+    def _add(self, url: str, stat: os.stat_result) -> None:
+        full_path = self.root + url
+        stem, ext = os.path.splitext(url)
+        content_type = mime_mapping.get(ext.lower(), DEFAULT_TYPE)
+        self._files[url] = Representation(full_path, content_type, "identity", stat)
+        types = self._stems.setdefault(stem, {})
+        types[content_type] = url
+        if len(types) > 1:
+            self._mark_negotiated(stem)
+        for encoding, suffix in SIDECARS.items():
+            if url.endswith(suffix):
+                # the sidecar is served with the type of the file it compresses
+                base = url[: -len(suffix)]
+                _, base_ext = os.path.splitext(base)
+                base_type = mime_mapping.get(base_ext.lower(), DEFAULT_TYPE)
+                self._encoded.setdefault(base, {})[encoding] = Representation(
+                    full_path, base_type, encoding, stat
+                )
+                base_stem, _ = os.path.splitext(base)
+                if len(self._stems.get(base_stem, ())) > 1:
+                    self._mark_negotiated(base_stem)
+
+    def _mark_negotiated(self, stem: str) -> None:
+        # Accept picks among the files of a stem once it has more than one content type
+        types = self._stems.get(stem, {})
+        negotiated = len(types) > 1
+        for url in types.values():
+            if (representation := self._files.get(url)) is not None:
+                representation.set_negotiated(negotiated)
+            for variant in self._encoded.get(url, {}).values():
+                variant.set_negotiated(negotiated)
+
+    def _remove(self, url: str) -> None:
+        representation = self._files.pop(url)
+        stem, _ = os.path.splitext(url)
+        types = self._stems.get(stem, {})
+        if types.get(representation.content_type) == url:
+            del types[representation.content_type]
+            if not types:
+                del self._stems[stem]
+            elif len(types) == 1:
+                # the last other type went away
+                self._mark_negotiated(stem)
+        for encoding, suffix in SIDECARS.items():
+            if url.endswith(suffix):
+                variants = self._encoded.get(url[: -len(suffix)], {})
+                variants.pop(encoding, None)
+                if not variants:
+                    self._encoded.pop(url[: -len(suffix)], None)
+
+
+def parse_accept(accept: str) -> list[tuple[str, str, float]]:
+    # 'text/html,application/xml;q=0.9,*/*;q=0.8' -> [("text", "html", 1.0), ...]
+    ranges = []
+    for item in accept.split(","):
+        media_range, *params = item.split(";")
+        main_type, _, sub_type = media_range.strip().lower().partition("/")
+        qvalue = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        if main_type:
+            ranges.append((main_type, sub_type or "*", qvalue))
+    return ranges
+
+
+def accept_quality(
+    ranges: list[tuple[str, str, float]], content_type: str
+) -> tuple[float, int]:
+    # the most specific matching range decides the q-value, RFC 9110 section 12.5.1
+    main_type, _, sub_type = content_type.partition("/")
+    best = (0.0, -1)
+    for range_main, range_sub, qvalue in ranges:
+        if range_main == main_type and range_sub == sub_type:
+            specificity = 2
+        elif range_main == main_type and range_sub == "*":
+            specificity = 1
+        elif range_main == "*":
+            specificity = 0
+        else:
+            continue
+        if specificity > best[1]:
+            best = (qvalue, specificity)
+    return best[0], best[1]
+
+
+static_index = StaticIndex(CONFIG.location["static"])
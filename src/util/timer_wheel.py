@@ -0,0 +1,46 @@
+import time
+import heapq
+from math import ceil
+from typing import Callable
+
+
+class TimerWheel:
+    """Hashed timer wheel driving the select() timeout.
+
+    Timers are hashed into buckets by the tick they expire on and a heap
+    holds the ticks that have a bucket, so advancing only touches the
+    buckets that are due: the cost per tick is O(expired), not O(timers).
+    Timers are never cancelled, the callback decides whether the
+    connection it watches is still worth keeping.
+    """
+
+    __slots__ = ("resolution", "_buckets", "_ticks")
+
+    def __init__(self, resolution: float = 0.5) -> None:
+        self.resolution = resolution
+        self._buckets: dict[int, list[Callable[[], None]]] = {}
+        self._ticks: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def schedule(self, deadline: float, callback: Callable[[], None]) -> None:
+        # deadlines are monotonic timestamps, rounded up so a timer never fires early
+        tick = ceil(deadline / self.resolution)
+        if tick in self._buckets:
+            self._buckets[tick].append(callback)
+        else:
+            self._buckets[tick] = [callback]
+            heapq.heappush(self._ticks, tick)
+
+    def timeout(self) -> float | None:
+        # how long select() may block before the next bucket is due
+        if not self._ticks:
+            return None
+        return max(0.0, self._ticks[0] * self.resolution - time.monotonic())
+
+    def advance(self) -> None:
+        now_tick = int(time.monotonic() / self.resolution)
+        while self._ticks and self._ticks[0] <= now_tick:
+            for callback in self._buckets.pop(heapq.heappop(self._ticks)):
+                callback()
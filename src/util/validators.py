@@ -0,0 +1,34 @@
+import os
+from email.utils import parsedate_to_datetime
+
+
+def make_etag(stat: os.stat_result) -> str:
+    # size and mtime based like most servers, each sidecar is its own file
+    # so every content-coding of a resource gets a distinct strong etag
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    # If-None-Match uses the weak comparison and If-Range the strong one, RFC 9110 section 8.8.3.2
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        # an invalid date is ignored, RFC 9110 section 13.1.3
+        return False
+    # Last-Modified only has second precision
+    return int(mtime) <= since
+
@@ -0,0 +1,34 @@
+"""The service modules read severt.yml when they are imported, the tests get
+a config of their own pointing at a scratch directory before any of them is."""
+import os
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRATCH = Path(tempfile.mkdtemp(prefix="severt-tests-"))
+
+(SCRATCH / "static").mkdir()
+(SCRATCH / "log").mkdir()
+(SCRATCH / "severt.yml").write_text(
+    yaml.safe_dump(
+        {
+            "name": "severt-tests",
+            "location": {"static": str(SCRATCH / "static"), "log": str(SCRATCH / "log")},
+            "pool": {"threads": 0},
+            "logging": {"access_log": False},
+        }
+    )
+)
+os.environ["SEVERT_CONFIG"] = str(SCRATCH / "severt.yml")
+sys.path.insert(0, str(ROOT / "src"))
+
+
+def pytest_unconfigure(config) -> None:
+    # the log writer is stopped before its directory goes away
+    if (logger := sys.modules.get("util.logger")) is not None:
+        logger.log_writer.stop()
+    shutil.rmtree(SCRATCH, ignore_errors=True)
@@ -0,0 +1,110 @@
+import gzip
+
+import pytest
+
+from util.bundle import StaticBundle, open_bundle, pack_tree
+from util.static_index import StaticIndex
+
+FILES = {
+    "index.html": b"<!doctype html><p>home</p>\n" * 20,
+    "style.css": b"body { margin: 0 }\n" * 50,
+    "logo.png": b"\x89PNG fake image",
+    "logo.webp": b"RIFF fake webp",
+    "docs/index.html": b"<p>docs</p>\n",
+    # two files of the same type sharing a stem
+    "docs/page.htm": b"<p>htm</p>\n",
+    "docs/page.html": b"<p>html</p>\n",
+    "empty.txt": b"",
+    "café.txt": b"unicode name\n",
+}
+
+REQUESTS = [
+    ("/", None, ""),
+    ("/index.html", None, "gzip, br"),
+    ("/index.html", None, "identity"),
+    ("/style.css", "text/css", "gzip"),
+    ("/logo.png", None, ""),
+    ("/logo.png", "image/webp,image/*;q=0.8", ""),
+    ("/logo.png", "image/png", ""),
+    ("/docs/", None, "gzip"),
+    ("/docs/page.htm", None, ""),
+    ("/docs/page.html", None, ""),
+    ("/docs/page.html", "text/html", ""),
+    ("/docs/page.htm", "text/html", ""),
+    ("/empty.txt", None, ""),
+    ("/café.txt", None, ""),
+    ("/index.html.gz", None, ""),
+]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "static"
+    for name, content in FILES.items():
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(content)
+    (root / "index.html.gz").write_bytes(gzip.compress(FILES["index.html"], mtime=0))
+    (root / "style.css.gz").write_bytes(gzip.compress(FILES["style.css"], mtime=0))
+    return root
+
+
+@pytest.fixture
+def packed(tree, tmp_path):
+    path = str(tmp_path / "static.bundle")
+    assert pack_tree(str(tree), path) == len(FILES) + 2
+    bundle = StaticBundle(path)
+    bundle.refresh()
+    return bundle
+
+
+def body(representation) -> bytes:
+    if hasattr(representation, "bundle"):
+        view = representation.bundle.view
+        return bytes(view[representation.offset : representation.offset + representation.size])
+    with open(representation.full_path, mode="rb") as file:
+        return file.read()
+
+
+@pytest.mark.parametrize("path, accept, accept_encoding", REQUESTS)
+def test_bundle_negotiates_like_the_directory(tree, packed, path, accept, accept_encoding):
+    index = StaticIndex(str(tree))
+    index.refresh()
+    expected = index.negotiate(path, accept, accept_encoding)
+    found = packed.negotiate(path, accept, accept_encoding)
+    assert expected is not None and found is not None
+    for name in ("content_type", "encoding", "size", "etag", "last_modified", "cache_headers"):
+        assert getattr(found, name) == getattr(expected, name)
+    assert body(found) == body(expected)
+
+
+def test_lookups(packed):
+    assert len(packed) == len(FILES) + 2
+    assert packed.negotiate("/logo.png", "image/webp", "").content_type == "image/webp"
+    gzipped = packed.negotiate("/style.css", None, "gzip")
+    assert gzipped.encoding == "gzip"
+    assert gzip.decompress(body(gzipped)) == FILES["style.css"]
+    assert body(packed.negotiate("/docs/page.html", None, "")) == FILES["docs/page.html"]
+
+
+@pytest.mark.parametrize("path", ["/missing.html", "/docs/missing/", "/docs", "/style.css/"])
+def test_missing_paths(packed, path):
+    assert packed.negotiate(path, None, "gzip") is None
+    assert packed.negotiate(path, "*/*", "") is None
+
+
+def test_repacked_bundle_is_swapped_in(tree, packed):
+    (tree / "new.txt").write_bytes(b"new")
+    (tree / "style.css").unlink()
+    pack_tree(str(tree), packed.path)
+    assert packed.refresh() == len(FILES) + 2
+    assert body(packed.negotiate("/new.txt", None, "")) == b"new"
+    # the sidecar alone isn't served for the file it compresses
+    assert packed.negotiate("/style.css", None, "gzip") is None
+    assert packed.negotiate("/style.css.gz", None, "").encoding == "identity"
+
+
+def test_not_a_bundle(tmp_path):
+    path = tmp_path / "static.bundle"
+    path.write_bytes(b"NOTABUND" + bytes(64))
+    with pytest.raises(ValueError):
+        open_bundle(str(path))
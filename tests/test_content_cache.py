@@ -0,0 +1,79 @@
+from util.content_cache import ContentCache
+
+V1 = (1, 100, 10)
+V2 = (1, 200, 10)
+
+
+def test_hit_and_miss():
+    cache = ContentCache(100, 50)
+    assert cache.get("/a", V1) is None
+    cache.put("/a", V1, b"a" * 10)
+    assert cache.get("/a", V1) == b"a" * 10
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_over_the_entry_limit_are_not_kept():
+    cache = ContentCache(100, 10)
+    cache.put("/big", V1, b"b" * 11)
+    assert cache.get("/big", V1) is None
+    assert len(cache) == 0
+
+
+def test_stale_validator_invalidates_in_both_segments():
+    cache = ContentCache(100, 50)
+    cache.put("/a", V1, b"old")
+    assert cache.get("/a", V2) is None
+    assert len(cache) == 0
+    # the second hit promotes into the protected segment
+    cache.put("/b", V1, b"old")
+    assert cache.get("/b", V1) == b"old"
+    assert cache.get("/b", V2) is None
+    assert len(cache) == 0
+    assert cache.size == 0
+    assert cache.stats()["invalidations"] == 2
+    cache.put("/b", V2, b"new")
+    assert cache.get("/b", V2) == b"new"
+
+
+def test_byte_budget_evicts_least_recently_used_first():
+    cache = ContentCache(30, 10)
+    for key in ("/1", "/2", "/3"):
+        cache.put(key, V1, b"x" * 10)
+    cache.put("/4", V1, b"x" * 10)
+    assert cache.size == 30
+    assert cache.get("/1", V1) is None
+    assert all(cache.get(key, V1) for key in ("/2", "/3", "/4"))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_scan_of_one_hit_files_keeps_the_hot_set():
+    # 100 bytes, 80 of them protected
+    cache = ContentCache(100, 10)
+    for key in ("/hot1", "/hot2"):
+        cache.put(key, V1, b"h" * 10)
+        assert cache.get(key, V1)
+    for number in range(50):
+        cache.put(f"/scan{number}", V1, b"s" * 10)
+    assert cache.get("/hot1", V1) == b"h" * 10
+    assert cache.get("/hot2", V1) == b"h" * 10
+    assert cache.size <= 100
+
+
+def test_protected_overflow_is_demoted_not_dropped():
+    cache = ContentCache(100, 10)
+    for number in range(9):
+        cache.put(f"/{number}", V1, b"p" * 10)
+        assert cache.get(f"/{number}", V1)
+    # only 80 bytes fit in the protected segment, the oldest moved back to probation
+    assert len(cache) == 9
+    assert cache.size == 90
+    assert cache.get("/0", V1) == b"p" * 10
+
+
+def test_put_replaces_a_probation_entry_without_leaking_bytes():
+    cache = ContentCache(100, 50)
+    cache.put("/a", V1, b"a" * 10)
+    cache.put("/a", V2, b"a" * 20)
+    assert cache.size == 20
+    assert cache.get("/a", V2) == b"a" * 20
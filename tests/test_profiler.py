@@ -0,0 +1,31 @@
+import math
+
+import pytest
+
+from util.profiler import Profiler
+from util.timer_wheel import TimerWheel
+
+
+class FailingTimers(TimerWheel):
+    def schedule(self, deadline, callback):
+        raise RuntimeError("no timer")
+
+
+@pytest.mark.parametrize("seconds", [math.nan, -1.0])
+def test_bad_length_starts_nothing(seconds):
+    profiler = Profiler()
+    profiler.attach(TimerWheel())
+    with pytest.raises(ValueError):
+        profiler.start(("cpu", "phases"), seconds)
+    assert profiler.kinds == ()
+    assert not profiler.timing
+    assert profiler.start(("phases",), 1) == 1
+
+
+def test_nothing_is_collected_without_a_stop_timer():
+    profiler = Profiler()
+    profiler.attach(FailingTimers())
+    with pytest.raises(RuntimeError):
+        profiler.start(("cpu", "phases"), 1)
+    assert profiler.kinds == ()
+    assert not profiler.timing
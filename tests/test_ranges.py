@@ -0,0 +1,75 @@
+import pytest
+
+from util.ranges import parse_range, MAX_RANGES
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("bytes=0-99", [(0, 100)]),
+        ("bytes=100-", [(100, 1000)]),
+        ("bytes=-100", [(900, 1000)]),
+        # past the end is clipped to the representation
+        ("bytes=900-5000", [(900, 1000)]),
+        ("bytes=-5000", [(0, 1000)]),
+        ("BYTES = 0-0", [(0, 1)]),
+        ("bytes= 0-9 , , 20-29", [(0, 10), (20, 30)]),
+        # the order asked for is kept when nothing overlaps
+        ("bytes=500-599,0-99", [(500, 600), (0, 100)]),
+        # overlapping and touching ranges are merged
+        ("bytes=0-99,50-149", [(0, 150)]),
+        ("bytes=100-199,0-99", [(0, 200)]),
+        ("bytes=0-9,900-,-50", [(0, 10), (900, 1000)]),
+    ],
+)
+def test_satisfiable(value, expected):
+    assert parse_range(value, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "bytes=1000-",
+        "bytes=2000-3000",
+        "bytes=-0",
+        "bytes=1000-1999,5000-",
+    ],
+)
+def test_unsatisfiable(value):
+    assert parse_range(value, 1000) == []
+
+
+def test_empty_representation():
+    assert parse_range("bytes=0-", 0) == []
+    assert parse_range("bytes=-10", 0) == []
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "items=0-9",
+        "bytes",
+        "bytes=",
+        "bytes=,",
+        "bytes=5",
+        "bytes=a-9",
+        "bytes=0-b",
+        "bytes=--5",
+        "bytes=-",
+        "bytes=+1-5",
+        "bytes=0x1-5",
+        # digits outside ascii are not byte offsets
+        "bytes=١-5",
+        # end before start makes the whole header invalid
+        "bytes=10-5",
+        "bytes=0-9,10-5",
+    ],
+)
+def test_ignored(value):
+    assert parse_range(value, 1000) is None
+
+
+def test_too_many_ranges_are_ignored():
+    allowed = ",".join(f"{i * 10}-{i * 10}" for i in range(MAX_RANGES))
+    assert len(parse_range("bytes=" + allowed, 1000)) == MAX_RANGES
+    assert parse_range("bytes=" + allowed + ",999-999", 1000) is None
@@ -0,0 +1,104 @@
+import pytest
+
+from config import DEFAULT_RATE_LIMIT
+from util.rate_limit import TokenBucketTable, RateLimiter, network_of
+
+
+def test_burst_then_refill():
+    table = TokenBucketTable(rate=2, burst=3, max_entries=10)
+    assert [table.take("a", 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert table.take("a", 0.0) == pytest.approx(0.5)
+    # half a second at two tokens a second refills one
+    assert table.take("a", 0.5) == 0.0
+    assert table.take("a", 0.5) == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_the_burst():
+    table = TokenBucketTable(rate=10, burst=2, max_entries=10)
+    table.take("a", 0.0)
+    assert [table.take("a", 100.0) for _ in range(3)][-1] > 0
+
+
+def test_a_denied_take_costs_nothing():
+    table = TokenBucketTable(rate=1, burst=1, max_entries=10)
+    assert table.take("a", 0.0) == 0.0
+    for _ in range(10):
+        assert table.take("a", 0.0) == pytest.approx(1.0)
+    assert table.take("a", 1.0) == 0.0
+
+
+def test_clients_have_their_own_buckets():
+    table = TokenBucketTable(rate=1, burst=1, max_entries=10)
+    assert table.take("a", 0.0) == 0.0
+    assert table.take("a", 0.0) > 0
+    assert table.take("b", 0.0) == 0.0
+
+
+def test_least_recently_seen_client_is_forgotten():
+    table = TokenBucketTable(rate=1, burst=1, max_entries=2)
+    table.take("a", 0.0)
+    table.take("b", 0.0)
+    # seeing a again makes b the oldest
+    table.take("a", 0.0)
+    table.take("c", 0.0)
+    assert len(table) == 2
+    # a is still known and empty, b starts over with a full bucket
+    assert table.take("a", 0.0) > 0
+    assert table.take("b", 0.0) == 0.0
+
+
+def test_network_of():
+    assert network_of("192.0.2.17") == network_of("192.0.2.200") == "192.0.2"
+    assert network_of("192.0.2.17") != network_of("192.0.3.17")
+    assert network_of("2001:db8::1") == network_of("2001:db8:0:0:ffff::2%eth0")
+    assert network_of("2001:db8::1") != network_of("2001:db8:0:1::1")
+
+
+def limiter(**settings) -> RateLimiter:
+    return RateLimiter({**DEFAULT_RATE_LIMIT, "enabled": True, **settings})
+
+
+def test_disabled_never_delays():
+    rate_limiter = RateLimiter({**DEFAULT_RATE_LIMIT, "request_burst": 1, "requests_per_second": 0.001})
+    assert all(rate_limiter.request_delay("192.0.2.1") == 0.0 for _ in range(10))
+
+
+def test_denied_client_leaves_its_network_budget_alone():
+    rate_limiter = limiter(
+        requests_per_second=0.001,
+        request_burst=2,
+        network_requests_per_second=0.001,
+        network_request_burst=4,
+    )
+    abuser, neighbour = "192.0.2.1", "192.0.2.2"
+    assert [rate_limiter.request_delay(abuser) for _ in range(2)] == [0.0, 0.0]
+    for _ in range(100):
+        assert rate_limiter.request_delay(abuser) > 0
+    assert [rate_limiter.request_delay(neighbour) for _ in range(2)] == [0.0, 0.0]
+    # the network is spent now, a third address on it has to wait
+    assert rate_limiter.request_delay("192.0.2.3") > 0
+    assert rate_limiter.request_delay("198.51.100.1") == 0.0
+
+
+def test_connections_and_requests_are_limited_apart():
+    rate_limiter = limiter(connections_per_second=0.001, connection_burst=1)
+    assert rate_limiter.connection_delay("192.0.2.1") == 0.0
+    assert rate_limiter.connection_delay("192.0.2.1") > 0
+    assert rate_limiter.request_delay("192.0.2.1") == 0.0
+
+
+@pytest.mark.parametrize(
+    "key, value",
+    [
+        ("requests_per_second", 0),
+        ("network_connections_per_second", -1),
+        ("connection_burst", 0),
+        ("network_request_burst", 0.5),
+        ("max_clients", 0),
+    ],
+)
+def test_settings_that_could_never_pass_are_rejected(key, value):
+    with pytest.raises(ValueError, match=f"rate_limit.{key}"):
+        limiter(**{key: value})
+    # nothing is checked while rate limiting is off
+    RateLimiter({**DEFAULT_RATE_LIMIT, key: value})
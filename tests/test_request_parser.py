@@ -0,0 +1,135 @@
+import pytest
+
+from service.request_parser import RequestParser, RequestError
+
+
+def parse(*reads: bytes, header_bytes: int = 8192, body_bytes: int = 1024) -> list:
+    parser = RequestParser(header_bytes, body_bytes)
+    requests = []
+    for data in reads:
+        requests += parser.feed(data)
+    return requests
+
+
+def test_simple_request():
+    (request,) = parse(b"GET /index.html HTTP/1.1\r\nHost: example.com\r\nAccept: */*\r\n\r\n")
+    assert request["Method"] == "GET"
+    assert request["Location"] == "/index.html"
+    assert request["Host"] == "example.com"
+    assert request["Accept"] == "*/*"
+    assert not request.get_payload()
+
+
+def test_request_split_across_reads():
+    raw = b"GET /a HTTP/1.1\r\nHost: x\r\n\r\n"
+    # every split point, the header end delimiter included
+    for cut in range(1, len(raw)):
+        (request,) = parse(raw[:cut], raw[cut:])
+        assert request["Location"] == "/a"
+
+
+def test_byte_at_a_time():
+    raw = b"POST /form HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nhello"
+    (request,) = parse(*(raw[i : i + 1] for i in range(len(raw))))
+    assert request.get_payload() == "hello"
+
+
+def test_pipelined_requests_in_order():
+    requests = parse(
+        b"GET /1 HTTP/1.1\r\nHost: x\r\n\r\n"
+        b"POST /2 HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\n\r\nabc"
+        b"GET /3 HTTP/1.1\r\nHost: x\r\n\r\n"
+    )
+    assert [request["Location"] for request in requests] == ["/1", "/2", "/3"]
+    assert requests[1].get_payload() == "abc"
+
+
+def test_partial_request_stays_in_progress():
+    parser = RequestParser(8192, 1024)
+    assert list(parser.feed(b"GET /1 HTTP/1.1\r\nHost: x\r\n\r\nGET /2 HT")) != []
+    assert parser.in_progress
+    (request,) = parser.feed(b"TP/1.1\r\nHost: x\r\n\r\n")
+    assert request["Location"] == "/2"
+    assert not parser.in_progress
+
+
+def test_chunked_body_with_extensions_and_trailers():
+    (request,) = parse(
+        b"POST /upload HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"5;name=value\r\nhello\r\n",
+        b"6\r\n world\r\n0\r\nExpires: never\r\n\r\n",
+    )
+    assert request.get_payload() == "hello world"
+
+
+def test_chunked_then_pipelined():
+    requests = parse(
+        b"POST /a HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\n"
+        b"GET /b HTTP/1.1\r\nHost: x\r\n\r\n"
+    )
+    assert [request["Location"] for request in requests] == ["/a", "/b"]
+
+
+@pytest.mark.parametrize(
+    "raw, status",
+    [
+        # both framings at once is a request smuggling vector
+        (
+            b"POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\nTransfer-Encoding: chunked\r\n\r\n",
+            "400 Bad Request",
+        ),
+        (b"POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: gzip, chunked\r\n\r\n", "400 Bad Request"),
+        (b"POST / HTTP/1.1\r\nHost: x\r\nContent-Length: -1\r\n\r\n", "400 Bad Request"),
+        (b"POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 1e3\r\n\r\n", "400 Bad Request"),
+        # obsolete line folding
+        (b"GET / HTTP/1.1\r\nHost: x\r\n folded\r\n\r\n", "400 Bad Request"),
+        (b"GET / HTTP/1.1\r\nno colon\r\n\r\n", "400 Bad Request"),
+        (b"GET /\r\nHost: x\r\n\r\n", "400 Bad Request"),
+        (b"GET / HTTP/2.0\r\nHost: x\r\n\r\n", "505 HTTP Version Not Supported"),
+        (b"POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 2000\r\n\r\n", "413 Content Too Large"),
+        (
+            b"POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+            "400 Bad Request",
+        ),
+        (
+            b"POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n801\r\n",
+            "413 Content Too Large",
+        ),
+        # chunk data longer than its size
+        (
+            b"POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n1\r\nab\r\n",
+            "400 Bad Request",
+        ),
+    ],
+)
+def test_rejected(raw, status):
+    with pytest.raises(RequestError) as error:
+        parse(raw)
+    assert error.value.status == status
+
+
+def test_header_limit():
+    with pytest.raises(RequestError) as error:
+        parse(b"GET / HTTP/1.1\r\nHost: x\r\nX-Big: " + b"a" * 200, header_bytes=128)
+    assert error.value.status == "431 Request Header Fields Too Large"
+    with pytest.raises(RequestError):
+        parse(b"GET / HTTP/1.1\r\nX-Big: " + b"a" * 200 + b"\r\n\r\n", header_bytes=128)
+
+
+def test_metadata_names_cannot_be_smuggled():
+    (request,) = parse(
+        b"GET /real HTTP/1.1\r\nHost: x\r\nLocation: /etc/passwd\r\nMethod: DELETE\r\nError: 200 OK\r\n\r\n"
+    )
+    assert request["Location"] == "/real"
+    assert request["Method"] == "GET"
+    assert request.get_all("Location") == ["/real"]
+    assert request.get("Error") is None
+
+
+def test_reset_clears_a_partial_request():
+    parser = RequestParser(8192, 1024)
+    assert not list(parser.feed(b"GET /half HTTP/1.1\r\nHo"))
+    parser.reset()
+    assert not parser.in_progress
+    (request,) = parser.feed(b"GET /whole HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert request["Location"] == "/whole"
@@ -0,0 +1,61 @@
+import gzip
+
+from util.headers import response_head
+from util.static_index import StaticIndex
+
+
+def vary(representation) -> list[bytes]:
+    return [
+        line for line in representation.cache_headers.split(b"\r\n") if line.startswith(b"Vary:")
+    ]
+
+
+def index_of(tmp_path, files: dict[str, bytes]) -> StaticIndex:
+    for name, content in files.items():
+        (tmp_path / name).write_bytes(content)
+    index = StaticIndex(str(tmp_path))
+    index.refresh()
+    return index
+
+
+def test_vary_on_accept_when_a_stem_has_several_types(tmp_path):
+    index = index_of(
+        tmp_path,
+        {
+            "logo.png": b"png",
+            "logo.webp": b"webp",
+            "page.html": b"html",
+            "page.html.gz": b"gz",
+            "page.json": b"{}",
+        },
+    )
+    webp = index.negotiate("/logo.png", "image/webp,*/*", "")
+    assert webp.content_type == "image/webp"
+    assert vary(webp) == [b"Vary: Accept"]
+    assert vary(index.negotiate("/logo.png", None, "")) == [b"Vary: Accept"]
+    html = index.negotiate("/page.html", "text/html", "")
+    assert vary(html) == [b"Vary: Accept, Accept-Encoding"]
+    gzipped = index.negotiate("/page.html", "text/html", "gzip")
+    assert gzipped.encoding == "gzip"
+    assert vary(gzipped) == [b"Vary: Accept, Accept-Encoding"]
+    # the header goes out with the response
+    assert b"\r\nVary: Accept\r\n" in response_head(b"HTTP/1.1 200 OK\r\n", webp, b"now", 4)
+
+
+def test_vary_follows_the_files_of_a_stem(tmp_path):
+    index = index_of(tmp_path, {"logo.png": b"png", "style.css": b"body {}"})
+    assert vary(index.negotiate("/logo.png", None, "")) == []
+    assert vary(index.negotiate("/style.css", None, "")) == [b"Vary: Accept-Encoding"]
+    (tmp_path / "logo.webp").write_bytes(b"webp")
+    index.refresh()
+    assert vary(index.negotiate("/logo.png", None, "")) == [b"Vary: Accept"]
+    (tmp_path / "logo.webp").unlink()
+    index.refresh()
+    assert vary(index.negotiate("/logo.png", None, "")) == []
+
+
+def test_sidecar_added_to_a_negotiated_stem(tmp_path):
+    index = index_of(tmp_path, {"page.html": b"html", "page.json": b"{}"})
+    (tmp_path / "page.html.gz").write_bytes(gzip.compress(b"html", mtime=0))
+    index.refresh()
+    assert vary(index.negotiate("/page.html", None, "gzip")) == [b"Vary: Accept, Accept-Encoding"]